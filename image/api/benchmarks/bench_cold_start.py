@@ -0,0 +1,79 @@
+"""
+Measures the Lambda cold start of the Mangum handler.
+
+Every run starts a fresh interpreter that imports ``main`` and then sends one
+API Gateway (HTTP API) event for ``--path`` through ``main.handler``, the way
+Lambda's first invocation would. Import time, first invocation time and total
+process time are reported. Run from image/api:
+
+    python -m benchmarks.bench_cold_start --runs 10
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_rag import percentile
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+event = {
+    "version": "2.0",
+    "routeKey": "$default",
+    "rawPath": sys.argv[1],
+    "rawQueryString": "",
+    "headers": {"host": "localhost"},
+    "requestContext": {
+        "http": {"method": "GET", "path": sys.argv[1], "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1"},
+        "stage": "$default",
+    },
+    "isBase64Encoded": False,
+}
+response = main.handler(event, None)
+invoked = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "invoke_s": invoked - imported,
+    "status": response["statusCode"],
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def run_once(path: str) -> dict:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", PROBE, path], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start probe failed:\n{result.stderr[-2000:]}")
+    return {**json.loads(result.stdout.strip().splitlines()[-1]), "process_s": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default="/health/1")
+    parser.add_argument("--output", default="bench_cold_start.json")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    result = {"runs": args.runs, "path": args.path, "modules": runs[-1]["modules"], "status": runs[-1]["status"]}
+    for key in ("import_s", "invoke_s", "process_s"):
+        samples = [run[key] for run in runs]
+        name = key[:-2]
+        result[f"{name}_p50_ms"] = percentile(samples, 50)
+        result[f"{name}_p95_ms"] = percentile(samples, 95)
+    print(
+        f"import p50 {result['import_p50_ms']:.0f} ms, first invoke p50 {result['invoke_p50_ms']:.0f} ms, "
+        f"process p50 {result['process_p50_ms']:.0f} ms, {result['modules']} modules loaded"
+    )
+    with open(args.output, "w") as f:
+        json.dump({"benchmark": "cold_start", "results": [result]}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Measures /query throughput and latency against the fake LLM provider.
+
+The app is served by an in-process uvicorn on a loopback port, so neither a model
+nor the network is needed and streamed answers arrive piece by piece (httpx's ASGI
+transport would buffer them). Each concurrency level sends ``--requests`` queries
+with distinct prompts (unless ``--same-prompt``) and the cache bypassed. Run from
+image/api:
+
+    python -m benchmarks.bench_query --concurrency 1 8 32 --requests 200 --stream
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import Counter
+
+from benchmarks.bench_rag import percentile
+
+
+def configure(args):
+    # Read by the app's modules at import time, so set before importing main
+    os.environ.update({
+        "FAKE_LLM_ENABLED": "true",
+        "FAKE_LLM_LATENCY": str(args.latency),
+        "FAKE_LLM_TOKEN_RATE": str(args.token_rate),
+        "FAKE_LLM_TOKENS": str(args.tokens),
+        "SCHEDULER_WORKERS_FAKE": str(args.workers),
+        "LLM_CONCURRENCY_FAKE": str(args.workers),
+        "SCHEDULER_MAX_DEPTH": str(args.max_depth),
+        "CACHE_BACKEND": "memory",
+    })
+
+
+async def send(client, payload: dict, stream: bool) -> tuple[int, float, float | None]:
+    start = time.perf_counter()
+    if not stream:
+        response = await client.post("/query/", json=payload)
+        return response.status_code, time.perf_counter() - start, None
+    first = None
+    status = 200
+    async with client.stream("POST", "/query/stream", json=payload) as response:
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                if event == "error":
+                    status = json.loads(line[len("data:"):])["status"]
+                elif event is None and first is None:
+                    first = time.perf_counter() - start
+            elif not line:
+                event = None
+    return status, time.perf_counter() - start, first
+
+
+async def run_level(client, args, concurrency: int) -> dict:
+    pending = iter(range(args.requests))
+    latencies, first_tokens, statuses = [], [], Counter()
+
+    async def worker():
+        for i in pending:
+            payload = {
+                "content": "benchmark prompt" if args.same_prompt else f"benchmark prompt {concurrency}-{i}",
+                "llm": "fake",
+                "model": "bench",
+                "bypass_cache": True,
+            }
+            status, latency, first = await send(client, payload, args.stream)
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(latency)
+                if first is not None:
+                    first_tokens.append(first)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) if latencies else None,
+        "p95_ms": percentile(latencies, 95) if latencies else None,
+        "p99_ms": percentile(latencies, 99) if latencies else None,
+    }
+    if args.stream:
+        result["ttft_p50_ms"] = percentile(first_tokens, 50) if first_tokens else None
+        result["ttft_p95_ms"] = percentile(first_tokens, 95) if first_tokens else None
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run(args) -> list[dict]:
+    import httpx
+    import uvicorn
+    from main import app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            await serving # Surfaces the startup error
+            raise RuntimeError("uvicorn exited before it started serving")
+        await asyncio.sleep(0.01)
+
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            for concurrency in args.concurrency:
+                result = await run_level(client, args, concurrency)
+                print(
+                    f"{concurrency:>4} concurrent: {result['throughput_rps']:.1f} req/s, "
+                    f"p50 {result['p50_ms'] or 0:.0f} ms, p95 {result['p95_ms'] or 0:.0f} ms, "
+                    f"p99 {result['p99_ms'] or 0:.0f} ms, statuses {result['statuses']}"
+                )
+                results.append(result)
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--stream", action="store_true", help="Use /query/stream and report time to first token")
+    parser.add_argument("--same-prompt", action="store_true", help="Send one prompt so concurrent requests coalesce")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model seconds to first token")
+    parser.add_argument("--token-rate", type=float, default=50, help="Fake model tokens per second")
+    parser.add_argument("--tokens", type=int, default=64, help="Fake model tokens per answer")
+    parser.add_argument("--workers", type=int, default=8, help="Scheduler slots for the fake provider")
+    parser.add_argument("--max-depth", type=int, default=1000, help="Scheduler queue depth")
+    parser.add_argument("--output", default="bench_query.json")
+    args = parser.parse_args()
+
+    configure(args)
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump({
+            "benchmark": "query_stream" if args.stream else "query",
+            "config": {
+                "latency": args.latency,
+                "token_rate": args.token_rate,
+                "tokens": args.tokens,
+                "workers": args.workers,
+                "same_prompt": args.same_prompt,
+            },
+            "results": results,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures retrieval latency of the RAG vector index against index size.
+
+Random unit vectors stand in for embeddings, so no embedding model is needed.
+Run from image/api:
+
+    python -m benchmarks.bench_rag --sizes 1000 10000 100000 --dim 768
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from util.rag_utils import VectorIndex
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    return float(np.percentile(samples, pct)) * 1000
+
+
+def bench_size(size: int, dim: int, queries: int, k: int, rng: np.random.Generator) -> dict:
+    with tempfile.TemporaryDirectory() as path:
+        index = VectorIndex(path)
+        start = time.perf_counter()
+        batch = 10000
+        for offset in range(0, size, batch):
+            count = min(batch, size - offset)
+            vectors = rng.normal(size=(count, dim)).astype(np.float32)
+            index.add(f"doc-{offset}", "bench", [f"chunk {offset + i}" for i in range(count)], vectors, save=False)
+        index.flush()
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reopened = VectorIndex(path)
+        open_time = time.perf_counter() - start
+
+        samples = []
+        for _ in range(queries):
+            query = rng.normal(size=dim)
+            start = time.perf_counter()
+            reopened.search(query, k)
+            samples.append(time.perf_counter() - start)
+
+    return {
+        "size": size,
+        "dim": dim,
+        "k": k,
+        "build_s": build,
+        "open_ms": open_time * 1000,
+        "search_p50_ms": percentile(samples, 50),
+        "search_p95_ms": percentile(samples, 95),
+        "search_p99_ms": percentile(samples, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--output", default="bench_rag.json")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    for size in args.sizes:
+        result = bench_size(size, args.dim, args.queries, args.k, rng)
+        print(
+            f"{size:>8} chunks: open {result['open_ms']:.1f} ms, "
+            f"search p50 {result['search_p50_ms']:.2f} ms, p95 {result['search_p95_ms']:.2f} ms"
+        )
+        results.append(result)
+    with open(args.output, "w") as f:
+        json.dump({"benchmark": "rag_search", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
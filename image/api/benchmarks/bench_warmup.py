@@ -0,0 +1,157 @@
+"""
+Measures how often queries hit a cold Ollama model, with and without the API's
+preloading and adaptive keep_alive.
+
+Each scenario runs in a fresh process with a stub Ollama server (see
+``stub_ollama``) and the app on loopback ports. The stub takes ``--load-seconds``
+to load a model and, like Ollama, unloads it ``--stub-keep-alive`` seconds after
+a request that did not ask for longer. After ``--startup`` seconds, ``--queries``
+queries are sent with exponentially distributed gaps of ``--mean-gap`` seconds
+on average, the same gaps in every scenario:
+
+- ``baseline``: no preload, every query asks for the stub's default keep_alive
+- ``managed``: models are preloaded and keep_alive follows the observed gaps
+
+Times are scaled down, a keep_alive of a few seconds stands for Ollama's five
+minutes. Run from image/api:
+
+    python -m benchmarks.bench_warmup --load-seconds 3 --mean-gap 3 --queries 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_query import free_port
+from benchmarks.bench_rag import percentile
+
+MODEL = "stub-model"
+
+
+def scenario_env(name: str, args, port: int) -> dict:
+    env = {
+        **os.environ,
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{port}",
+        "OLLAMA_PRELOAD_MODELS": MODEL,
+        "OLLAMA_STATUS_TTL": "0",
+        "CACHE_BACKEND": "memory",
+    }
+    if name == "baseline":
+        keep_alive = str(args.stub_keep_alive)
+        env.update({
+            "OLLAMA_PRELOAD": "false",
+            "OLLAMA_KEEP_ALIVE": keep_alive,
+            "OLLAMA_KEEP_ALIVE_MIN": keep_alive,
+            "OLLAMA_KEEP_ALIVE_MAX": keep_alive,
+        })
+    else:
+        env.update({
+            "OLLAMA_PRELOAD": "true",
+            "OLLAMA_KEEP_ALIVE": str(args.keep_alive),
+            "OLLAMA_KEEP_ALIVE_MIN": str(args.stub_keep_alive),
+            "OLLAMA_KEEP_ALIVE_MAX": str(args.keep_alive_max),
+        })
+    return env
+
+
+async def run_scenario(args) -> dict:
+    import httpx
+    import uvicorn
+    from benchmarks.stub_ollama import StubOllama, create_app
+
+    async def serve(app, port: int):
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        task = asyncio.create_task(server.serve())
+        while not server.started:
+            if task.done():
+                await task
+                raise RuntimeError("uvicorn exited before it started serving")
+            await asyncio.sleep(0.01)
+        return server, task
+
+    stub = StubOllama(args.load_seconds, args.stub_keep_alive, args.tokens, args.token_rate)
+    stub_server, stub_task = await serve(create_app(stub), args.stub_port)
+    from main import app # Reads the scenario's environment
+    api_port = free_port()
+    api_server, api_task = await serve(app, api_port)
+
+    rng = random.Random(args.seed)
+    gaps = [rng.expovariate(1 / args.mean_gap) for _ in range(args.queries - 1)]
+    latencies = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=None) as client:
+            await asyncio.sleep(args.startup)
+            for i, gap in enumerate([0.0, *gaps]):
+                await asyncio.sleep(gap)
+                start = time.perf_counter()
+                response = await client.post("/query/", json={
+                    "content": f"warm-up benchmark {i}",
+                    "llm": "ollama",
+                    "model": MODEL,
+                    "bypass_cache": True,
+                })
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            health = (await client.get("/health/3")).json()
+    finally:
+        api_server.should_exit = True
+        await api_task
+        stub_server.should_exit = True
+        await stub_task
+
+    cold = sum(1 for latency in latencies if latency >= args.load_seconds)
+    return {
+        "queries": len(latencies),
+        "cold_queries": cold,
+        "stub_loads": stub.loads,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "max_ms": max(latencies) * 1000,
+        "first_ms": latencies[0] * 1000,
+        "ollama": health.get("ollama"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--mean-gap", type=float, default=3.0, help="Average seconds between queries")
+    parser.add_argument("--load-seconds", type=float, default=3.0, help="Stub model load time")
+    parser.add_argument("--stub-keep-alive", type=float, default=2.0, help="Stub default keep_alive, Ollama's 5m")
+    parser.add_argument("--keep-alive", type=float, default=10.0, help="Managed keep_alive before traffic is seen")
+    parser.add_argument("--keep-alive-max", type=float, default=30.0)
+    parser.add_argument("--startup", type=float, default=4.0, help="Seconds from API start to the first query")
+    parser.add_argument("--tokens", type=int, default=16)
+    parser.add_argument("--token-rate", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", choices=["baseline", "managed"], help=argparse.SUPPRESS)
+    parser.add_argument("--stub-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default="bench_warmup.json")
+    args = parser.parse_args()
+
+    if args.scenario: # Child process of one scenario
+        print(json.dumps(asyncio.run(run_scenario(args))))
+        return
+
+    results = []
+    for name in ("baseline", "managed"):
+        port = free_port()
+        command = [sys.executable, "-m", "benchmarks.bench_warmup", *sys.argv[1:], "--scenario", name, "--stub-port", str(port)]
+        result = subprocess.run(command, env=scenario_env(name, args, port), capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Scenario {name} failed:\n{result.stderr[-2000:]}")
+        results.append({"scenario": name, **json.loads(result.stdout.strip().splitlines()[-1])})
+        print(
+            f"{name}: {results[-1]['cold_queries']}/{results[-1]['queries']} cold, {results[-1]['stub_loads']} loads, "
+            f"first {results[-1]['first_ms']:.0f} ms, p50 {results[-1]['p50_ms']:.0f} ms, p95 {results[-1]['p95_ms']:.0f} ms"
+        )
+    with open(args.output, "w") as f:
+        json.dump({"benchmark": "warmup", "config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
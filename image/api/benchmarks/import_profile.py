@@ -0,0 +1,83 @@
+"""
+Reports where import time goes, using Python's ``-X importtime``.
+
+The module is imported in a fresh interpreter and the slowest imports are listed
+by cumulative time, along with the total per top-level package. Works for either
+service; run from its directory:
+
+    python -m benchmarks.import_profile --module main --top 25
+    python ../api/benchmarks/import_profile.py --module main   (from image/bot)
+"""
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def profile(module: str) -> list[dict]:
+    """
+    :return: One entry per imported module with its self and cumulative time in ms,
+        in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return entries
+
+
+def by_package(entries: list[dict]) -> dict[str, float]:
+    totals = defaultdict(float)
+    for entry in entries:
+        totals[entry["module"].split(".")[0]] += entry["self_ms"]
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--output", default="bench_import_profile.json")
+    args = parser.parse_args()
+
+    entries = profile(args.module)
+    total = sum(entry["self_ms"] for entry in entries)
+    slowest = sorted(entries, key=lambda entry: -entry["cumulative_ms"])[:args.top]
+    packages = by_package(entries)
+
+    print(f"import {args.module}: {total:.0f} ms over {len(entries)} modules\n")
+    print(f"{'cumulative':>11} {'self':>9}  module")
+    for entry in slowest:
+        print(f"{entry['cumulative_ms']:>9.1f}ms {entry['self_ms']:>7.1f}ms  {'  ' * entry['depth']}{entry['module']}")
+    print("\nBy top-level package:")
+    for package, ms in list(packages.items())[:args.top]:
+        print(f"{ms:>9.1f}ms  {package}")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "benchmark": "import_profile",
+            "module": args.module,
+            "total_ms": total,
+            "modules": len(entries),
+            "slowest": slowest,
+            "packages": packages,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+A stand-in for an Ollama server that models load times and keep_alive.
+
+It serves the parts of Ollama's HTTP API the app uses: ``/api/chat`` (streamed
+and not), ``/api/generate`` (an empty prompt only loads the model, like Ollama),
+``/api/ps`` and ``/api/tags``. A model that is not loaded takes ``--load-seconds``
+to load first, and concurrent requests wait for the same load. Loaded models are
+unloaded when the ``keep_alive`` of their last request runs out, which defaults
+to ``--keep-alive`` seconds like Ollama's OLLAMA_KEEP_ALIVE. Answers are
+``--tokens`` words at ``--token-rate`` tokens per second. Run from image/api:
+
+    python -m benchmarks.stub_ollama --port 11434 --load-seconds 5 --keep-alive 300
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DURATION = re.compile(r"^(-?[\d.]+)(ms|s|m|h)?$")
+UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+WORDS = ("the", "stub", "model", "answers", "after", "it", "was", "loaded", "into", "memory")
+
+
+def parse_keep_alive(value, default: float) -> float | None:
+    """
+    Seconds to keep a model loaded, None for forever. Ollama takes a number of
+    seconds or a duration string such as ``5m``; a negative value never unloads.
+    """
+    if value is None:
+        return default
+    if isinstance(value, str):
+        match = DURATION.match(value.strip())
+        if match is None:
+            raise ValueError(f"Invalid keep_alive: {value}")
+        value = float(match.group(1)) * UNITS[match.group(2)]
+    return None if value < 0 else float(value)
+
+
+class StubOllama:
+    def __init__(self, load_seconds: float, keep_alive: float, tokens: int, token_rate: float):
+        self.load_seconds = load_seconds
+        self.keep_alive = keep_alive
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.expires: dict[str, float | None] = {} # Loaded models, monotonic unload time or None
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.loads = 0
+        self.requests = 0
+
+    def is_loaded(self, model: str) -> bool:
+        if model not in self.expires:
+            return False
+        expires = self.expires[model]
+        if expires is not None and expires <= time.monotonic():
+            del self.expires[model]
+            return False
+        return True
+
+    async def ensure_loaded(self, model: str) -> float:
+        """
+        :return: Seconds spent loading, 0 if the model was loaded already.
+        """
+        async with self.locks.setdefault(model, asyncio.Lock()):
+            if self.is_loaded(model):
+                return 0.0
+            await asyncio.sleep(self.load_seconds)
+            self.loads += 1
+            self.expires[model] = time.monotonic() + self.keep_alive
+            return self.load_seconds
+
+    def touch(self, model: str, keep_alive):
+        seconds = parse_keep_alive(keep_alive, self.keep_alive)
+        if seconds == 0:
+            self.expires.pop(model, None)
+        else:
+            self.expires[model] = None if seconds is None else time.monotonic() + seconds
+
+    def ps(self) -> list[dict]:
+        now = time.monotonic()
+        models = []
+        for model in list(self.expires):
+            if not self.is_loaded(model):
+                continue
+            expires = self.expires[model]
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires - now if expires else 365 * 86400)
+            models.append({
+                "name": model,
+                "model": model,
+                "size": 0,
+                "digest": "stub",
+                "details": {"format": "gguf", "family": "stub"},
+                "expires_at": expires_at.isoformat(),
+                "size_vram": 0,
+            })
+        return models
+
+
+def _full_name(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+
+def create_app(stub: StubOllama) -> FastAPI:
+    app = FastAPI(title="Stub Ollama")
+
+    def _base(model: str, done: bool) -> dict:
+        return {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+
+    def _final(model: str, load: float, start: float, reason: str = "stop") -> dict:
+        return {
+            **_base(model, True),
+            "done_reason": reason,
+            "total_duration": int((time.monotonic() - start) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": 1,
+            "prompt_eval_duration": 0,
+            "eval_count": stub.tokens,
+            "eval_duration": int(stub.tokens / stub.token_rate * 1e9) if stub.token_rate > 0 else 0,
+        }
+
+    async def _tokens():
+        start = time.monotonic()
+        for i in range(stub.tokens):
+            if stub.token_rate > 0:
+                await asyncio.sleep(max(0.0, start + i / stub.token_rate - time.monotonic()))
+            yield WORDS[i % len(WORDS)] + (" " if i < stub.tokens - 1 else ".")
+
+    async def _respond(body: dict, piece: Callable[[str], dict], load: float, start: float):
+        model = _full_name(body["model"])
+        if not body.get("stream", True):
+            text = "".join([token async for token in _tokens()])
+            stub.touch(model, body.get("keep_alive"))
+            return JSONResponse({**_final(model, load, start), **piece(text)})
+
+        async def lines():
+            async for token in _tokens():
+                yield json.dumps({**_base(model, False), **piece(token)}) + "\n"
+            stub.touch(model, body.get("keep_alive")) # Ollama counts keep_alive from the end of a request
+            yield json.dumps({**_final(model, load, start), **piece("")}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        model = _full_name(body["model"])
+        stub.requests += 1
+        start = time.monotonic()
+        load = await stub.ensure_loaded(model)
+        if not body.get("messages"):
+            stub.touch(model, body.get("keep_alive"))
+            return JSONResponse({**_final(model, load, start, "load"), "message": {"role": "assistant", "content": ""}})
+        return await _respond(body, lambda text: {"message": {"role": "assistant", "content": text}}, load, start)
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = _full_name(body["model"])
+        stub.requests += 1
+        start = time.monotonic()
+        load = await stub.ensure_loaded(model)
+        if not body.get("prompt"):
+            stub.touch(model, body.get("keep_alive"))
+            return JSONResponse({**_final(model, load, start, "load"), "response": ""})
+        return await _respond(body, lambda text: {"response": text}, load, start)
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": stub.ps()}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model, "model": model} for model in stub.expires]}
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {"loads": stub.loads, "requests": stub.requests, "loaded": [m["name"] for m in stub.ps()]}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--load-seconds", type=float, default=5.0)
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="Seconds, when a request sends none")
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    stub = StubOllama(args.load_seconds, args.keep_alive, args.tokens, args.token_rate)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, HTTPException
+from models.Agent import AgentRequest
+from util.ai_utils import build_prompt, query_llm, LLMTimeoutError
+from util.agent_utils import agent
+from util.scheduler import scheduler, QueueRejectedError
+from util.llm_router import router as llm_router, mark_started, NoHealthyCandidateError, UnknownRouteError
+from util.cascade_utils import model_cascade
+
+router = APIRouter(prefix="/agent", tags=["ai"])
+
+
+async def _invoke(request: AgentRequest, messages: list, tools: list[dict] | None, llm: str, model: str, timeout: float):
+    # Every step queues again, so a long run does not hold a worker between steps
+    async with scheduler.slot(llm, request.user_id, request.guild_id, request.priority):
+        mark_started() # A routed candidate's latency starts here, after the queue
+        return await query_llm(query=messages, llm=llm, model=model, timeout=timeout, tools=tools)
+
+
+@router.get("/")
+async def agent_get() -> dict:
+    return agent.stats()
+
+
+@router.post("/")
+async def agent_post(request: AgentRequest) -> dict:
+    """
+    Answers a message with the model calling tools as it needs them.
+
+    The tools the model asks for in one step run concurrently and their results
+    are sent back for the next step, until the model answers or the run's step or
+    time budget is used up. Agent answers are not cached, since the tools' data
+    changes, but deterministic tool results are.
+
+    :param request: The message, model, tools, budgets and the context the tools read.
+    :return: The answer, why the run stopped and a timing trace of every step.
+    :rtype: dict
+    :raises HTTPException: 422 for unknown tools, routes or cascades, 503 if the
+        request is rejected by the scheduler, 504 if the model does not answer in time.
+    """
+    try:
+        agent.registry.select(request.tools)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    prompt = build_prompt(request.content, request.messages, request.summary)
+    if isinstance(prompt, str):
+        prompt = [("human", prompt)]
+
+    llm, model = request.llm, request.model
+    try:
+        if llm == "cascade": # Tool calling needs the large tier
+            large = model_cascade.get(model).large
+            llm, model = large.llm, large.model
+        if llm == "route":
+            llm_router.get(model)
+    except UnknownRouteError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    async def invoke(messages: list, tools: list[dict] | None, timeout: float):
+        if llm == "route": # model names the route
+            return await llm_router.invoke(
+                model,
+                lambda candidate: _invoke(
+                    request, messages, tools, candidate.llm, candidate.model, min(candidate.timeout or timeout, timeout)
+                )
+            )
+        return await _invoke(request, messages, tools, llm, model, timeout)
+
+    try:
+        return await agent.run(
+            prompt,
+            invoke,
+            context={**request.context, "user_id": request.user_id, "guild_id": request.guild_id},
+            tool_names=request.tools,
+            max_steps=request.max_steps,
+            max_seconds=request.max_seconds,
+        )
+    except (QueueRejectedError, NoHealthyCandidateError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
@@ -0,0 +1,61 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request
+from models.Query import Attachment
+from util.attachment_utils import (
+    attachment_processor,
+    detect_kind,
+    receive_upload,
+    AttachmentTooLargeError,
+    UnsupportedAttachmentError,
+    ATTACHMENT_MAX_BYTES,
+)
+
+router = APIRouter(prefix="/attachments", tags=["ai"])
+
+
+@router.get("/")
+async def attachments_get() -> dict:
+    return attachment_processor.stats()
+
+
+@router.post("/")
+async def attachments_post(request: Request, filename: str, content_type: str | None = None) -> Attachment:
+    """
+    Receives a raw file upload and returns its extracted content, ready to be
+    sent in ``Query.attachments``.
+
+    The body is streamed to a temporary file instead of being buffered, then text
+    is extracted or the image downscaled in the process pool. Files with the same
+    content are only processed once.
+
+    :param filename: Original file name, used to detect the kind of file.
+    :param content_type: Original content type, used when the extension is unknown.
+    :raises HTTPException: 400 for a malformed Content-Length, 413 if the file is
+        too large, 415 if it cannot be processed, 422 if extraction fails and 504
+        if it takes too long.
+    """
+    try:
+        kind = detect_kind(filename, content_type)
+    except UnsupportedAttachmentError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    declared = request.headers.get("content-length")
+    try:
+        too_large = declared is not None and int(declared) > ATTACHMENT_MAX_BYTES
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid Content-Length: {declared}")
+    if too_large:
+        raise HTTPException(status_code=413, detail=f"Attachment is over the {ATTACHMENT_MAX_BYTES} byte limit")
+
+    try:
+        path, digest = await receive_upload(request.stream())
+        artifact = await attachment_processor.process(path, digest, kind, filename)
+    except AttachmentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedAttachmentError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Processing {filename} took too long")
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not process {filename}: {e}")
+    return Attachment(id=digest, kind=kind, filename=filename, **artifact)
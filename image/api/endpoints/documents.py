@@ -0,0 +1,37 @@
+from fastapi import APIRouter, HTTPException
+from models.Document import DocumentBatch
+from util.rag_utils import rag_store
+
+router = APIRouter(prefix="/documents", tags=["rag"])
+
+
+@router.get("/")
+async def documents_get() -> dict:
+    return rag_store.stats()
+
+
+@router.post("/")
+async def documents_post(batch: DocumentBatch) -> dict:
+    """
+    Ingests documents into the retrieval index.
+
+    Each document is chunked and embedded in batches. Documents whose content hash
+    matches the indexed version are skipped, so re-posting a whole corpus only
+    re-embeds the documents that changed.
+
+    :param batch: The documents to ingest and the chunking settings.
+    :return: The ids of ingested and unchanged documents and the number of new chunks.
+    :rtype: dict
+    """
+    return await rag_store.ingest(
+        [(document.id, document.content) for document in batch.documents],
+        chunk_size=batch.chunk_size,
+        overlap=batch.overlap
+    )
+
+
+@router.delete("/{doc_id}")
+async def documents_delete(doc_id: str) -> dict:
+    if not await rag_store.remove(doc_id):
+        raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
+    return {"deleted": doc_id}
@@ -1,4 +1,24 @@
 from fastapi import APIRouter
+from util.ai_utils import registry
+from util.cache_utils import response_cache
+from endpoints.query import query_flight, stream_flight
+from util.scheduler import scheduler
+from util.llm_router import router as llm_router
+from util.cascade_utils import model_cascade
+from util.metrics import registry as metrics
+from util.attachment_utils import attachment_processor
+from util.log_store import log_store
+from util.agent_utils import agent
+from util.ollama_utils import ollama_warmer
+from util.socket_utils import sessions as socket_sessions
+
+LATENCY_METRICS = (
+    "http_request_duration_seconds",
+    "llm_request_duration_seconds",
+    "llm_time_to_first_token_seconds",
+    "llm_stream_tokens_per_second",
+    "scheduler_queue_wait_seconds",
+)
 
 router = APIRouter(prefix="/health", tags=["stats"])
 
@@ -8,5 +28,24 @@ async def health_get(index) -> dict:
     match int(index):
         case 1:
             return {"health": "Healthy"}
+        case 2 | 3 as level:
+            health = {
+                "health": "Healthy",
+                "cache": response_cache.stats(),
+                "llm_clients": registry.stats(),
+                "coalescing": {"query": query_flight.stats(), "stream": stream_flight.stats()},
+                "queues": scheduler.stats(),
+                "routes": llm_router.stats(),
+                "cascades": model_cascade.stats(),
+                "attachments": attachment_processor.stats(),
+                "logs": log_store.stats(),
+                "agent": agent.stats(),
+                "sockets": socket_sessions.stats(),
+                "latency": {name: metrics.get(name).snapshot() for name in LATENCY_METRICS},
+            }
+            if level == 3:
+                health["ollama"] = await ollama_warmer.status() # Asks Ollama, so only at the top level
+                health["metrics"] = metrics.snapshot()
+            return health
         case _:
             return {"health": "Unhealthy"}
\ No newline at end of file
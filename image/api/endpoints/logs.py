@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException
+from models.Log import LogPage, LogSearch
+from util.log_store import InvalidCursorError, LogStoreUnavailableError, log_store
+
+router = APIRouter(prefix="/logs", tags=["logs"])
+
+
+@router.get("/")
+async def logs_get() -> dict:
+    return log_store.stats()
+
+
+@router.post("/search")
+async def logs_search(search: LogSearch) -> LogPage:
+    """
+    Searches the bot's event log, newest first.
+
+    Filters combine with AND. Pass the returned ``next_cursor`` with the same
+    filters to get the next page.
+
+    :param search: The filters, page size and cursor.
+    :return: One page of log entries and the cursor of the next page.
+    :rtype: LogPage
+    """
+    try:
+        return await log_store.search(search)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LogStoreUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from util.metrics import registry, CONTENT_TYPE
+
+router = APIRouter(prefix="/metrics", tags=["stats"])
+
+
+@router.get("")
+async def metrics_get() -> Response:
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
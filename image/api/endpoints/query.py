@@ -1,11 +1,109 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
 from http.client import responses
 
-from fastapi import APIRouter
-from models.Query import Query, AttachmentEnum
-from util.ai_utils import query_llm
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from langchain_core.messages import AIMessage
+from models.Query import Query, QueryBatch, AttachmentEnum
+from util.ai_utils import batch_llm, build_prompt, query_llm, stream_llm, LLMTimeoutError
+from util.cache_utils import response_cache
+from util.singleflight import SingleFlight, StreamFlight
+from util.rag_utils import rag_store
+from util.scheduler import scheduler, QueueRejectedError
+from util.llm_router import router as llm_router, mark_started, NoHealthyCandidateError, UnknownRouteError
+from util.cascade_utils import complexity, model_cascade
 
 router = APIRouter(prefix="/query", tags=["ai"])
 
+QUERY_BATCH_MAX_ITEMS = int(os.getenv("QUERY_BATCH_MAX_ITEMS", "100"))
+QUERY_BATCH_MAX_CONCURRENCY = int(os.getenv("QUERY_BATCH_MAX_CONCURRENCY", "8"))
+
+# Identical concurrent queries share one generation
+query_flight = SingleFlight()
+stream_flight = StreamFlight()
+
+
+class QueuePosition(int):
+    """
+    Marks a queue position update among the text pieces of a stream.
+    """
+    pass
+
+
+def _prompt_key(query: Query) -> str:
+    """
+    The text that identifies a query for caching and coalescing. Queries with
+    history are keyed on the whole conversation, not just the last message.
+    """
+    if not query.messages and not query.summary and not query.use_rag and not query.attachments:
+        return query.content
+    return json.dumps([
+        query.summary,
+        [m.model_dump(mode="json") for m in query.messages],
+        query.content,
+        query.top_k if query.use_rag else 0,
+        [attachment.id for attachment in query.attachments]
+    ])
+
+
+async def _prompt(query: Query):
+    context = None
+    if query.use_rag:
+        context = [chunk["text"] for chunk in await rag_store.retrieve(query.content, query.top_k)]
+    return build_prompt(query.content, query.messages, query.summary, context, query.attachments)
+
+
+async def _invoke(query: Query, prompt, llm: str, model: str, timeout: float | None = None):
+    async with scheduler.slot(llm, query.user_id, query.guild_id, query.priority):
+        mark_started() # A routed candidate's latency starts here, after the queue
+        return await query_llm(
+            query=prompt,
+            llm=llm,
+            model=model,
+            timeout=timeout,
+            show_thoughts=query.show_thoughts
+        )
+
+
+async def _stream(query: Query, prompt, llm: str, model: str, timeout: float | None = None):
+    provider, ticket = scheduler.enqueue(llm, query.user_id, query.guild_id, query.priority)
+    async for position in scheduler.positions(provider, ticket):
+        yield QueuePosition(position)
+    async with scheduler.hold(provider, ticket):
+        mark_started()
+        async for piece in stream_llm(
+            query=prompt,
+            llm=llm,
+            model=model,
+            timeout=timeout,
+            show_thoughts=query.show_thoughts
+        ):
+            yield piece
+
+
+def _complexity(query: Query) -> float:
+    return complexity(query.content, len(query.messages), len(query.attachments), query.use_rag)
+
+
+def _check_target(llm: str, model: str):
+    """
+    :raises HTTPException: 422 if ``model`` names a route or cascade that does not exist.
+    """
+    try:
+        if llm == "route":
+            llm_router.get(model)
+        elif llm == "cascade":
+            model_cascade.get(model)
+    except UnknownRouteError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _flight_key(query: Query) -> tuple:
+    return query.llm, query.model, _prompt_key(query), query.show_thoughts
+
 @router.get("/")
 async def query_get():
     """
@@ -43,10 +141,262 @@ async def query_post(query: Query):
                   and optional settings for thought display.
     :return: The response generated by the LLM based on the given query details.
     :rtype: Depends on the implementation of `query_llm` function.
+    :raises HTTPException: 422 for an unknown route or cascade, 503 if the request
+        is rejected by the scheduler, 504 if the model does not answer in time.
+    """
+    _check_target(query.llm, query.model)
+    if not query.bypass_cache:
+        cached = await response_cache.get(query.llm, query.model, _prompt_key(query), query.show_thoughts)
+        if cached is not None:
+            return cached
+
+    async def generate():
+        prompt = await _prompt(query)
+        if query.llm == "route": # query.model names the route
+            response = await llm_router.invoke(
+                query.model,
+                lambda candidate: _invoke(query, prompt, candidate.llm, candidate.model, candidate.timeout)
+            )
+        elif query.llm == "cascade": # query.model names the cascade
+            response = await model_cascade.get(query.model).invoke(
+                prompt,
+                _complexity(query),
+                lambda llm, model, timeout, tier_prompt: _invoke(query, tier_prompt, llm, model, timeout)
+            )
+        else:
+            response = await _invoke(query, prompt, query.llm, query.model)
+        response = response.model_dump()
+        await response_cache.set(query.llm, query.model, _prompt_key(query), response, query.show_thoughts)
+        return response
+
+    try:
+        return await query_flight.do(_flight_key(query), generate)
+    except (QueueRejectedError, NoHealthyCandidateError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+def _sse(data: dict, event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@router.post("/stream")
+async def query_stream_post(query: Query):
+    """
+    Handles POST requests that want the answer streamed back while it is generated.
+
+    The response is a Server-Sent Events stream. While the request waits for a
+    worker, ``queue`` events report ``{"position": ...}``. Every text piece is sent
+    as a ``data`` event holding ``{"content": ...}``, failures are sent as an
+    ``error`` event and the stream always ends with a ``done`` event.
+
+    :param query: Instance of the Query class containing the content, LLM, model,
+                  and optional settings for thought display.
+    :return: A streaming response with the ``text/event-stream`` media type.
+    :rtype: StreamingResponse
+    :raises HTTPException: 422 for an unknown route or cascade.
+    """
+    _check_target(query.llm, query.model)
+
+    async def generate():
+        prompt = await _prompt(query)
+        if query.llm == "route": # query.model names the route
+            stream = llm_router.stream(
+                query.model,
+                lambda candidate: _stream(query, prompt, candidate.llm, candidate.model, candidate.timeout),
+                is_content=lambda piece: not isinstance(piece, QueuePosition)
+            )
+        elif query.llm == "cascade": # query.model names the cascade
+            stream = model_cascade.get(query.model).stream(
+                prompt,
+                _complexity(query),
+                lambda llm, model, timeout, tier_prompt: _invoke(query, tier_prompt, llm, model, timeout),
+                lambda llm, model, timeout, tier_prompt: _stream(query, tier_prompt, llm, model, timeout),
+                is_content=lambda piece: not isinstance(piece, QueuePosition)
+            )
+        else:
+            stream = _stream(query, prompt, query.llm, query.model)
+        pieces = []
+        async for piece in stream:
+            if not isinstance(piece, QueuePosition):
+                pieces.append(piece)
+            yield piece
+        await response_cache.set(
+            query.llm, query.model, _prompt_key(query),
+            AIMessage(content="".join(pieces)).model_dump(), # The shape query_post caches
+            query.show_thoughts
+        )
+
+    async def events():
+        try:
+            if not query.bypass_cache:
+                cached = await response_cache.get(query.llm, query.model, _prompt_key(query), query.show_thoughts)
+                if cached is not None:
+                    yield _sse({"content": cached["content"]})
+                    yield _sse({}, event="done")
+                    return
+            async for piece in stream_flight.stream(_flight_key(query), generate):
+                if isinstance(piece, QueuePosition):
+                    yield _sse({"position": int(piece)}, event="queue")
+                else:
+                    yield _sse({"content": piece})
+        except (QueueRejectedError, NoHealthyCandidateError) as e:
+            yield _sse({"error": str(e), "status": 503}, event="error")
+        except LLMTimeoutError as e:
+            yield _sse({"error": str(e), "status": 504}, event="error")
+        except Exception as e:
+            yield _sse({"error": str(e), "status": 500}, event="error")
+        yield _sse({}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _error_status(e: Exception) -> int:
+    if isinstance(e, UnknownRouteError):
+        return 422
+    if isinstance(e, (QueueRejectedError, NoHealthyCandidateError)):
+        return 503
+    if isinstance(e, LLMTimeoutError):
+        return 504
+    return 500
+
+
+async def _batch_group(
+        batch: QueryBatch,
+        indices: list[int],
+        results: asyncio.Queue,
+        ):
+    """
+    Generates the batch items that share a provider, model and thought setting
+    with one ``batch_llm`` call and puts each result on ``results`` as it finishes.
+    The group is scheduled as one request of its first item's user and guild.
+    """
+    first = batch.queries[indices[0]]
+    concurrency = max(1, min(batch.max_concurrency, QUERY_BATCH_MAX_CONCURRENCY))
+    done: set[int] = set()
+
+    async def run(llm: str, model: str, timeout: float | None = None):
+        remaining = [index for index in indices if index not in done] # A failover retries only these
+        prompts = await asyncio.gather(*(_prompt(batch.queries[index]) for index in remaining))
+        async with scheduler.slot(llm, first.user_id, first.guild_id, first.priority):
+            mark_started()
+            async for position, result in batch_llm(
+                prompts, llm, model, concurrency, timeout, show_thoughts=first.show_thoughts
+            ):
+                index = remaining[position]
+                done.add(index)
+                if isinstance(result, Exception):
+                    await results.put({"index": index, "error": str(result), "status": _error_status(result)})
+                    continue
+                query = batch.queries[index]
+                response = result.model_dump()
+                await response_cache.set(query.llm, query.model, _prompt_key(query), response, query.show_thoughts)
+                await results.put({"index": index, "response": response})
+
+    llm, model, timeout = first.llm, first.model, None
+    if llm == "cascade": # Batches are background work, they go to the large tier
+        large = model_cascade.get(model).large
+        llm, model, timeout = large.llm, large.model, large.timeout
+    try:
+        if llm == "route": # model names the route
+            await llm_router.invoke(model, lambda candidate: run(candidate.llm, candidate.model, candidate.timeout))
+        else:
+            await run(llm, model, timeout)
+    except Exception as e:
+        for index in indices:
+            if index not in done:
+                await results.put({"index": index, "error": str(e), "status": _error_status(e)})
+
+
+async def _batch_results(batch: QueryBatch):
+    """
+    Yields one result per batch item as soon as it is available: cached answers
+    first, then generated ones in the order they finish. Each result holds the
+    item's ``index`` and either its ``response`` or an ``error`` with a ``status``.
+    """
+    groups: dict[tuple, list[int]] = defaultdict(list)
+    for index, query in enumerate(batch.queries):
+        if not query.bypass_cache:
+            cached = await response_cache.get(query.llm, query.model, _prompt_key(query), query.show_thoughts)
+            if cached is not None:
+                yield {"index": index, "response": cached}
+                continue
+        groups[(query.llm, query.model, query.show_thoughts)].append(index)
+
+    results: asyncio.Queue = asyncio.Queue()
+    tasks = [asyncio.create_task(_batch_group(batch, indices, results)) for indices in groups.values()]
+    try:
+        for _ in range(sum(len(indices) for indices in groups.values())):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel() # The client went away, stop generating
+
+
+def _check_batch(batch: QueryBatch):
+    if not batch.queries:
+        raise HTTPException(status_code=422, detail="The batch has no queries")
+    if len(batch.queries) > QUERY_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413, detail=f"A batch takes at most {QUERY_BATCH_MAX_ITEMS} queries, got {len(batch.queries)}"
+        )
+
+
+@router.post("/batch")
+async def query_batch_post(batch: QueryBatch) -> dict:
+    """
+    Answers many queries in one request.
+
+    Queries with the same provider, model and thought setting are sent to the
+    provider's batch API together, with at most ``max_concurrency`` generated at
+    once. A failed query does not fail the batch: its result holds ``error`` and
+    ``status`` instead of ``response``.
+
+    :param batch: The queries and the concurrency per provider and model.
+    :return: ``{"results": [...]}`` in the order of the queries.
+    :rtype: dict
+    :raises HTTPException: 413 if the batch has more than ``QUERY_BATCH_MAX_ITEMS`` queries.
+    """
+    _check_batch(batch)
+    results = [None] * len(batch.queries)
+    async for result in _batch_results(batch):
+        results[result["index"]] = result
+    return {"results": results}
+
+
+@router.post("/batch/stream")
+async def query_batch_stream_post(batch: QueryBatch):
+    """
+    Answers many queries in one request, streaming each result as a line of
+    JSON (NDJSON) as soon as it finishes. Results carry the ``index`` of their
+    query, since they arrive out of order. See ``query_batch_post``.
+
+    :param batch: The queries and the concurrency per provider and model.
+    :return: A streaming response with the ``application/x-ndjson`` media type.
+    :rtype: StreamingResponse
+    """
+    _check_batch(batch)
+
+    async def lines():
+        async for result in _batch_results(batch):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/queue")
+async def queue_get() -> dict:
+    """
+    Returns queue depth, running requests and wait-time statistics per provider.
     """
-    return await query_llm(
-        query=query.content,
-        llm=query.llm,
-        model=query.model,
-        show_thoughts=query.show_thoughts
-    )
\ No newline at end of file
+    return scheduler.stats()
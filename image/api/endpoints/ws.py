@@ -0,0 +1,58 @@
+import asyncio
+
+from fastapi import APIRouter, WebSocket
+from util.socket_utils import codec, dispatch, sessions
+
+router = APIRouter(prefix="/ws", tags=["socket"])
+
+
+@router.get("/")
+async def socket_get() -> dict:
+    return sessions.stats()
+
+
+@router.websocket("/")
+async def socket_connect(websocket: WebSocket, session: str | None = None, last_seq: int = 0, encoding: str = "json"):
+    """
+    A persistent connection that carries many API requests at once.
+
+    The client sends ``{"op": "call", "id", "method", "path", "body"}`` frames for
+    any HTTP route, ``{"op": "cancel", "id"}`` to stop one, and
+    ``{"op": "ack", "seq"}`` for the frames it received. Responses come back as
+    frames tagged with the request ``id`` and a ``seq`` number (see ``dispatch``).
+    Frames are msgpack (binary) or JSON (text), as chosen by ``encoding``.
+
+    The first frame is ``hello`` with the ``session`` ID. Reconnecting with that
+    ``session`` and the last ``seq`` received resumes it: requests that were
+    running meanwhile carry on, missed frames are replayed, and ``known`` lists the
+    requests the session has, so the client resends only those that never arrived.
+    """
+    if encoding not in ("json", "msgpack"):
+        await websocket.close(code=1003, reason=f"Unknown encoding: {encoding}")
+        return
+    _, decode, _ = codec(encoding)
+    await websocket.accept()
+    state, resumed = sessions.open(session)
+    await state.attach(websocket, encoding, last_seq, resumed)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = decode(message["bytes"] if message.get("bytes") is not None else message["text"])
+            op = frame.get("op")
+            if op == "call":
+                request_id = frame["id"]
+                if request_id in state.tasks:
+                    continue # Resent after a reconnect, but already running
+                state.tasks[request_id] = asyncio.create_task(
+                    dispatch(websocket.app, state, frame, websocket.scope.get("client"))
+                )
+            elif op == "cancel":
+                task = state.tasks.get(frame["id"])
+                if task is not None:
+                    task.cancel()
+            elif op == "ack":
+                state.ack(frame["seq"])
+    finally:
+        state.detach(websocket)
@@ -1,25 +1,74 @@
 import os
+import time
+from contextlib import asynccontextmanager
 
-import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from mangum import Mangum
 from util.api_router import api_router
+from util.ai_utils import close_llms, warm_up
+from util.attachment_utils import attachment_processor
+from util.cache_utils import response_cache
+from util.log_store import log_store
+from util.ollama_utils import ollama_warmer, preload_models
+from util.metrics import registry as metrics
+
+REQUEST_LATENCY = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, by route. Streams are measured by the llm_stream metrics"
+)
+
+
+WARMUP_PROVIDERS = [name.strip() for name in os.getenv("WARMUP_PROVIDERS", "").split(",") if name.strip()]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_PROVIDERS:
+        await warm_up(WARMUP_PROVIDERS) # Trade a slower start for a faster first query
+    ollama_warmer.start(preload_models()) # Load the models in the background, before their first query
+    yield
+    await ollama_warmer.close()
+    await close_llms() # Release pooled LLM clients and their connections
+    attachment_processor.close()
+    await log_store.close()
+    await response_cache.close()
 
 app = FastAPI(
     title="AWS Discord Bot",
     version="1.0.0",
+    lifespan=lifespan,
     # So much more to add
 )
 
 app.include_router(api_router)
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route") # Templated path, so ids do not create new series
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            path=route.path if route is not None else "unmatched",
+            status=status,
+        )
+
 @app.get("/")
 async def root():
     return {"response": "Go away"}
 
-handler = Mangum(app)
+# Lambda reuses warm processes between invocations, and Mangum's default lifespan
+# would run the startup and shutdown hooks around every one of them
+handler = Mangum(app, lifespan="off")
 
 if __name__ == "__main__": # Comment out in prod
+    import uvicorn # Only needed when serving locally, not on Lambda
     
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
     
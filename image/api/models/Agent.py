@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+from models.Query import Message
+
+
+class AgentRequest(BaseModel):
+    content: str
+    llm: str = "ollama" # Or "route" or "cascade", with model naming the route or cascade
+    model: str = "deepseek-r1:8b"
+    messages: list[Message] = [] # Earlier turns of the conversation, oldest first
+    summary: str | None = None # Summary of turns that were dropped from messages
+    tools: list[str] | None = None # Names of the tools the model may call, all by default
+    max_steps: int | None = None # Model calls per run, AGENT_MAX_STEPS by default
+    max_seconds: float | None = None # Time for the tool loop, AGENT_MAX_SECONDS by default
+    user_id: str | None = None # Used for fair scheduling between users
+    guild_id: str | None = None # Scopes the log search and fair scheduling
+    priority: int = 1 # Lower values are scheduled first
+    context: dict = {} # Request data the tools read, e.g. game_stats
@@ -0,0 +1,18 @@
+from pydantic import BaseModel, Field, model_validator
+
+
+class Document(BaseModel):
+    id: str
+    content: str
+
+
+class DocumentBatch(BaseModel):
+    documents: list[Document]
+    chunk_size: int = Field(default=800, gt=0)
+    overlap: int = Field(default=100, ge=0) # Must be smaller than chunk_size
+
+    @model_validator(mode="after")
+    def check_overlap(self):
+        if self.overlap >= self.chunk_size:
+            raise ValueError(f"overlap must be smaller than chunk_size, got {self.overlap} and {self.chunk_size}")
+        return self
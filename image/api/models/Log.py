@@ -0,0 +1,43 @@
+from datetime import datetime
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+
+class LevelEnum(str, Enum):
+    debug = "DEBUG"
+    info = "INFO"
+    warning = "WARNING"
+    error = "ERROR"
+    critical = "CRITICAL"
+
+
+class LogSearch(BaseModel):
+    guild_id: int | None = None
+    channel_id: int | None = None
+    user_id: int | None = None
+    level: LevelEnum | None = None # Minimum level, e.g. WARNING also returns errors
+    event: str | None = None # Structured event type, e.g. message_delete
+    since: datetime | None = None # Defaults to LOG_SEARCH_DEFAULT_DAYS before until
+    until: datetime | None = None # Defaults to now
+    text: str | None = None # Words that must all appear in the message
+    limit: int = Field(default=50, ge=1, le=500)
+    cursor: str | None = None # next_cursor of the previous page
+
+
+class LogEntry(BaseModel):
+    id: int
+    timestamp: datetime
+    logger: str
+    level: str
+    message: str
+    event: str | None = None
+    guild_id: int | None = None
+    channel_id: int | None = None
+    user_id: int | None = None
+    fields: dict | None = None
+
+
+class LogPage(BaseModel):
+    logs: list[LogEntry]
+    next_cursor: str | None = None # None on the last page
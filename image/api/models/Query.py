@@ -8,10 +8,43 @@ class AttachmentEnum(str, Enum):
     audio = "audio"
     document = "document"
     code = "code"
-    
+
+
+class RoleEnum(str, Enum):
+    human = "human"
+    ai = "ai"
+
+
+class Message(BaseModel):
+    role: RoleEnum
+    content: str
+
+
+class Attachment(BaseModel):
+    id: str # Content hash of the file
+    kind: AttachmentEnum
+    filename: str
+    text: str | None = None # Extracted text, or a short description for images
+    image: str | None = None # Downscaled image as a data URL
+    truncated: bool = False # The text was cut at the size limit
+
+
 class Query(BaseModel):
     content: str = "Waduhek?"
-    llm: str = "ollama"
+    llm: str = "ollama" # Or "route" or "cascade", with model naming the route or cascade
     model: str = "deepseek-r1:8b"
     show_thoughts: bool = False # Provide thoughts in response, formatted cleanly
-    
\ No newline at end of file
+    bypass_cache: bool = False # Always ask the model, skipping the response cache
+    messages: list[Message] = [] # Earlier turns of the conversation, oldest first
+    summary: str | None = None # Summary of turns that were dropped from messages
+    use_rag: bool = False # Add the most relevant indexed document chunks to the prompt
+    top_k: int = 4
+    user_id: str | None = None # Used for fair scheduling between users
+    guild_id: str | None = None # Used for fair scheduling between guilds
+    priority: int = 1 # Lower values are scheduled first
+    attachments: list[Attachment] = [] # Processed by POST /attachments
+
+
+class QueryBatch(BaseModel):
+    queries: list[Query]
+    max_concurrency: int = 4 # Queries generated at once for each provider and model
@@ -0,0 +1,29 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import time
+
+import pytest
+
+from util.agent_tools import ToolError, evaluate
+
+
+def test_arithmetic():
+    assert evaluate("2 * (3 + 4) ** 2") == 98
+    assert evaluate("factorial(10) // 2 ** 3") == 453600
+    assert evaluate("2 ** -1") == 0.5
+
+
+@pytest.mark.parametrize("expression", [
+    "((9**1000)**1000)**1000",
+    "factorial(1000)**1000",
+    "(9**1000)*(9**1000)*(9**1000)*(9**1000)",
+    "2**1001",
+    "factorial(1001)",
+    "__import__('os')",
+])
+def test_rejects_unbounded_or_unsafe_expressions(expression):
+    start = time.monotonic()
+    with pytest.raises(ToolError):
+        evaluate(expression)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,35 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import util.attachment_utils as attachment_utils
+from models.Query import AttachmentEnum
+from util.attachment_utils import ArtifactCache, AttachmentProcessor
+
+
+def slow_extract(path, kind, filename, limits):
+    time.sleep(0.3)
+    return {"text": "done"}
+
+
+def test_timed_out_job_keeps_its_slot_until_it_ends(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachment_utils, "extract", slow_extract)
+    processor = AttachmentProcessor(ArtifactCache(str(tmp_path / "cache"), 10), workers=1, timeout=0.05)
+    processor._pool = ThreadPoolExecutor(max_workers=1)
+    upload = tmp_path / "upload"
+    upload.write_text("text")
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await processor.process(str(upload), "digest", AttachmentEnum.document, "a.txt")
+        held = processor._slots._value
+        await asyncio.sleep(0.5)
+        return held, processor._slots._value
+
+    assert asyncio.run(main()) == (1, 2)
+    processor._pool.shutdown()
@@ -0,0 +1,56 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from util.cache_utils import MemoryCacheBackend, ResponseCache, SQLiteCacheBackend
+
+pytest.importorskip("numpy")
+
+
+class Embedder:
+    """
+    Embeds prompts by their first word, so prompts sharing it are similar.
+    """
+    VECTORS = {"capital": [1.0, 0.0, 0.0], "weather": [0.0, 1.0, 0.0]}
+
+    async def aembed_query(self, text: str):
+        return self.VECTORS.get(text.split()[0], [0.0, 0.0, 1.0])
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCacheBackend()
+    return SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+
+
+def test_exact_and_semantic_hits(backend):
+    async def main():
+        cache = ResponseCache(backend, embedder=Embedder(), threshold=0.9)
+        assert await cache.get("ollama", "m", "capital of France?") is None
+        await cache.set("ollama", "m", "capital of France?", {"content": "Paris"})
+        assert await cache.get("ollama", "m", "Capital of France") == {"content": "Paris"}
+        assert await cache.get("ollama", "m", "capital city of France, please") == {"content": "Paris"}
+        assert await cache.get("ollama", "m", "weather today") is None
+        assert await cache.get("ollama", "other", "capital city of France, please") is None
+        await cache.close()
+        return cache.stats()
+
+    stats = asyncio.run(main())
+    assert (stats["hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 3)
+
+
+def test_semantic_index_loads_from_a_persisted_backend(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    async def main():
+        first = ResponseCache(SQLiteCacheBackend(path), embedder=Embedder())
+        await first.set("ollama", "m", "capital of France?", {"content": "Paris"})
+        await first.close()
+        second = ResponseCache(SQLiteCacheBackend(path), embedder=Embedder())
+        return await second.get("ollama", "m", "capital city of France")
+
+    assert asyncio.run(main()) == {"content": "Paris"}
@@ -0,0 +1,51 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from util.cascade_utils import Cascade, complexity, confidence
+from util.llm_router import UnknownRouteError, router as llm_router
+
+
+class Message:
+    def __init__(self, content: str):
+        self.content = content
+
+    def model_copy(self, update: dict):
+        return Message(update["content"])
+
+
+def test_confidence_line_is_split_off():
+    assert confidence("Noon.\nConfidence: 9/10") == ("Noon.", 0.9)
+    assert confidence("Maybe.\n**Confidence:** 40%") == ("Maybe.", 0.4)
+    assert confidence("I don't know.\nConfidence: 8/10") == ("I don't know.", 0.3)
+    assert confidence("No rating") == ("No rating", None)
+
+
+def test_complexity_ranks_code_above_small_talk():
+    assert complexity("what time is it") < 0.1
+    assert complexity("Explain why this fails:\n```\ndef f(): pass\n```") > 0.5
+
+
+def test_small_tier_may_be_a_route():
+    route = next(iter(llm_router.routes))
+    cascade = Cascade("test", {"llm": "route", "model": route}, {"llm": "fake", "model": "large"})
+    calls = []
+
+    async def call(llm, model, timeout, prompt):
+        calls.append(model)
+        if model == "large":
+            return Message("large answer")
+        return Message("small answer\nConfidence: 9/10")
+
+    message = asyncio.run(cascade.invoke("hello", 0.0, call))
+    assert message.content == "small answer"
+    assert "large" not in calls
+    assert cascade.reasons == {"confident": 1}
+
+
+def test_unknown_route_tier_fails_at_load():
+    with pytest.raises(UnknownRouteError):
+        Cascade("test", {"llm": "route", "model": "missing"}, {"llm": "fake", "model": "large"})
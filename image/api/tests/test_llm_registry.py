@@ -0,0 +1,40 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+
+from util.llm_registry import LLMRegistry
+
+
+def test_registry_serves_again_after_close():
+    closed = []
+
+    async def closer(client):
+        closed.append(client)
+
+    async def main():
+        registry = LLMRegistry(closer=closer)
+        first = await registry.get(("fake", "a", ()), object)
+        await registry.close()
+        second = await registry.get(("fake", "a", ()), object)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert closed == [first]
+    assert second is not first
+
+
+def test_close_waits_for_leases():
+    closed = []
+
+    async def closer(client):
+        closed.append(client)
+
+    async def main():
+        registry = LLMRegistry(closer=closer)
+        async with registry.lease(("fake", "a", ()), object) as client:
+            await registry.close()
+            assert closed == []
+        assert closed == [client]
+
+    asyncio.run(main())
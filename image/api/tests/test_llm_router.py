@@ -0,0 +1,52 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from util.llm_router import LLMRouter, mark_started, NoHealthyCandidateError
+from util.scheduler import QueueRejectedError
+
+
+def make_router() -> LLMRouter:
+    return LLMRouter({"default": [{"llm": "fake", "model": "a"}, {"llm": "fake", "model": "b"}]})
+
+
+def test_rejections_fail_over_without_tripping_the_breaker():
+    router = make_router()
+
+    async def call(candidate):
+        if candidate.model == "a":
+            raise QueueRejectedError("queue full")
+        return candidate.model
+
+    async def main():
+        return [await router.invoke("default", call) for _ in range(5)]
+
+    assert asyncio.run(main()) == ["b"] * 5
+    first = router.get("default").candidates[0]
+    assert first.state == "closed" and first.error_rate == 0.0
+
+
+def test_all_rejected_is_no_healthy_candidate():
+    router = make_router()
+
+    async def call(candidate):
+        raise QueueRejectedError("queue full")
+
+    with pytest.raises(NoHealthyCandidateError):
+        asyncio.run(router.invoke("default", call))
+
+
+def test_latency_excludes_queue_wait():
+    router = make_router()
+
+    async def call(candidate):
+        await asyncio.sleep(0.2) # Waiting for a worker slot
+        mark_started()
+        await asyncio.sleep(0.01)
+        return candidate.model
+
+    asyncio.run(router.invoke("default", call))
+    assert router.get("default").candidates[0].latency < 0.1
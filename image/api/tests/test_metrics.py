@@ -0,0 +1,28 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+from pathlib import Path
+
+import pytest
+
+from util.metrics import Metric, Registry
+
+IMAGE = Path(__file__).resolve().parents[2]
+
+
+def test_bot_copy_matches_the_api_module():
+    api = (IMAGE / "api" / "util" / "metrics.py").read_text()
+    bot = (IMAGE / "bot" / "util" / "metrics.py").read_text()
+    assert bot.startswith(api.rstrip("\n") + "\n"), "Change both copies of metrics.py together"
+    assert "def start_server" in bot[len(api.rstrip("\n")):]
+
+
+def test_metric_needs_samples():
+    with pytest.raises(TypeError):
+        Metric("name", "documentation")
+
+
+def test_render():
+    registry = Registry()
+    registry.counter("requests_total", "Requests").inc(path="/a")
+    assert 'requests_total{path="/a"} 1' in registry.render()
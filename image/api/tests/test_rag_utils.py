@@ -0,0 +1,59 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from util.rag_utils import RAGStore, chunk_text
+
+
+def test_paragraphs_that_fit_stay_together():
+    assert chunk_text("one.\n\ntwo.", 20, 5) == ["one.\n\ntwo."]
+
+
+def test_chunks_are_never_empty_or_too_long():
+    text = "x" * 15 + "\n\n" + "a" * 19 + ". " + "b" * 5
+    chunks = chunk_text(text, 20, 5)
+    assert chunks == ["x" * 15, "a" * 19 + ".", "aaaa. bbbbb"]
+    assert all(0 < len(chunk) <= 20 for chunk in chunks)
+
+
+def test_long_sentences_are_cut_with_overlap():
+    chunks = chunk_text("a" * 25, 10, 3)
+    assert chunks == ["a" * 10, "a" * 10, "a" * 10, "a" * 4]
+    assert all(len(chunk) <= 10 for chunk in chunks)
+
+
+def test_long_sentence_after_short_one_keeps_text_order():
+    chunks = chunk_text("Hi. " + "b" * 12, 10, 2)
+    assert chunks[0] == "Hi."
+    assert "".join(chunks[1:]).startswith("b")
+
+
+@pytest.mark.parametrize("chunk_size, overlap", [(10, 10), (10, 11), (0, 0), (10, -1)])
+def test_overlap_must_be_smaller_than_chunk_size(chunk_size, overlap):
+    with pytest.raises(ValueError):
+        chunk_text("a" * 50, chunk_size, overlap)
+
+
+class FakeEmbedder:
+    async def aembed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+    async def aembed_query(self, text):
+        return [1.0, 1.0]
+
+
+def test_document_emptied_on_reingest_loses_its_chunks(tmp_path):
+    store = RAGStore(str(tmp_path), "fake")
+    store._embedder = FakeEmbedder()
+
+    async def main():
+        await store.ingest([("doc", "Some text.")])
+        assert await store.retrieve("text")
+        await store.ingest([("doc", "   ")])
+        return await store.retrieve("text")
+
+    assert asyncio.run(main()) == []
+    assert store.stats()["documents"] == 0
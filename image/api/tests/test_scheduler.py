@@ -0,0 +1,57 @@
+"""
+Run from image/api: python -m pytest tests
+"""
+import asyncio
+
+from util.scheduler import ProviderScheduler, Scheduler
+
+
+def test_cancel_right_after_grant_releases_the_slot():
+    async def main():
+        scheduler = Scheduler()
+        provider = ProviderScheduler("fake", 1, 60, 10, {})
+        first = provider.enqueue("a", "g", 1)
+        second = provider.enqueue("b", "g", 1)
+        assert first.granted.done() and not second.granted.done()
+
+        async def wait():
+            async for _ in scheduler.positions(provider, second, interval=1.0):
+                pass
+
+        task = asyncio.create_task(wait())
+        for _ in range(3):
+            await asyncio.sleep(0) # Let it report its position and start waiting
+        provider.release(0.0) # Grants the second ticket
+        assert second.granted.done()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return provider.running
+
+    assert asyncio.run(main()) == 0
+
+
+def test_cancel_while_queued_leaves_the_queue():
+    async def main():
+        scheduler = Scheduler()
+        provider = ProviderScheduler("fake", 1, 60, 10, {})
+        provider.enqueue("a", "g", 1)
+        second = provider.enqueue("b", "g", 1)
+
+        async def wait():
+            async for _ in scheduler.positions(provider, second, interval=1.0):
+                pass
+
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        provider.release(0.0)
+        return provider.running, provider.depth
+
+    assert asyncio.run(main()) == (0, 0)
@@ -0,0 +1,344 @@
+import ast
+import json
+import math
+import operator
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+from dotenv import load_dotenv
+load_dotenv()
+
+from models.Log import LogSearch
+from util.log_store import log_store
+from util.rag_utils import rag_store
+
+AGENT_TOOL_TIMEOUT = float(os.getenv("AGENT_TOOL_TIMEOUT", "10"))
+AGENT_TOOL_CACHE_SIZE = int(os.getenv("AGENT_TOOL_CACHE_SIZE", "1024"))
+AGENT_TOOL_CACHE_TTL = float(os.getenv("AGENT_TOOL_CACHE_TTL", "300"))
+
+
+class ToolError(Exception):
+    """
+    A tool call that cannot be answered, e.g. invalid arguments. The message is
+    sent back to the model so it can correct the call.
+    """
+    pass
+
+
+class Tool:
+    """
+    A function the agent's model may call.
+
+    :param parameters: JSON schema of the keyword arguments.
+    :param deterministic: The result only depends on the arguments and the
+        ``context`` fields listed in ``scope``, so it may be cached.
+    :param ttl: Seconds a cached result stays valid across agent runs.
+    :param scope: Request context fields the result depends on. They are part of
+        the cache key, so one guild never sees another guild's cached results.
+    """
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            parameters: dict,
+            fn: Callable[..., Awaitable],
+            deterministic: bool = False,
+            ttl: float = AGENT_TOOL_CACHE_TTL,
+            timeout: float = AGENT_TOOL_TIMEOUT,
+            scope: tuple[str, ...] = (),
+            ):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.fn = fn
+        self.deterministic = deterministic
+        self.ttl = ttl
+        self.timeout = timeout
+        self.scope = scope
+
+    def schema(self) -> dict:
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+    def key(self, args: dict, context: dict) -> str:
+        return json.dumps([self.name, args, [context.get(field) for field in self.scope]], sort_keys=True, default=str)
+
+    def check(self, args: dict):
+        """
+        :raises ToolError: If a required argument is missing or an unknown one is given.
+        """
+        properties = self.parameters.get("properties", {})
+        missing = [name for name in self.parameters.get("required", []) if name not in args]
+        if missing:
+            raise ToolError(f"Missing arguments: {', '.join(missing)}")
+        unknown = [name for name in args if name not in properties]
+        if unknown:
+            raise ToolError(f"Unknown arguments: {', '.join(unknown)}")
+
+
+class ToolRegistry:
+    def __init__(self):
+        self.tools: dict[str, Tool] = {}
+
+    def register(self, name: str, description: str, parameters: dict | None = None, **options):
+        """
+        Decorates an async function ``fn(context, **args)`` to register it as a tool.
+        ``options`` are passed to ``Tool``.
+        """
+        def decorator(fn):
+            self.tools[name] = Tool(
+                name, description, parameters or {"type": "object", "properties": {}}, fn, **options
+            )
+            return fn
+        return decorator
+
+    def get(self, name: str) -> Tool | None:
+        return self.tools.get(name)
+
+    def select(self, names: list[str] | None = None) -> list[Tool]:
+        """
+        :raises ValueError: If a name is not a registered tool.
+        """
+        if names is None:
+            return list(self.tools.values())
+        unknown = [name for name in names if name not in self.tools]
+        if unknown:
+            raise ValueError(f"Unknown tools: {', '.join(unknown)}")
+        return [self.tools[name] for name in names]
+
+
+class ToolCache:
+    """
+    In-process LRU store of deterministic tool results, each valid for its
+    tool's ``ttl`` seconds.
+    """
+    def __init__(self, max_entries: int = AGENT_TOOL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> tuple[bool, object]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, key: str, value, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+tools = ToolRegistry()
+
+
+# ------------------------------------------------------------------------------
+# Calculator
+# ------------------------------------------------------------------------------
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+FUNCTIONS = {
+    name: getattr(math, name)
+    for name in ("sqrt", "log", "log10", "log2", "exp", "sin", "cos", "tan", "floor", "ceil", "factorial")
+} | {"abs": abs, "round": round, "min": min, "max": max}
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+MAX_EXPONENT = 1000
+# Integer results are bounded too: big integer math runs on the event loop and
+# cannot be interrupted by the tool timeout. 10000 bits stays below Python's
+# 4300 digit limit for turning the result into text
+MAX_INT_BITS = 10_000
+
+
+def _int_bits(op: ast.operator, left, right) -> int:
+    """
+    Upper bound of the bits of an integer ``left op right``, 0 if either is not an int.
+    """
+    if not (isinstance(left, int) and isinstance(right, int)):
+        return 0
+    if isinstance(op, ast.Pow):
+        return left.bit_length() * right if right > 0 and abs(left) > 1 else 0
+    if isinstance(op, ast.Mult):
+        return left.bit_length() + right.bit_length()
+    return max(left.bit_length(), right.bit_length()) + 1
+
+
+def evaluate(expression: str):
+    """
+    Evaluates an arithmetic expression without ``eval``. Only numbers, the
+    operators in ``OPERATORS`` and the names in ``FUNCTIONS`` and ``CONSTANTS``
+    are allowed, and exponents and integer sizes are bounded before computing
+    so one call cannot hog the process.
+
+    :raises ToolError: If the expression uses anything else or cannot be computed.
+    """
+    def visit(node):
+        if isinstance(node, ast.Expression):
+            return visit(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in CONSTANTS:
+            return CONSTANTS[node.id]
+        if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](visit(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            left, right = visit(node.left), visit(node.right)
+            if isinstance(node.op, ast.Pow) and abs(right) > MAX_EXPONENT:
+                raise ToolError(f"Exponents are limited to {MAX_EXPONENT}")
+            if _int_bits(node.op, left, right) > MAX_INT_BITS:
+                raise ToolError(f"Integer results are limited to {MAX_INT_BITS} bits")
+            return OPERATORS[type(node.op)](left, right)
+        if (
+            isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS and not node.keywords
+        ):
+            args = [visit(arg) for arg in node.args]
+            if node.func.id == "factorial" and args and args[0] > MAX_EXPONENT:
+                raise ToolError(f"factorial is limited to {MAX_EXPONENT}")
+            result = FUNCTIONS[node.func.id](*args)
+            if isinstance(result, int) and result.bit_length() > MAX_INT_BITS:
+                raise ToolError(f"Integer results are limited to {MAX_INT_BITS} bits")
+            return result
+        raise ToolError(f"Unsupported expression: {ast.dump(node)[:80]}")
+
+    if len(expression) > 500:
+        raise ToolError("The expression is longer than 500 characters")
+    try:
+        return visit(ast.parse(expression, mode="eval"))
+    except SyntaxError as e:
+        raise ToolError(f"Invalid expression: {e.msg}")
+    except (ArithmeticError, TypeError, ValueError) as e:
+        raise ToolError(f"Cannot compute {expression}: {e}")
+
+
+@tools.register(
+    "calculator",
+    "Evaluates an arithmetic expression, e.g. 2 * (3 + 4) ** 2 or sqrt(2) * pi. Use it instead of doing math yourself.",
+    {
+        "type": "object",
+        "properties": {"expression": {"type": "string", "description": "Python style arithmetic expression"}},
+        "required": ["expression"],
+    },
+    deterministic=True,
+    ttl=86400,
+)
+async def calculator(context: dict, expression: str):
+    return {"expression": expression, "result": evaluate(expression)}
+
+
+# ------------------------------------------------------------------------------
+# Local lookups
+# ------------------------------------------------------------------------------
+
+@tools.register(
+    "current_time",
+    "Returns the current date and time.",
+    {
+        "type": "object",
+        "properties": {"timezone": {"type": "string", "description": "IANA time zone, e.g. Europe/Berlin. Defaults to UTC"}},
+    },
+)
+async def current_time(context: dict, timezone: str = "UTC"):
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        zone = ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ToolError(f"Unknown time zone: {timezone}")
+    now = datetime.now(zone)
+    return {"timezone": timezone, "datetime": now.isoformat(timespec="seconds"), "weekday": now.strftime("%A")}
+
+
+@tools.register(
+    "search_logs",
+    "Searches this server's event log (messages, edits, deletions, joins, reactions), newest first.",
+    {
+        "type": "object",
+        "properties": {
+            "text": {"type": "string", "description": "Words that must all appear in the log message"},
+            "user_id": {"type": "integer", "description": "Discord user ID"},
+            "event": {"type": "string", "description": "Event type, e.g. message, message_delete, member_join"},
+            "level": {"type": "string", "enum": ["DEBUG", "INFO", "WARNING", "ERROR"], "description": "Minimum level"},
+            "hours": {"type": "number", "description": "How far back to search, default 24"},
+            "limit": {"type": "integer", "description": "Maximum number of entries, default 10"},
+        },
+    },
+    deterministic=True,
+    ttl=30, # New events arrive all the time
+    scope=("guild_id",),
+)
+async def search_logs(
+        context: dict,
+        text: str | None = None,
+        user_id: int | None = None,
+        event: str | None = None,
+        level: str | None = None,
+        hours: float = 24,
+        limit: int = 10,
+        ):
+    if not context.get("guild_id"):
+        raise ToolError("The log can only be searched from inside a server")
+    page = await log_store.search(LogSearch(
+        guild_id=int(context["guild_id"]),
+        user_id=user_id,
+        event=event,
+        level=level,
+        text=text,
+        since=datetime.now(timezone.utc) - timedelta(hours=min(max(hours, 0), 24 * 30)),
+        limit=min(max(limit, 1), 50),
+    ))
+    return [
+        {"timestamp": entry.timestamp.isoformat(timespec="seconds"), "event": entry.event, "message": entry.message}
+        for entry in page.logs
+    ]
+
+
+@tools.register(
+    "lookup_documents",
+    "Finds the passages of the indexed documents most relevant to a query.",
+    {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "What to look for"},
+            "k": {"type": "integer", "description": "Number of passages, default 4"},
+        },
+        "required": ["query"],
+    },
+    deterministic=True,
+    ttl=300,
+)
+async def lookup_documents(context: dict, query: str, k: int = 4):
+    chunks = await rag_store.retrieve(query, min(max(k, 1), 10))
+    return [{"doc_id": chunk["doc_id"], "text": chunk["text"], "score": round(chunk["score"], 3)} for chunk in chunks]
+
+
+@tools.register(
+    "game_stats",
+    "Returns the user's results in the bot's games (coinflip, rps).",
+)
+async def game_stats(context: dict):
+    stats = context.get("game_stats")
+    if stats is None:
+        raise ToolError("No game stats were sent with this request")
+    return stats
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable
+from dotenv import load_dotenv
+load_dotenv()
+
+from util.agent_tools import Tool, ToolCache, ToolError, ToolRegistry, tools as default_tools
+from util.metrics import registry as metrics
+from util.singleflight import SingleFlight
+
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "6"))
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "60"))
+# The answer forced after the time budget ran out gets at least this long
+AGENT_ANSWER_TIMEOUT = float(os.getenv("AGENT_ANSWER_TIMEOUT", "30"))
+AGENT_TOOL_MAX_CHARS = int(os.getenv("AGENT_TOOL_MAX_CHARS", "4000"))
+
+AGENT_PROMPT = (
+    "You are the assistant of a Discord bot. Call the available tools when they help to answer, "
+    "several in one step when they do not depend on each other. Answer in plain text once you "
+    "have what you need."
+)
+
+AGENT_RUNS = metrics.counter("agent_runs_total", "Agent runs, by why they stopped")
+AGENT_TOOL_LATENCY = metrics.histogram("agent_tool_duration_seconds", "Agent tool calls, by tool and cache hit")
+AGENT_TOOL_ERRORS = metrics.counter("agent_tool_errors_total", "Agent tool calls that failed or timed out")
+
+# (messages, tool schemas or None, timeout) -> AIMessage
+Invoke = Callable[[list, list[dict] | None, float], Awaitable]
+
+
+def _text(message) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    # Some providers answer with a list of content blocks
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in message.content
+    )
+
+
+class _Run:
+    def __init__(self, context: dict, deadline: float):
+        self.context = context
+        self.deadline = deadline
+        self.start = time.monotonic()
+        self.memo: dict[str, object] = {} # Deterministic results of this run
+        self.trace: list[dict] = []
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def record(self, start: float, **entry):
+        self.trace.append({**entry, "duration_ms": round((time.monotonic() - start) * 1000, 1)})
+
+
+class Agent:
+    """
+    Runs a model in a loop with tools: each step the model either answers or asks
+    for tool calls, whose results are added to the conversation for the next step.
+
+    The tool calls of one step run concurrently. Results of deterministic tools are
+    memoized for the rest of the run and kept in a TTL cache shared by every run,
+    and identical calls running at the same time share one execution. A run makes
+    at most ``max_steps`` model calls and stops calling tools after ``max_seconds``;
+    either way the model is then asked to answer without tools.
+    """
+    def __init__(self, registry: ToolRegistry = default_tools, cache: ToolCache | None = None):
+        self.registry = registry
+        self.cache = cache or ToolCache()
+        self.flight = SingleFlight()
+        self.runs = 0
+
+    async def run(
+            self,
+            prompt: list,
+            invoke: Invoke,
+            context: dict | None = None,
+            tool_names: list[str] | None = None,
+            max_steps: int | None = None,
+            max_seconds: float | None = None,
+            ) -> dict:
+        """
+        :param prompt: The conversation as (role, content) tuples, ending with the user's message.
+        :param invoke: Calls the model with the messages, the tool schemas (None to
+            force an answer) and a timeout, and returns its message.
+        :param context: Request data the tools read, e.g. ``guild_id``.
+        :param tool_names: Tools the model may call, all registered ones by default.
+        :return: The answer's ``content``, why the run ``stopped`` (``answer``,
+            ``max_steps`` or ``max_seconds``), the number of model ``steps`` and
+            ``tool_calls``, and the ``trace`` of every model and tool call with its duration.
+        :rtype: dict
+        :raises ValueError: If a tool name is not registered.
+        """
+        from langchain_core.messages import ToolMessage # Only loaded once an agent runs
+
+        selected = {tool.name: tool for tool in self.registry.select(tool_names)}
+        schemas = [tool.schema() for tool in selected.values()] or None
+        max_steps = max(1, AGENT_MAX_STEPS if max_steps is None else max_steps)
+        max_seconds = AGENT_MAX_SECONDS if max_seconds is None else max_seconds
+        run = _Run(context or {}, time.monotonic() + max_seconds)
+        messages = [("system", AGENT_PROMPT), *prompt]
+        self.runs += 1
+
+        stopped = "max_steps"
+        message = None
+        for step in range(1, max_steps + 1):
+            if run.remaining() <= 0:
+                stopped = "max_seconds"
+                break
+            final = step == max_steps or schemas is None
+            start = time.monotonic()
+            message = await invoke(messages, None if final else schemas, run.remaining())
+            run.record(start, step=step, kind="llm", name="model", tool_calls=len(message.tool_calls))
+            messages.append(message)
+            if not message.tool_calls:
+                if not final or schemas is None:
+                    stopped = "answer"
+                break
+            results = await asyncio.gather(*(
+                self._call(run, step, call, selected) for call in message.tool_calls
+            ))
+            messages.extend(
+                ToolMessage(content=content, tool_call_id=call["id"])
+                for call, content in zip(message.tool_calls, results)
+            )
+
+        if stopped == "max_seconds":
+            start = time.monotonic()
+            message = await invoke(messages, None, max(run.remaining(), AGENT_ANSWER_TIMEOUT))
+            run.record(start, step=step, kind="llm", name="final_answer", tool_calls=0)
+
+        AGENT_RUNS.inc(stopped=stopped)
+        tool_entries = [entry for entry in run.trace if entry["kind"] == "tool"]
+        return {
+            "content": _text(message),
+            "type": "ai",
+            "stopped": stopped,
+            "steps": sum(1 for entry in run.trace if entry["kind"] == "llm"),
+            "tool_calls": len(tool_entries),
+            "cached_tool_calls": sum(1 for entry in tool_entries if entry["cached"]),
+            "duration_ms": round((time.monotonic() - run.start) * 1000, 1),
+            "trace": run.trace,
+        }
+
+    async def _call(self, run: _Run, step: int, call: dict, selected: dict[str, Tool]) -> str:
+        """
+        Runs one tool call and returns its result as JSON for the model. Failures
+        are returned as ``{"error": ...}`` so the model can react to them.
+        """
+        start = time.monotonic()
+        name, args = call["name"], call.get("args") or {}
+        tool = selected.get(name)
+        cached = None
+        error = None
+        try:
+            if tool is None:
+                raise ToolError(f"Unknown tool: {name}")
+            tool.check(args)
+            timeout = min(tool.timeout, run.remaining())
+            if timeout <= 0:
+                raise ToolError("The run's time budget is used up")
+            try:
+                result, cached = await asyncio.wait_for(self._result(run, tool, args), timeout)
+            except asyncio.TimeoutError:
+                raise ToolError(f"{name} did not finish within {timeout:.1f}s")
+            content = json.dumps(result, default=str)
+        except ToolError as e:
+            error = str(e)
+        except Exception as e:
+            error = f"{name} failed: {e}"
+        label = name if tool is not None else "unknown" # Names come from the model
+        if error is not None:
+            AGENT_TOOL_ERRORS.inc(tool=label)
+            content = json.dumps({"error": error})
+        AGENT_TOOL_LATENCY.observe(time.monotonic() - start, tool=label, cached=cached or "no")
+        run.record(start, step=step, kind="tool", name=name, cached=cached, error=error)
+        if len(content) > AGENT_TOOL_MAX_CHARS:
+            content = content[:AGENT_TOOL_MAX_CHARS] + " [truncated]"
+        return content
+
+    async def _result(self, run: _Run, tool: Tool, args: dict) -> tuple[object, str | None]:
+        """
+        :return: The tool's result and where it came from: ``turn`` (this run's
+            memo), ``ttl`` (the shared cache) or None (executed).
+        """
+        if not tool.deterministic:
+            return await tool.fn(run.context, **args), None
+        key = tool.key(args, run.context)
+        if key in run.memo:
+            return run.memo[key], "turn"
+        found, value = self.cache.get(key)
+        if found:
+            run.memo[key] = value
+            return value, "ttl"
+
+        async def execute():
+            value = await tool.fn(run.context, **args)
+            self.cache.set(key, value, tool.ttl) # Also when the caller already timed out
+            return value
+
+        value = await self.flight.do(key, execute)
+        run.memo[key] = value
+        return value, None
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "tools": list(self.registry.tools),
+            "tool_cache": self.cache.stats(),
+            "coalescing": self.flight.stats(),
+        }
+
+
+agent = Agent()
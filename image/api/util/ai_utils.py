@@ -1,49 +1,398 @@
-from langchain_community.chat_models import ChatOpenAI, ChatAnthropic
-from langchain_ollama import ChatOllama
-from langchain_aws import ChatBedrock
+import asyncio
+import functools
+import importlib
+import math
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
+from util.llm_registry import LLMRegistry, close_client, make_key
+from util.metrics import registry as metrics, timed, timed_stream, RATE_BUCKETS
+from util.ollama_utils import ollama_warmer
 
-async def get_llm(name: str, model: str, **kwargs):
+_bedrock_client = None
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+
+
+def _new_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("LLM_THREAD_POOL_SIZE", "8")),
+        thread_name_prefix="llm-invoke",
+    )
+
+
+# Used only for providers without a native async client
+_executor = _new_executor()
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+# Provider classes are imported on first use, so a process that only talks to
+# one provider never pays for importing the others
+PROVIDERS = {
+    "openai": ("langchain_community.chat_models", "ChatOpenAI"),
+    "anthropic": ("langchain_community.chat_models", "ChatAnthropic"),
+    "bedrock": ("langchain_aws", "ChatBedrock"),
+    "ollama": ("langchain_ollama", "ChatOllama"),
+    "fake": ("util.fake_llm", "FakeChatModel"),
+}
+
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+
+@functools.cache
+def provider_class(name: str) -> type:
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    module, attribute = PROVIDERS[name]
+    return getattr(importlib.import_module(module), attribute)
+
+
+@functools.cache
+def _base_chat_model() -> type:
+    from langchain_core.language_models.chat_models import BaseChatModel
+    return BaseChatModel
+
+
+LLM_LATENCY = metrics.histogram("llm_request_duration_seconds", "Full LLM invocations, by provider and model")
+LLM_ERRORS = metrics.counter("llm_request_errors_total", "Failed or timed out LLM invocations")
+LLM_TTFT = metrics.histogram("llm_time_to_first_token_seconds", "Time until a stream yields its first piece")
+LLM_TOKEN_RATE = metrics.histogram(
+    "llm_stream_tokens_per_second",
+    "Streamed pieces per second after the first one, about one token each",
+    RATE_BUCKETS,
+)
+LLM_STREAM_DURATION = metrics.histogram("llm_stream_duration_seconds", "Complete LLM streams")
+LLM_BATCH_ITEMS = metrics.counter("llm_batch_items_total", "Batched LLM queries, by provider, model and outcome")
+
+
+def _llm_labels(llm, model, **_) -> dict:
+    return {"provider": llm, "model": model}
+
+
+async def _close_llm(client):
+    if _bedrock_client is not None and getattr(client, "client", None) is _bedrock_client:
+        return # The boto3 client is shared between models and closed in close_llms
+    await close_client(client)
+
+
+registry = LLMRegistry(
+    max_size=int(os.getenv("LLM_REGISTRY_SIZE", "8")),
+    idle_ttl=float(os.getenv("LLM_REGISTRY_IDLE_TTL", "900")),
+    closer=_close_llm,
+)
+
+
+def _get_bedrock_client():
+    """
+    Returns one boto3 bedrock-runtime client shared by every Bedrock model so they
+    reuse the same session and connection pool.
+    """
+    global _bedrock_client
+    if _bedrock_client is None:
+        import boto3
+        from botocore.config import Config
+        _bedrock_client = boto3.client(
+            "bedrock-runtime",
+            region_name="us-east-1",
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+            config=Config(max_pool_connections=int(os.getenv("BEDROCK_MAX_POOL", "20"))),
+        )
+    return _bedrock_client
+
+
+def _build_llm(name: str, model: str, **kwargs):
     if name == "openai":
         # model = "gpt-4o"
-        return ChatOpenAI( 
-            model=model, 
+        return provider_class(name)(
+            model=model,
             **kwargs
         )
     elif name == "anthropic":
         # model = "claude-3-sonnet-20240620"
-        return ChatAnthropic(
-            model=model, 
+        return provider_class(name)(
+            model=model,
             **kwargs
         )
     elif name == "bedrock":
         # model = "anthropic.claude-3-sonnet-20240229-v1:0"
-        return ChatBedrock(
+        return provider_class(name)(
             # credentials_profile_name="bedrock-profile", Might need to readd this
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+            client=_get_bedrock_client(),
             region="us-east-1",
-            model=model, 
+            model=model,
             **kwargs
         )
     elif name == "ollama":
         # model = "deepseek-r1:8b"
         ollama_url = os.getenv("OLLAMA_BASE_URL")
-        return ChatOllama(
-            model=model, 
-            temperature=0.7, 
+        return provider_class(name)(
+            model=model,
+            temperature=0.7,
             base_url=ollama_url,
             reasoning=False,
             **kwargs
         )
+    elif name == "fake" and os.getenv("FAKE_LLM_ENABLED", "false").lower() == "true":
+        # Deterministic offline provider for the benchmarks, disabled unless asked for
+        return provider_class(name)(
+            model=model,
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.2")),
+            token_rate=float(os.getenv("FAKE_LLM_TOKEN_RATE", "50")),
+            tokens=int(os.getenv("FAKE_LLM_TOKENS", "64")),
+            **kwargs
+        )
     else:
         raise ValueError(f"Unknown LLM provider: {name}")
-    
-    
-async def query_llm(query, llm, model, **kwargs):
-    inst_llm = await get_llm(llm, model, **kwargs)
-    return inst_llm.invoke(query)
 
+
+def _attachment_content(content: str, attachments: list) -> str | list:
+    """
+    Adds extracted attachment text to the user message. With images the message
+    becomes a list of text and image parts, which every chat provider accepts.
+    """
+    texts = [content]
+    images = []
+    for attachment in attachments:
+        if attachment.image:
+            images.append({"type": "image_url", "image_url": {"url": attachment.image}})
+        elif attachment.text:
+            note = " (truncated)" if attachment.truncated else ""
+            texts.append(f"Attached file {attachment.filename}{note}:\n```\n{attachment.text}\n```")
+    text = "\n\n".join(texts)
+    if not images:
+        return text
+    return [{"type": "text", "text": text}, *images]
+
+
+def build_prompt(
+        content: str,
+        messages: list | None = None,
+        summary: str | None = None,
+        context: list[str] | None = None,
+        attachments: list | None = None,
+        ):
+    """
+    Turns a query, its conversation history and retrieved document chunks into the
+    model input. A query without history, context or attachments stays a plain string.
+
+    :param content: The new user message.
+    :param messages: Earlier turns with ``role`` and ``content`` attributes, oldest first.
+    :param summary: Summary of turns that are no longer part of ``messages``.
+    :param context: Retrieved document chunks, most relevant first.
+    :param attachments: Processed attachments of the new message.
+    :return: The prompt string, or a list of (role, content) tuples.
+    """
+    if not messages and not summary and not context and not attachments:
+        return content
+    prompt = []
+    if context:
+        sources = "\n\n".join(f"[{i}] {chunk}" for i, chunk in enumerate(context, 1))
+        prompt.append(("system", f"Answer using these documents when they are relevant:\n\n{sources}"))
+    if summary:
+        prompt.append(("system", f"Summary of the earlier conversation:\n{summary}"))
+    prompt.extend((message.role.value, message.content) for message in messages or [])
+    prompt.append(("human", _attachment_content(content, attachments or [])))
+    return prompt
+
+
+def lease_llm(name: str, model: str, **kwargs):
+    """
+    Async context manager yielding a cached client that will not be closed by
+    registry eviction while the caller is still using it.
+    """
+    key = make_key(name, model, kwargs)
+    return registry.lease(key, lambda: _build_llm(name, model, **kwargs))
+
+
+async def close_llms():
+    """
+    Closes every cached client and the shared Bedrock client on shutdown. Clients
+    are rebuilt on demand if the process serves again.
+    """
+    global _bedrock_client, _executor
+    await registry.close()
+    if _bedrock_client is not None:
+        _bedrock_client.close()
+        _bedrock_client = None
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = _new_executor() # Threads start on first use, and the process may serve again
+
+
+async def warm_up(providers: list[str]):
+    """
+    Imports provider modules ahead of the first query, in a thread so startup
+    work elsewhere can proceed. Unknown providers are skipped.
+    """
+    for name in providers:
+        if name in PROVIDERS:
+            await asyncio.to_thread(provider_class, name)
+
+
+def get_semaphore(name: str) -> asyncio.Semaphore:
+    """
+    Returns the concurrency limiter for a provider. The limit is read from
+    ``LLM_CONCURRENCY_<PROVIDER>`` and falls back to ``LLM_CONCURRENCY``.
+    """
+    semaphore = _semaphores.get(name)
+    if semaphore is None:
+        limit = int(os.getenv(f"LLM_CONCURRENCY_{name.upper()}", LLM_CONCURRENCY))
+        semaphore = _semaphores[name] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+def has_native_async(inst_llm) -> bool:
+    """
+    True when the provider overrides ``_agenerate``. Otherwise LangChain's default
+    ``ainvoke`` just hands ``invoke`` to the loop's unbounded default executor.
+    """
+    return type(inst_llm)._agenerate is not _base_chat_model()._agenerate
+
+
+async def _invoke(inst_llm, query, tools: list[dict] | None = None, **params):
+    runnable = inst_llm.bind_tools(tools) if tools else inst_llm
+    if params:
+        runnable = runnable.bind(**params)
+    if has_native_async(inst_llm):
+        return await runnable.ainvoke(query)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, runnable.invoke, query)
+
+
+@timed(LLM_LATENCY, _llm_labels, errors=LLM_ERRORS)
+async def query_llm(query, llm, model, timeout: float | None = None, tools: list[dict] | None = None, **kwargs):
+    """
+    Sends the query to the model without blocking the event loop.
+
+    The call waits on the provider's concurrency limit and is cancelled after
+    ``timeout`` seconds (``LLM_TIMEOUT`` by default). A call that fell back to the
+    thread pool keeps running in its thread until the provider returns.
+
+    :param tools: Tool schemas in the OpenAI function format the model may call.
+        The calls are returned in the message's ``tool_calls``, not executed.
+    :raises LLMTimeoutError: If the model does not answer within the timeout.
+    """
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+
+    async def _run():
+        async with get_semaphore(llm):
+            async with lease_llm(llm, model, **kwargs) as inst_llm:
+                return await _invoke(inst_llm, query, tools, **ollama_warmer.params(llm, model))
+
+    try:
+        return await asyncio.wait_for(_run(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise LLMTimeoutError(f"{llm} ({model}) did not answer within {timeout}s")
+
+
+def has_native_stream(inst_llm) -> bool:
+    return type(inst_llm)._astream is not _base_chat_model()._astream
+
+
+@timed_stream(LLM_TTFT, LLM_TOKEN_RATE, LLM_STREAM_DURATION, _llm_labels)
+async def stream_llm(query, llm, model, timeout: float | None = None, **kwargs):
+    """
+    Yields the model's answer as text pieces while it is being generated.
+
+    Providers without a native async stream are invoked in the thread pool and
+    their full answer is yielded as a single piece. The whole generation shares one
+    ``timeout`` deadline, checked while waiting for each piece.
+
+    :raises LLMTimeoutError: If the deadline passes before the stream finishes.
+    """
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+
+    async def _wait(awaitable):
+        remaining = deadline - time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(remaining, 0))
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"{llm} ({model}) did not answer within {timeout}s")
+
+    semaphore = get_semaphore(llm)
+    await _wait(semaphore.acquire())
+    try:
+        async with lease_llm(llm, model, **kwargs) as inst_llm:
+            params = ollama_warmer.params(llm, model)
+            if not has_native_stream(inst_llm):
+                message = await _wait(_invoke(inst_llm, query, **params))
+                yield message.content
+                return
+            chunks = inst_llm.astream(query, **params).__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await _wait(chunks.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    if isinstance(chunk.content, str) and chunk.content:
+                        yield chunk.content
+            finally:
+                await chunks.aclose()
+    finally:
+        semaphore.release()
+
+
+async def batch_llm(queries: list, llm, model, max_concurrency: int = 4, timeout: float | None = None, **kwargs):
+    """
+    Sends many queries to one model through the provider's batch API and yields
+    ``(position, message)`` for each query as it finishes. A failed query yields
+    its exception instead, so one failure does not fail the others.
+
+    At most ``max_concurrency`` queries are generated at once. The batch as a whole
+    holds one of the provider's concurrency slots and has ``timeout`` seconds
+    (``LLM_TIMEOUT`` by default) per round of ``max_concurrency`` queries; queries
+    still running at the deadline yield an ``LLMTimeoutError``. Providers without
+    a native async client run their synchronous ``batch`` in the thread pool and
+    yield every result when the whole batch is done.
+    """
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout * math.ceil(len(queries) / max_concurrency)
+    config = {"max_concurrency": max_concurrency}
+    pending = set(range(len(queries)))
+
+    def _outcome(result) -> str:
+        return "error" if isinstance(result, BaseException) else "ok"
+
+    async with get_semaphore(llm):
+        async with lease_llm(llm, model, **kwargs) as inst_llm:
+            params = ollama_warmer.params(llm, model)
+            runnable = inst_llm.bind(**params) if params else inst_llm
+            if has_native_async(inst_llm):
+                results = runnable.abatch_as_completed(queries, config, return_exceptions=True).__aiter__()
+                try:
+                    while pending:
+                        try:
+                            position, result = await asyncio.wait_for(
+                                results.__anext__(), timeout=max(deadline - time.monotonic(), 0)
+                            )
+                        except (StopAsyncIteration, asyncio.TimeoutError):
+                            break
+                        pending.discard(position)
+                        LLM_BATCH_ITEMS.inc(provider=llm, model=model, outcome=_outcome(result))
+                        yield position, result
+                finally:
+                    await results.aclose()
+            else:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(
+                    _executor, functools.partial(runnable.batch, queries, config, return_exceptions=True)
+                )
+                try:
+                    results = await asyncio.wait_for(future, timeout=max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    results = []
+                for position, result in enumerate(results):
+                    pending.discard(position)
+                    LLM_BATCH_ITEMS.inc(provider=llm, model=model, outcome=_outcome(result))
+                    yield position, result
+    for position in sorted(pending):
+        LLM_BATCH_ITEMS.inc(provider=llm, model=model, outcome="timeout")
+        yield position, LLMTimeoutError(f"{llm} ({model}) did not answer within the batch deadline")
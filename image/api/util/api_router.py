@@ -1,7 +1,13 @@
 from fastapi import APIRouter
-from endpoints import health, query, reset
+from endpoints import agent, attachments, documents, health, logs, metrics, query, reset, ws
 
 api_router = APIRouter()
 api_router.include_router(reset.router)
 api_router.include_router(health.router)
 api_router.include_router(query.router)
+api_router.include_router(documents.router)
+api_router.include_router(metrics.router)
+api_router.include_router(attachments.router)
+api_router.include_router(logs.router)
+api_router.include_router(agent.router)
+api_router.include_router(ws.router)
\ No newline at end of file
@@ -0,0 +1,294 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator
+from xml.etree import ElementTree
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from models.Query import AttachmentEnum
+from util.singleflight import SingleFlight
+
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+ATTACHMENT_MAX_CHARS = int(os.getenv("ATTACHMENT_MAX_CHARS", "20000"))
+ATTACHMENT_MAX_PAGES = int(os.getenv("ATTACHMENT_MAX_PAGES", "50"))
+ATTACHMENT_IMAGE_MAX_SIDE = int(os.getenv("ATTACHMENT_IMAGE_MAX_SIDE", "1024"))
+ATTACHMENT_IMAGE_MAX_PIXELS = int(os.getenv("ATTACHMENT_IMAGE_MAX_PIXELS", str(64 * 1024 * 1024)))
+ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", "2"))
+ATTACHMENT_TIMEOUT = float(os.getenv("ATTACHMENT_TIMEOUT", "60"))
+
+IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp", "bmp", "tiff"}
+CODE_EXTENSIONS = {
+    "py", "js", "ts", "jsx", "tsx", "java", "kt", "c", "h", "cpp", "hpp", "cs", "go", "rs",
+    "rb", "php", "swift", "lua", "sh", "ps1", "sql", "r", "scala", "dart", "toml", "ini",
+}
+DOCUMENT_EXTENSIONS = {"txt", "md", "rst", "csv", "tsv", "json", "yaml", "yml", "xml", "html", "htm", "log", "docx"}
+
+
+class AttachmentError(Exception):
+    pass
+
+
+class UnsupportedAttachmentError(AttachmentError):
+    pass
+
+
+class AttachmentTooLargeError(AttachmentError):
+    pass
+
+
+def detect_kind(filename: str, content_type: str | None = None) -> AttachmentEnum:
+    """
+    Classifies an attachment by its extension, falling back to its content type.
+
+    :raises UnsupportedAttachmentError: If the file is not something we can extract.
+    """
+    extension = Path(filename).suffix.lower().lstrip(".")
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if extension in IMAGE_EXTENSIONS or content_type.startswith("image/"):
+        return AttachmentEnum.image
+    if extension == "pdf" or content_type == "application/pdf":
+        return AttachmentEnum.pdf
+    if extension in CODE_EXTENSIONS:
+        return AttachmentEnum.code
+    if extension in DOCUMENT_EXTENSIONS or content_type.startswith("text/"):
+        return AttachmentEnum.document
+    if content_type.startswith("video/"):
+        raise UnsupportedAttachmentError(f"Video attachments are not supported: {filename}")
+    if content_type.startswith("audio/"):
+        raise UnsupportedAttachmentError(f"Audio attachments are not supported: {filename}")
+    raise UnsupportedAttachmentError(f"Unsupported attachment type: {filename}")
+
+
+async def receive_upload(chunks: AsyncIterator[bytes], max_bytes: int = ATTACHMENT_MAX_BYTES) -> tuple[str, str]:
+    """
+    Writes an upload to a temporary file chunk by chunk while hashing it, so the
+    whole file is never held in memory.
+
+    :return: The temporary file path and the sha256 of the content. The caller owns the file.
+    :raises AttachmentTooLargeError: If the upload exceeds ``max_bytes``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="attachment-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AttachmentTooLargeError(f"Attachment is over the {max_bytes} byte limit")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest()
+
+
+# ------------------------------------------------------------------------------
+# Extraction, run in the process pool
+# ------------------------------------------------------------------------------
+
+def _read_text(path: str, max_chars: int) -> dict:
+    with open(path, "rb") as f:
+        data = f.read(max_chars * 4 + 1) # UTF-8 takes at most four bytes per character
+    if b"\x00" in data[:8192]:
+        raise UnsupportedAttachmentError("File looks binary, not text")
+    text = data.decode("utf-8", errors="replace")
+    return {"text": text[:max_chars], "truncated": len(text) > max_chars or os.path.getsize(path) > len(data)}
+
+
+def _read_docx(path: str, max_chars: int) -> dict:
+    namespace = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(path) as archive:
+        if archive.getinfo("word/document.xml").file_size > 64 * 1024 * 1024:
+            raise AttachmentTooLargeError("Document body is too large to extract")
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = ["".join(node.text or "" for node in p.iter(f"{namespace}t")) for p in root.iter(f"{namespace}p")]
+    text = "\n".join(paragraph for paragraph in paragraphs if paragraph)
+    return {"text": text[:max_chars], "truncated": len(text) > max_chars}
+
+
+def _read_pdf(path: str, max_chars: int, max_pages: int) -> dict:
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    parts, total = [], 0
+    for page in reader.pages[:max_pages]:
+        text = page.extract_text() or ""
+        parts.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    text = "\n\n".join(parts)
+    return {"text": text[:max_chars], "truncated": len(text) > max_chars or len(reader.pages) > max_pages}
+
+
+def _downscale_image(path: str, max_side: int, max_pixels: int) -> dict:
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = max_pixels # Refuse decompression bombs
+    with Image.open(path) as image:
+        image.draft("RGB", (max_side, max_side)) # Lets JPEG decode straight at a reduced size
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85, optimize=True)
+        width, height = image.size
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {"image": f"data:image/jpeg;base64,{encoded}", "text": f"{width}x{height} image"}
+
+
+def extract(path: str, kind: str, filename: str, limits: dict) -> dict:
+    """
+    Turns a stored attachment into prompt material: ``text`` and, for images, a
+    downscaled JPEG data URL in ``image``. Runs in a worker process.
+    """
+    match kind:
+        case AttachmentEnum.image:
+            return _downscale_image(path, limits["max_side"], limits["max_pixels"])
+        case AttachmentEnum.pdf:
+            return _read_pdf(path, limits["max_chars"], limits["max_pages"])
+        case AttachmentEnum.document if filename.lower().endswith(".docx"):
+            return _read_docx(path, limits["max_chars"])
+        case _:
+            return _read_text(path, limits["max_chars"])
+
+
+# ------------------------------------------------------------------------------
+# Processing
+# ------------------------------------------------------------------------------
+
+class ArtifactCache:
+    """
+    Processed attachments stored as JSON files named by content hash and the limits
+    they were processed with, so a re-posted file is not processed again and a
+    change of limits does not serve stale artifacts. The least recently written
+    files are removed beyond ``max_entries``.
+    """
+    def __init__(self, path: str, max_entries: int = 1000):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def get(self, key: str) -> dict | None:
+        try:
+            artifact = json.loads(self._file(key).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return artifact
+
+    def set(self, key: str, artifact: dict):
+        tmp = self._file(key).with_suffix(".tmp")
+        tmp.write_text(json.dumps(artifact))
+        os.replace(tmp, self._file(key))
+        entries = sorted(self.path.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for stale in entries[:max(0, len(entries) - self.max_entries)]:
+            stale.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {"entries": sum(1 for _ in self.path.glob("*.json")), "hits": self.hits, "misses": self.misses}
+
+
+class AttachmentProcessor:
+    """
+    Extracts attachments in a process pool so parsing and image decoding never
+    block the event loop or hold the GIL. At most ``workers * 2`` jobs are queued
+    or running at once, counting jobs that outlived their timeout until they end;
+    identical files processed concurrently share one job.
+    """
+    def __init__(self, cache: ArtifactCache, workers: int = ATTACHMENT_WORKERS, timeout: float = ATTACHMENT_TIMEOUT):
+        self.cache = cache
+        self.workers = workers
+        self.timeout = timeout
+        self.limits = {
+            "max_chars": ATTACHMENT_MAX_CHARS,
+            "max_pages": ATTACHMENT_MAX_PAGES,
+            "max_side": ATTACHMENT_IMAGE_MAX_SIDE,
+            "max_pixels": ATTACHMENT_IMAGE_MAX_PIXELS,
+        }
+        self._tag = hashlib.sha256(json.dumps(self.limits, sort_keys=True).encode()).hexdigest()[:8]
+        self._pool: ProcessPoolExecutor | None = None
+        self._slots = asyncio.Semaphore(workers * 2)
+        self._flight = SingleFlight()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def process(self, path: str, digest: str, kind: AttachmentEnum, filename: str) -> dict:
+        """
+        Returns the artifact of an uploaded file, from the cache when the same
+        content was processed before. Takes ownership of the file at ``path``.
+        """
+        key = f"{digest}-{kind.value}-{self._tag}"
+        owned = False
+
+        async def generate():
+            try:
+                artifact = await asyncio.to_thread(self.cache.get, key)
+                if artifact is not None:
+                    return artifact
+                await self._slots.acquire()
+                try:
+                    future = asyncio.get_running_loop().run_in_executor(
+                        self.pool, extract, path, kind, filename, self.limits
+                    )
+                except BaseException:
+                    self._slots.release()
+                    raise
+                future.add_done_callback(self._job_done) # A timeout does not stop the job in the pool
+                artifact = await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+                await asyncio.to_thread(self.cache.set, key, artifact)
+                return artifact
+            finally:
+                os.unlink(path)
+
+        def start():
+            nonlocal owned
+            owned = True # The job deletes the file once it is done with it
+            return generate()
+
+        try:
+            return await self._flight.do(key, start)
+        finally:
+            if not owned:
+                os.unlink(path)
+
+    def _job_done(self, future: asyncio.Future):
+        self._slots.release()
+        if not future.cancelled():
+            future.exception() # Retrieved, so a job nobody waits for anymore is not logged as unhandled
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {"cache": self.cache.stats(), "coalescing": self._flight.stats(), "workers": self.workers}
+
+
+attachment_processor = AttachmentProcessor(
+    ArtifactCache(
+        os.getenv("ATTACHMENT_CACHE_DIR", "attachment_cache"),
+        int(os.getenv("ATTACHMENT_CACHE_MAX_ENTRIES", "1000")),
+    )
+)
@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+load_dotenv()
+
+if TYPE_CHECKING:
+    import numpy as np # Imported where used, so a cache without embeddings does not load numpy
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Lowercases the prompt, collapses whitespace and drops trailing punctuation so
+    trivially different phrasings share a cache entry.
+    """
+    prompt = re.sub(r"\s+", " ", prompt.strip().lower())
+    return prompt.rstrip(" ?!.")
+
+
+def make_scope(llm: str, model: str, show_thoughts: bool) -> str:
+    return f"{llm}|{model}|{int(show_thoughts)}"
+
+
+def make_cache_key(scope: str, prompt: str) -> str:
+    return hashlib.sha256(f"{scope}|{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+def _unit(vector) -> np.ndarray:
+    import numpy as np
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class EmbeddingIndex:
+    """
+    The embeddings of cached prompts as one normalized float32 matrix per scope, so
+    a semantic lookup is a single matrix-vector product. Holds at most
+    ``max_entries`` rows, dropping the oldest first like the backends do.
+    """
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._keys: dict[str, list[str]] = {}
+        self._matrices: dict[str, np.ndarray] = {}
+        self._scopes: OrderedDict[str, str] = OrderedDict() # key -> scope, oldest first
+
+    def loaded(self, scope: str) -> bool:
+        return scope in self._keys
+
+    def load(self, scope: str, rows: list[tuple[str, list[float]]]):
+        import numpy as np
+        self._keys[scope] = []
+        self._matrices[scope] = np.empty((0, 0), dtype=np.float32)
+        for key, embedding in rows:
+            self.add(scope, key, embedding)
+
+    def add(self, scope: str, key: str, embedding):
+        import numpy as np
+        if scope not in self._keys:
+            return # Loaded from the backend on its first lookup
+        self.remove(key)
+        vector = _unit(embedding)
+        matrix = self._matrices[scope]
+        if matrix.size and matrix.shape[1] != vector.shape[0]:
+            return # Another embedding model, never comparable
+        self._matrices[scope] = np.vstack([matrix, vector]) if matrix.size else vector[np.newaxis, :]
+        self._keys[scope].append(key)
+        self._scopes[key] = scope
+        while len(self._scopes) > self.max_entries:
+            self.remove(next(iter(self._scopes)))
+
+    def remove(self, key: str):
+        import numpy as np
+        scope = self._scopes.pop(key, None)
+        if scope is None:
+            return
+        index = self._keys[scope].index(key)
+        del self._keys[scope][index]
+        self._matrices[scope] = np.delete(self._matrices[scope], index, axis=0)
+
+    def search(self, scope: str, embedding) -> tuple[str | None, float]:
+        """
+        :return: The key of the most similar embedding and its cosine similarity.
+        """
+        matrix = self._matrices.get(scope)
+        if matrix is None or not matrix.size:
+            return None, 0.0
+        vector = _unit(embedding)
+        if vector.shape[0] != matrix.shape[1]:
+            return None, 0.0
+        scores = matrix @ vector
+        best = int(scores.argmax())
+        return self._keys[scope][best], float(scores[best])
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU store. Entries are ``(scope, value, embedding, created)`` tuples.
+    """
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1], entry[3]
+
+    def set(self, key: str, scope: str, value: dict, embedding: list[float] | None):
+        self._entries[key] = (scope, value, embedding, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def embeddings(self, scope: str):
+        return [
+            (key, entry[2]) for key, entry in self._entries.items()
+            if entry[0] == scope and entry[2] is not None
+        ]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        pass
+
+
+class SQLiteCacheBackend:
+    """
+    Local SQLite store so cached answers survive restarts. Least recently accessed
+    rows are deleted once the table grows past ``max_entries``.
+
+    The methods block, ``ResponseCache`` calls them in a thread. A lock keeps those
+    threads from interleaving on the one connection, which is opened on first use.
+    """
+    def __init__(self, path: str, max_entries: int = 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._size = 0 # Kept current by the writes, so stats() does not query
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                value TEXT NOT NULL,
+                embedding TEXT,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_scope ON response_cache (scope)")
+        self._conn.commit()
+        self._count()
+        return self._conn
+
+    def _count(self):
+        self._size = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def get(self, key: str):
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE response_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, scope: str, value: dict, embedding: list[float] | None):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, json.dumps(value), json.dumps(embedding) if embedding else None, now, now)
+            )
+            conn.execute("""
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            conn.commit()
+            self._count()
+
+    def delete(self, key: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            conn.commit()
+            self._count()
+
+    def embeddings(self, scope: str):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, embedding FROM response_cache WHERE scope = ? AND embedding IS NOT NULL", (scope,)
+            ).fetchall()
+        return [(key, json.loads(embedding)) for key, embedding in rows]
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ResponseCache:
+    """
+    Two tier cache for query responses.
+
+    The exact tier matches on (llm, model, normalized prompt, show_thoughts). When an
+    ``embedder`` is configured, a miss falls through to the semantic tier, which
+    returns the closest cached answer for the same llm, model and show_thoughts if
+    its cosine similarity reaches ``threshold``. Entries older than ``ttl`` seconds
+    are treated as misses and removed.
+
+    Backend calls run in a thread when the backend blocks (SQLite), and the
+    embeddings are searched in memory, see ``EmbeddingIndex``.
+    """
+    def __init__(self, backend, ttl: float = 3600.0, embedder=None, threshold: float = 0.95):
+        self.backend = backend
+        self.ttl = ttl
+        self.embedder = embedder
+        self.threshold = threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._pending_embeddings: OrderedDict[str, list[float]] = OrderedDict()
+        self._index = EmbeddingIndex(getattr(backend, "max_entries", 1024))
+
+    async def _call(self, method: str, *args):
+        function = getattr(self.backend, method)
+        if isinstance(self.backend, MemoryCacheBackend):
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    async def _fresh(self, key: str):
+        entry = await self._call("get", key)
+        if entry is None:
+            self._index.remove(key) # Evicted by the backend
+            return None
+        value, created = entry
+        if time.time() - created > self.ttl:
+            self._index.remove(key)
+            await self._call("delete", key)
+            return None
+        return value
+
+    async def get(self, llm: str, model: str, prompt: str, show_thoughts: bool = False) -> dict | None:
+        scope = make_scope(llm, model, show_thoughts)
+        key = make_cache_key(scope, prompt)
+        value = await self._fresh(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.embedder is not None:
+            try:
+                vector = await self.embedder.aembed_query(normalize_prompt(prompt))
+            except Exception as e:
+                print(f"Semantic cache lookup failed: {e}")
+                self.misses += 1
+                return None
+            # Kept so set() does not embed the same prompt twice
+            self._pending_embeddings[key] = vector
+            while len(self._pending_embeddings) > 256:
+                self._pending_embeddings.popitem(last=False)
+            if not self._index.loaded(scope):
+                self._index.load(scope, await self._call("embeddings", scope))
+            best_key, best_score = self._index.search(scope, vector)
+            if best_key is not None and best_score >= self.threshold:
+                value = await self._fresh(best_key)
+                if value is not None:
+                    self.semantic_hits += 1
+                    return value
+        self.misses += 1
+        return None
+
+    async def set(self, llm: str, model: str, prompt: str, value: dict, show_thoughts: bool = False):
+        scope = make_scope(llm, model, show_thoughts)
+        key = make_cache_key(scope, prompt)
+        embedding = self._pending_embeddings.pop(key, None)
+        if embedding is None and self.embedder is not None:
+            try:
+                embedding = await self.embedder.aembed_query(normalize_prompt(prompt))
+            except Exception as e:
+                print(f"Semantic cache embedding failed: {e}")
+        await self._call("set", key, scope, value, embedding)
+        if embedding:
+            self._index.add(scope, key, embedding)
+
+    async def close(self):
+        await self._call("close")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    """
+    Builds the response cache from environment configuration.
+
+    ``CACHE_BACKEND`` selects ``memory`` (default) or ``sqlite`` (stored at
+    ``CACHE_PATH``). Setting ``CACHE_EMBED_MODEL`` enables the semantic tier with
+    Ollama embeddings.
+    """
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    if os.getenv("CACHE_BACKEND", "memory") == "sqlite":
+        backend = SQLiteCacheBackend(os.getenv("CACHE_PATH", "response_cache.sqlite3"), max_entries)
+    else:
+        backend = MemoryCacheBackend(max_entries)
+
+    embedder = None
+    embed_model = os.getenv("CACHE_EMBED_MODEL")
+    if embed_model:
+        from langchain_ollama import OllamaEmbeddings
+        embedder = OllamaEmbeddings(model=embed_model, base_url=os.getenv("OLLAMA_BASE_URL"))
+
+    return ResponseCache(
+        backend,
+        ttl=float(os.getenv("CACHE_TTL", "3600")),
+        embedder=embedder,
+        threshold=float(os.getenv("CACHE_SEMANTIC_THRESHOLD", "0.95")),
+    )
+
+
+response_cache = create_response_cache()
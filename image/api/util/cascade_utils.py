@@ -0,0 +1,303 @@
+import json
+import os
+import re
+import time
+from typing import AsyncIterator, Awaitable, Callable
+from dotenv import load_dotenv
+load_dotenv()
+
+from util.llm_router import router as llm_router, UnknownRouteError
+from util.metrics import registry as metrics
+
+# A small answer is kept when its confidence is at least this (0 to 1)
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.7"))
+# Prompts scoring above this (0 to 1, see complexity) go straight to the large tier
+CASCADE_MAX_COMPLEXITY = float(os.getenv("CASCADE_MAX_COMPLEXITY", "0.6"))
+# The small tier gets this long before the query escalates, unless the tier sets a timeout
+CASCADE_SMALL_TIMEOUT = float(os.getenv("CASCADE_SMALL_TIMEOUT", "20"))
+
+CASCADE_REQUESTS = metrics.counter(
+    "llm_cascade_requests_total", "Cascaded queries, by cascade, the tier that answered and why"
+)
+CASCADE_LATENCY = metrics.histogram("llm_cascade_duration_seconds", "Cascaded queries, by cascade and answering tier")
+CASCADE_SAVED = metrics.counter(
+    "llm_cascade_saved_seconds_total", "Estimated large tier seconds saved by small answers, by cascade"
+)
+CASCADE_OVERHEAD = metrics.counter(
+    "llm_cascade_overhead_seconds_total", "Seconds spent on small attempts that escalated anyway, by cascade"
+)
+
+CONFIDENCE_INSTRUCTION = (
+    "Answer the user's last message. Then, on a final line of its own, rate how sure you are "
+    "that your answer is correct and complete as `Confidence: N/10`."
+)
+CONFIDENCE = re.compile(r"^\W*confidence\W*(\d+(?:\.\d+)?)\s*(/\s*10|%)?\W*$", re.IGNORECASE | re.MULTILINE)
+THINKING = re.compile(r"<think>.*?</think>", re.DOTALL)
+HEDGES = ("i'm not sure", "i am not sure", "i don't know", "i do not know", "i can't answer", "i cannot answer")
+REASONING = re.compile(
+    r"\b(explain|why|prove|derive|compare|analy[sz]e|design|implement|debug|refactor|optimi[sz]e|"
+    r"step by step|essay|summari[sz]e|translate|calculate|plan)\b",
+    re.IGNORECASE,
+)
+CODE = re.compile(r"```|\bdef |\bclass |\bfunction\b|[{};]\s*$", re.MULTILINE)
+
+
+class UnknownCascadeError(UnknownRouteError):
+    pass
+
+
+def complexity(content: str, turns: int = 0, attachments: int = 0, use_rag: bool = False) -> float:
+    """
+    Scores how much a prompt needs the large tier, from 0 (small talk, lookups) to 1.
+    A cheap heuristic, so a prompt that clearly needs the large tier does not pay
+    for a small attempt first: long prompts, code, reasoning requests, several
+    questions, attachments, long conversations and document context all add to it.
+    """
+    words = len(content.split())
+    score = 0.4 * min(1.0, words / 300)
+    if CODE.search(content):
+        score += 0.3
+    if REASONING.search(content):
+        score += 0.25
+    if content.count("?") > 1:
+        score += 0.1
+    if attachments:
+        score += 0.3
+    if use_rag:
+        score += 0.1
+    score += min(0.2, 0.05 * turns)
+    return min(1.0, score)
+
+
+def confidence(text: str) -> tuple[str, float | None]:
+    """
+    Splits the ``Confidence: N/10`` line off a small tier answer.
+
+    :return: The answer without the line, and the confidence from 0 to 1, or None
+        when the model did not rate itself. Hedging answers are capped at 0.3.
+    """
+    matches = list(CONFIDENCE.finditer(text))
+    if not matches:
+        return text.strip(), None
+    match = matches[-1]
+    value = float(match.group(1))
+    value = value / 100 if match.group(2) == "%" or value > 10 else value / 10
+    answer = (text[:match.start()] + text[match.end():]).strip()
+    if any(hedge in THINKING.sub("", answer).lower() for hedge in HEDGES):
+        value = min(value, 0.3)
+    return answer, max(0.0, min(1.0, value))
+
+
+def with_instruction(prompt, instruction: str) -> list:
+    """
+    Puts a system instruction in front of a prompt string or (role, content) list.
+    """
+    if isinstance(prompt, str):
+        return [("system", instruction), ("human", prompt)]
+    return [("system", instruction), *prompt]
+
+
+class Tier:
+    def __init__(self, llm: str, model: str, timeout: float | None = None):
+        self.llm = llm # "route" makes model a route name of LLM_ROUTES
+        self.model = model
+        self.timeout = timeout
+        if llm == "route":
+            llm_router.get(model) # Fails at startup, not on every query
+
+    @property
+    def name(self) -> str:
+        return f"{self.llm}:{self.model}"
+
+    def _timeout(self, candidate) -> float | None:
+        if self.timeout is None:
+            return candidate.timeout
+        return min(candidate.timeout or self.timeout, self.timeout)
+
+    async def invoke(self, prompt, call: Callable[[str, str, float | None, object], Awaitable]):
+        if self.llm == "route":
+            return await llm_router.invoke(
+                self.model, lambda candidate: call(candidate.llm, candidate.model, self._timeout(candidate), prompt)
+            )
+        return await call(self.llm, self.model, self.timeout, prompt)
+
+    def stream(
+            self,
+            prompt,
+            stream: Callable[[str, str, float | None, object], AsyncIterator],
+            is_content: Callable[[object], bool],
+            ) -> AsyncIterator:
+        if self.llm == "route":
+            return llm_router.stream(
+                self.model,
+                lambda candidate: stream(candidate.llm, candidate.model, self._timeout(candidate), prompt),
+                is_content=is_content,
+            )
+        return stream(self.llm, self.model, self.timeout, prompt)
+
+
+class Cascade:
+    """
+    A small, fast tier that answers first and a large tier it escalates to.
+
+    Prompts above ``max_complexity`` skip the small tier. Otherwise the small tier
+    answers and rates its own confidence; answers below ``min_confidence``, without
+    a rating or that failed are escalated to the large tier.
+    """
+    def __init__(
+            self,
+            name: str,
+            small: dict,
+            large: dict,
+            min_confidence: float = CASCADE_MIN_CONFIDENCE,
+            max_complexity: float = CASCADE_MAX_COMPLEXITY,
+            ):
+        self.name = name
+        self.small = Tier(**{"timeout": CASCADE_SMALL_TIMEOUT, **small})
+        self.large = Tier(**large)
+        self.min_confidence = min_confidence
+        self.max_complexity = max_complexity
+        self.large_latency: float | None = None # EWMA of complete large answers
+        self.requests = 0
+        self.escalated = 0
+        self.reasons: dict[str, int] = {}
+
+    def _record(self, tier: str, reason: str, elapsed: float, small_elapsed: float = 0.0):
+        self.requests += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        CASCADE_REQUESTS.inc(cascade=self.name, tier=tier, reason=reason)
+        CASCADE_LATENCY.observe(elapsed, cascade=self.name, tier=tier)
+        if tier == "large":
+            self.escalated += 1
+            large_elapsed = elapsed - small_elapsed
+            self.large_latency = (
+                large_elapsed if self.large_latency is None else 0.8 * self.large_latency + 0.2 * large_elapsed
+            )
+            if small_elapsed:
+                CASCADE_OVERHEAD.inc(small_elapsed, cascade=self.name)
+        elif self.large_latency is not None:
+            # Nothing is saved until a large answer shows what it would have cost
+            CASCADE_SAVED.inc(max(0.0, self.large_latency - elapsed), cascade=self.name)
+
+    def _route(self, score: float) -> str | None:
+        """
+        :return: Why the query skips the small tier, or None to try it.
+        """
+        return "complex" if score > self.max_complexity else None
+
+    def _judge(self, message) -> tuple[object, str | None]:
+        """
+        :return: The small answer without its confidence line, and why it must
+            escalate, or None to keep it.
+        """
+        content = message.content if isinstance(message.content, str) else ""
+        answer, rating = confidence(content)
+        if not answer:
+            return message, "empty"
+        if rating is None:
+            return message, "no_confidence"
+        if rating < self.min_confidence:
+            return message, "low_confidence"
+        return message.model_copy(update={"content": answer}), None
+
+    async def _small(self, prompt, call) -> tuple[object | None, str | None]:
+        try:
+            message = await self.small.invoke(with_instruction(prompt, CONFIDENCE_INSTRUCTION), call)
+        except Exception as e:
+            print(f"Cascade {self.name} small tier failed, escalating: {e}")
+            return None, "small_failed"
+        return self._judge(message)
+
+    async def invoke(self, prompt, score: float, call: Callable[[str, str, float | None, object], Awaitable]):
+        """
+        Answers with the small tier when it is confident enough, otherwise with the
+        large tier. ``call(llm, model, timeout, prompt)`` runs one model.
+
+        :param score: The prompt's ``complexity``.
+        :return: The message of the tier that answered.
+        """
+        start = time.monotonic()
+        small_elapsed = 0.0
+        reason = self._route(score)
+        if reason is None:
+            message, reason = await self._small(prompt, call)
+            small_elapsed = time.monotonic() - start
+            if reason is None:
+                self._record("small", "confident", small_elapsed)
+                return message
+        message = await self.large.invoke(prompt, call)
+        self._record("large", reason, time.monotonic() - start, small_elapsed)
+        return message
+
+    async def stream(
+            self,
+            prompt,
+            score: float,
+            call: Callable[[str, str, float | None, object], Awaitable],
+            stream: Callable[[str, str, float | None, object], AsyncIterator],
+            is_content: Callable[[object], bool] = lambda piece: True,
+            ) -> AsyncIterator:
+        """
+        Like ``invoke``, but streams a large answer. The small tier answers in one
+        piece, since it has to be judged before any of it is sent.
+        ``stream(llm, model, timeout, prompt)`` streams one model.
+        """
+        start = time.monotonic()
+        small_elapsed = 0.0
+        reason = self._route(score)
+        if reason is None:
+            message, reason = await self._small(prompt, call)
+            small_elapsed = time.monotonic() - start
+            if reason is None:
+                self._record("small", "confident", small_elapsed)
+                yield message.content
+                return
+        async for piece in self.large.stream(prompt, stream, is_content):
+            yield piece
+        self._record("large", reason, time.monotonic() - start, small_elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "small": self.small.name,
+            "large": self.large.name,
+            "min_confidence": self.min_confidence,
+            "max_complexity": self.max_complexity,
+            "requests": self.requests,
+            "escalation_rate": self.escalated / self.requests if self.requests else 0.0,
+            "reasons": self.reasons,
+            "large_latency_s": self.large_latency,
+            "saved_s": CASCADE_SAVED.value(cascade=self.name),
+            "overhead_s": CASCADE_OVERHEAD.value(cascade=self.name),
+        }
+
+
+class ModelCascade:
+    """
+    Named cascades, read from ``LLM_CASCADES`` (a JSON object) or the JSON file named
+    by ``LLM_CASCADES_FILE``. They map a cascade name to
+    ``{"small": {"llm", "model", "timeout"}, "large": {...}}`` and optionally their own
+    ``min_confidence`` and ``max_complexity``. A query selects one with
+    ``llm="cascade"`` and ``model`` set to its name.
+    """
+    def __init__(self, config: dict[str, dict]):
+        self.cascades = {name: Cascade(name, **settings) for name, settings in config.items()}
+
+    def get(self, name: str) -> Cascade:
+        cascade = self.cascades.get(name)
+        if cascade is None:
+            raise UnknownCascadeError(f"Unknown cascade: {name}")
+        return cascade
+
+    def stats(self) -> dict:
+        return {name: cascade.stats() for name, cascade in self.cascades.items()}
+
+
+def load_cascades() -> dict[str, dict]:
+    path = os.getenv("LLM_CASCADES_FILE")
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    return json.loads(os.getenv("LLM_CASCADES", "{}"))
+
+
+model_cascade = ModelCascade(load_cascades())
@@ -0,0 +1,68 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+WORDS = (
+    "the", "model", "answers", "with", "a", "steady", "stream", "of", "tokens", "for",
+    "benchmarks", "so", "every", "run", "is", "comparable", "and", "needs", "no", "network",
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model for benchmarks.
+
+    The answer is ``tokens`` words picked from a hash of the prompt, so the same
+    prompt always gets the same answer. The first token arrives after ``latency``
+    seconds and the rest follow at ``token_rate`` tokens per second, on a fixed
+    schedule so the pacing does not drift with event loop load.
+    """
+    model_config = ConfigDict(extra="ignore") # Provider options such as show_thoughts are accepted and ignored
+
+    model: str = "fake"
+    latency: float = 0.2
+    token_rate: float = 50.0
+    tokens: int = 64
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs) -> "FakeChatModel":
+        return self # Never calls tools, so agent runs answer in one step
+
+    def _answer(self, messages: list[BaseMessage]) -> list[str]:
+        digest = hashlib.sha256("\n".join(str(m.content) for m in messages).encode("utf-8")).digest()
+        return [
+            WORDS[(digest[i % len(digest)] + i) % len(WORDS)] + (" " if i < self.tokens - 1 else ".")
+            for i in range(self.tokens)
+        ]
+
+    def _delay(self, index: int) -> float:
+        return self.latency + (index / self.token_rate if self.token_rate > 0 else 0.0)
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay(self.tokens - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._answer(messages))))])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay(self.tokens - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._answer(messages))))])
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        start = time.monotonic()
+        for i, token in enumerate(self._answer(messages)):
+            time.sleep(max(0.0, start + self._delay(i) - time.monotonic()))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        start = time.monotonic()
+        for i, token in enumerate(self._answer(messages)):
+            await asyncio.sleep(max(0.0, start + self._delay(i) - time.monotonic()))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
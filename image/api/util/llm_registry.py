@@ -0,0 +1,159 @@
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+
+class _Entry:
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.evicted = False
+
+
+async def close_client(client) -> None:
+    """
+    Best effort shutdown of the HTTP clients held by a LangChain chat model.
+
+    Providers keep their transport under different attribute names (Ollama wraps an
+    httpx client inside its own client, Bedrock holds a boto3 client), so every known
+    attribute is checked and closed if it exposes ``aclose`` or ``close``.
+    """
+    for attr in ("_client", "_async_client", "client", "async_client"):
+        inner = getattr(client, attr, None)
+        if inner is None:
+            continue
+        inner = getattr(inner, "_client", inner)
+        closer = getattr(inner, "aclose", None) or getattr(inner, "close", None)
+        if closer is None:
+            continue
+        try:
+            result = closer()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"Failed to close {attr} of {type(client).__name__}: {e}")
+
+
+def make_key(provider: str, model: str, settings: dict) -> tuple:
+    """
+    Builds a hashable registry key from the provider, model and constructor settings.
+    Unhashable setting values fall back to their ``repr``.
+    """
+    frozen = []
+    for name, value in sorted(settings.items()):
+        try:
+            hash(value)
+        except TypeError:
+            value = repr(value)
+        frozen.append((name, value))
+    return provider, model, tuple(frozen)
+
+
+class LLMRegistry:
+    """
+    Process wide cache of LLM clients keyed by (provider, model, settings).
+
+    Clients are built lazily on first use and reused afterwards so their HTTP
+    connection pools survive between requests. The registry holds at most
+    ``max_size`` clients and drops any client that has not been used for
+    ``idle_ttl`` seconds. Clients that are evicted while a request still holds a
+    lease are closed once that lease is released.
+    """
+    def __init__(
+            self,
+            max_size: int = 8,
+            idle_ttl: float = 900.0,
+            closer: Callable[[Any], Awaitable[None]] = close_client,
+            ):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._closer = closer
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: tuple, factory: Callable[[], Any | Awaitable[Any]]):
+        """
+        Returns the client stored under ``key``, building it with ``factory`` if needed.
+        """
+        entry = await self._acquire(key, factory)
+        entry.in_use -= 1
+        return entry.client
+
+    @asynccontextmanager
+    async def lease(self, key: tuple, factory: Callable[[], Any | Awaitable[Any]]):
+        """
+        Yields the client stored under ``key`` and keeps it from being closed by
+        eviction until the caller is done with it.
+        """
+        entry = await self._acquire(key, factory)
+        try:
+            yield entry.client
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if entry.evicted and entry.in_use == 0:
+                await self._closer(entry.client)
+
+    async def _acquire(self, key: tuple, factory) -> _Entry:
+        to_close = []
+        async with self._lock:
+            to_close.extend(self._evict_idle())
+            entry = self._entries.get(key)
+            if entry is None:
+                client = factory()
+                if inspect.isawaitable(client):
+                    client = await client
+                entry = _Entry(client)
+                self._entries[key] = entry
+                while len(self._entries) > self.max_size:
+                    _, old = self._entries.popitem(last=False)
+                    to_close.append(old)
+            else:
+                self._entries.move_to_end(key)
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+        await self._close_entries(to_close)
+        return entry
+
+    def _evict_idle(self) -> list[_Entry]:
+        now = time.monotonic()
+        stale = [
+            key for key, entry in self._entries.items()
+            if entry.in_use == 0 and now - entry.last_used > self.idle_ttl
+        ]
+        return [self._entries.pop(key) for key in stale]
+
+    async def _close_entries(self, entries: list[_Entry]):
+        for entry in entries:
+            entry.evicted = True
+            if entry.in_use == 0:
+                await self._closer(entry.client)
+
+    async def close(self):
+        """
+        Closes every cached client. Called from the FastAPI shutdown hook. Clients
+        still leased are closed when released. The registry stays usable and builds
+        new clients on demand, since a warm Lambda can be reused after shutdown.
+        """
+        async with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        await self._close_entries(entries)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "idle_ttl": self.idle_ttl,
+            "clients": [
+                {"provider": key[0], "model": key[1], "in_use": entry.in_use}
+                for key, entry in self._entries.items()
+            ],
+        }
@@ -0,0 +1,278 @@
+import json
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable
+from dotenv import load_dotenv
+load_dotenv()
+
+from util.scheduler import QueueRejectedError
+
+# Start of the model call of the routed attempt running in this context, see mark_started
+_attempt_start: ContextVar[list[float] | None] = ContextVar("router_attempt_start", default=None)
+
+
+def mark_started():
+    """
+    Marks that a routed call got its worker slot and the model call begins, so the
+    candidate's latency does not include the queue wait before it. Does nothing
+    outside the router.
+    """
+    holder = _attempt_start.get()
+    if holder is not None:
+        holder[0] = time.monotonic()
+
+
+class NoHealthyCandidateError(Exception):
+    pass
+
+
+class UnknownRouteError(ValueError):
+    pass
+
+
+class Candidate:
+    """
+    One provider/model behind a route, with its rolling latency, error rate and
+    circuit breaker.
+
+    The breaker opens after ``failure_threshold`` failures in a row, or when more
+    than ``max_error_rate`` of the last ``window`` calls failed. While open, the
+    candidate is skipped for ``cooldown`` seconds. After that one trial call is let
+    through (half open): a success closes the breaker, a failure opens it again.
+    """
+    def __init__(
+            self,
+            llm: str,
+            model: str,
+            timeout: float | None = None,
+            window: int = 20,
+            failure_threshold: int = 3,
+            max_error_rate: float = 0.5,
+            cooldown: float = 30.0,
+            ):
+        self.llm = llm
+        self.model = model
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.latency: float | None = None # EWMA of full invocations
+        self.ttft: float | None = None # EWMA of time to first streamed token
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+
+    @property
+    def name(self) -> str:
+        return f"{self.llm}:{self.model}"
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial_running)
+
+    def begin(self):
+        if self.state == "half_open":
+            self.trial_running = True
+
+    def skip(self):
+        """
+        Ends an attempt that says nothing about the candidate's health, e.g. one
+        the scheduler shed or that was cancelled.
+        """
+        self.trial_running = False
+
+    def success(self, elapsed: float, streaming: bool = False):
+        if streaming:
+            self.ttft = elapsed if self.ttft is None else 0.8 * self.ttft + 0.2 * elapsed
+        else:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        half_open = self.trial_running
+        self.trial_running = False
+        if (
+            half_open
+            or self.consecutive_failures >= self.failure_threshold
+            or (len(self.outcomes) >= 5 and self.error_rate > self.max_error_rate)
+        ):
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "candidate": self.name,
+            "state": self.state,
+            "latency_s": self.latency,
+            "ttft_s": self.ttft,
+            "error_rate": self.error_rate,
+        }
+
+
+class Route:
+    def __init__(self, name: str, candidates: list[Candidate]):
+        self.name = name
+        self.candidates = candidates
+
+    def ranked(self, streaming: bool = False) -> list[Candidate]:
+        """
+        Available candidates, fastest first. Candidates without measurements keep
+        their configured order ahead of measured ones so they get tried.
+        """
+        def key(item):
+            index, candidate = item
+            observed = candidate.ttft if streaming else candidate.latency
+            if observed is None:
+                return 0, index, 0.0
+            return 1, 0, observed * (1 + candidate.error_rate)
+
+        available = [(i, c) for i, c in enumerate(self.candidates) if c.available()]
+        return [candidate for _, candidate in sorted(available, key=key)]
+
+
+class LLMRouter:
+    """
+    Routes a query to the fastest healthy candidate of a named route, failing over
+    to the next one on errors or timeouts.
+
+    Routes are read from ``LLM_ROUTES`` (a JSON object) or the JSON file named by
+    ``LLM_ROUTES_FILE``. They map a route name to a list of
+    ``{"llm": ..., "model": ..., "timeout": ...}`` candidates.
+    """
+    def __init__(self, config: dict[str, list[dict]]):
+        breaker = {
+            "failure_threshold": int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3")),
+            "max_error_rate": float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5")),
+            "cooldown": float(os.getenv("ROUTER_COOLDOWN", "30")),
+        }
+        self.routes = {
+            name: Route(name, [Candidate(**candidate, **breaker) for candidate in candidates])
+            for name, candidates in config.items()
+        }
+
+    def get(self, name: str) -> Route:
+        route = self.routes.get(name)
+        if route is None:
+            raise UnknownRouteError(f"Unknown route: {name}")
+        return route
+
+    async def invoke(self, name: str, call: Callable[[Candidate], Awaitable]):
+        """
+        Runs ``call`` on the best candidate, then the next ones until one succeeds.
+        Requests the scheduler rejects fail over without counting against the
+        candidate, and latency is measured from ``mark_started`` when ``call`` uses it.
+
+        :raises NoHealthyCandidateError: If every candidate is open or failed.
+        """
+        errors = []
+        for candidate in self.get(name).ranked():
+            candidate.begin()
+            start = [time.monotonic()]
+            token = _attempt_start.set(start)
+            try:
+                result = await call(candidate)
+            except QueueRejectedError as e:
+                candidate.skip() # Load shedding, not a backend failure
+                errors.append(f"{candidate.name}: {e}")
+                continue
+            except Exception as e:
+                candidate.failure()
+                errors.append(f"{candidate.name}: {e}")
+                continue
+            except BaseException:
+                candidate.skip() # Cancelled, the trial proved nothing
+                raise
+            finally:
+                _attempt_start.reset(token)
+            candidate.success(time.monotonic() - start[0])
+            return result
+        raise NoHealthyCandidateError(f"No candidate of route {name} answered: {'; '.join(errors) or 'all open'}")
+
+    async def stream(
+            self,
+            name: str,
+            factory: Callable[[Candidate], AsyncIterator],
+            is_content: Callable[[object], bool] = lambda piece: True,
+            ) -> AsyncIterator:
+        """
+        Streams from the best candidate. A candidate can only be failed over before it
+        produced its first content piece; errors after that are raised to the caller.
+        Pieces rejected by ``is_content`` (e.g. queue updates) are passed through
+        without committing to the candidate.
+
+        :raises NoHealthyCandidateError: If every candidate is open or failed before streaming.
+        """
+        errors = []
+        for candidate in self.get(name).ranked(streaming=True):
+            candidate.begin()
+            start = [time.monotonic()]
+            # Not reset: an async generator runs in its consumer's context, which may
+            # differ between yields. The next attempt replaces it
+            _attempt_start.set(start)
+            pieces = factory(candidate).__aiter__()
+            try:
+                while True:
+                    first = await pieces.__anext__()
+                    if is_content(first):
+                        break
+                    yield first
+            except StopAsyncIteration:
+                candidate.success(time.monotonic() - start[0], streaming=True)
+                return
+            except QueueRejectedError as e:
+                candidate.skip()
+                errors.append(f"{candidate.name}: {e}")
+                continue
+            except Exception as e:
+                candidate.failure()
+                errors.append(f"{candidate.name}: {e}")
+                continue
+            except BaseException:
+                candidate.skip()
+                raise
+            candidate.success(time.monotonic() - start[0], streaming=True)
+            yield first
+            try:
+                async for piece in pieces:
+                    yield piece
+            except Exception:
+                candidate.failure()
+                raise
+            return
+        raise NoHealthyCandidateError(f"No candidate of route {name} answered: {'; '.join(errors) or 'all open'}")
+
+    def stats(self) -> dict:
+        return {name: [c.stats() for c in route.candidates] for name, route in self.routes.items()}
+
+
+def load_routes() -> dict[str, list[dict]]:
+    path = os.getenv("LLM_ROUTES_FILE")
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    return json.loads(os.getenv(
+        "LLM_ROUTES",
+        '{"default": [{"llm": "ollama", "model": "deepseek-r1:8b"}]}'
+    ))
+
+
+router = LLMRouter(load_routes())
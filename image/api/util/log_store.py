@@ -0,0 +1,151 @@
+import asyncio
+import base64
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from models.Log import LevelEnum, LogEntry, LogPage, LogSearch
+
+LOG_SEARCH_DEFAULT_DAYS = float(os.getenv("LOG_SEARCH_DEFAULT_DAYS", "7"))
+LOG_SEARCH_TIMEOUT = float(os.getenv("LOG_SEARCH_TIMEOUT", "10"))
+
+LEVELS = list(LevelEnum)
+COLUMNS = "id, timestamp, logger, level, message, event, guild_id, channel_id, user_id, fields"
+
+
+class LogStoreUnavailableError(Exception):
+    pass
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime, log_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{log_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, log_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def build_search(search: LogSearch, now: datetime | None = None) -> tuple[str, list]:
+    """
+    Builds the search query for the bot's ``logs`` table, newest first.
+
+    The time range is always bounded so Postgres only scans the daily partitions
+    it covers. Pages continue strictly below the (timestamp, id) of the previous
+    page's last row, which the indexes ending in (timestamp DESC, id DESC) serve
+    without an offset, however deep the page.
+
+    :return: The SQL and its arguments. One row more than ``limit`` is fetched to
+        tell whether another page follows.
+    """
+    until = search.until or now or datetime.now(timezone.utc)
+    since = search.since or until - timedelta(days=LOG_SEARCH_DEFAULT_DAYS)
+    args = [since, until]
+    conditions = ["timestamp >= $1", "timestamp < $2"]
+
+    def add(condition: str, value):
+        args.append(value)
+        conditions.append(condition.format(f"${len(args)}"))
+
+    for column in ("guild_id", "channel_id", "user_id", "event"):
+        value = getattr(search, column)
+        if value is not None:
+            add(f"{column} = {{}}", value)
+    if search.level is not None:
+        add("level = ANY({})", [level.value for level in LEVELS[LEVELS.index(search.level):]])
+    if search.text:
+        # Same expression as the logs_message_search index
+        add("to_tsvector('simple', message) @@ plainto_tsquery('simple', {})", search.text)
+    if search.cursor:
+        timestamp, log_id = decode_cursor(search.cursor)
+        args.extend([timestamp, log_id])
+        conditions.append(f"(timestamp, id) < (${len(args) - 1}, ${len(args)})")
+    args.append(search.limit + 1)
+    query = (
+        f"SELECT {COLUMNS} FROM logs WHERE {' AND '.join(conditions)} "
+        f"ORDER BY timestamp DESC, id DESC LIMIT ${len(args)}"
+    )
+    return query, args
+
+
+class LogStore:
+    """
+    Read access to the logs the bot writes. The connection pool is created on the
+    first search, so the API starts and serves everything else without a database.
+    """
+    def __init__(self, dsn: str | None, min_size: int = 0, max_size: int = 5):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+        self._lock = asyncio.Lock()
+        self.searches = 0
+
+    async def pool(self):
+        if self.dsn is None:
+            raise LogStoreUnavailableError("DB_URL is not configured")
+        async with self._lock:
+            if self._pool is None:
+                import asyncpg # Only loaded when logs are searched
+                try:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        command_timeout=LOG_SEARCH_TIMEOUT,
+                    )
+                except (OSError, asyncpg.PostgresError) as e:
+                    raise LogStoreUnavailableError(f"Could not connect to the log database: {e}") from e
+        return self._pool
+
+    async def search(self, search: LogSearch) -> LogPage:
+        """
+        :raises InvalidCursorError: If the cursor was not produced by a search.
+        :raises LogStoreUnavailableError: If the database is not configured or reachable.
+        """
+        query, args = build_search(search)
+        pool = await self.pool()
+        self.searches += 1
+        records = await pool.fetch(query, *args)
+        entries = [
+            LogEntry(**{**dict(record), "fields": json.loads(record["fields"]) if record["fields"] else None})
+            for record in records[:search.limit]
+        ]
+        next_cursor = None
+        if len(records) > search.limit:
+            last = entries[-1]
+            next_cursor = encode_cursor(last.timestamp, last.id)
+        return LogPage(logs=entries, next_cursor=next_cursor)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def stats(self) -> dict:
+        if self._pool is None:
+            return {"configured": self.dsn is not None, "connected": False, "searches": self.searches}
+        return {
+            "configured": True,
+            "connected": True,
+            "searches": self.searches,
+            "size": self._pool.get_size(),
+            "idle": self._pool.get_idle_size(),
+        }
+
+
+log_store = LogStore(
+    os.getenv("DB_URL"),
+    max_size=int(os.getenv("LOG_DB_POOL_MAX_SIZE", "5")),
+)
@@ -0,0 +1,317 @@
+# The bot and the API each ship this module, as they are built as separate images.
+# Both copies are identical except for start_server, which only the bot's copy
+# adds at the end. image/api/tests/test_metrics.py fails when they drift apart.
+import bisect
+import functools
+import inspect
+import math
+import time
+from abc import ABC, abstractmethod
+from typing import Callable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        pass
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def snapshot(self) -> dict:
+        return {_format_labels(key) or "total": value for key, value in self._values.items()}
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With ``collect`` the values are read from a
+    callback returning ``{labels: value}`` each time the metric is rendered, which
+    keeps existing ``stats()`` methods as the single source of truth.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], dict[LabelKey, float]] | None = None):
+        super().__init__(name, documentation)
+        self._values: dict[LabelKey, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels):
+        self._values[_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def _items(self) -> dict[LabelKey, float]:
+        if self._collect is None:
+            return self._values
+        try:
+            return {_key(dict(key)): value for key, value in self._collect().items()}
+        except Exception:
+            return {}
+
+    def snapshot(self) -> dict:
+        return {_format_labels(key) or "value": value for key, value in self._items().items()}
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self._items().items()]
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[LabelKey, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets) + 1)
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.count += 1
+        series.sum += value
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """
+        Estimates a quantile by linear interpolation inside the bucket it falls in,
+        the same way Prometheus' ``histogram_quantile`` does.
+        """
+        series = self._series.get(_key(labels))
+        return self._quantile(series, q) if series is not None else None
+
+    def _quantile(self, series: _HistogramSeries, q: float) -> float | None:
+        if series.count == 0:
+            return None
+        rank = q * series.count
+        seen = 0
+        for i, count in enumerate(series.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            _format_labels(key) or "all": {
+                "count": series.count,
+                "avg": series.sum / series.count if series.count else 0.0,
+                "p50": self._quantile(series, 0.5),
+                "p95": self._quantile(series, 0.95),
+                "p99": self._quantile(series, 0.99),
+            }
+            for key, series in self._series.items()
+        }
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str, collect=None) -> Gauge:
+        return self.register(Gauge(name, documentation, collect))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def get(self, name: str) -> Metric | None:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labeller(func, labels: Callable[..., dict] | dict | None) -> Callable[[tuple, dict], dict]:
+    if labels is None:
+        return lambda args, kwargs: {}
+    if isinstance(labels, dict):
+        return lambda args, kwargs: labels
+    signature = inspect.signature(func)
+
+    def label_values(args, kwargs) -> dict:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return labels(**bound.arguments)
+    return label_values
+
+
+def timed(histogram: Histogram, labels: Callable[..., dict] | dict | None = None, errors: Counter | None = None):
+    """
+    Decorates a coroutine function to observe its duration in ``histogram``.
+
+    :param labels: Fixed labels, or a callable receiving the call's arguments by
+        name and returning the labels.
+    :param errors: Counter incremented with the same labels when the call raises.
+    """
+    def decorator(func):
+        label_values = _labeller(func, labels)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            values = label_values(args, kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**values)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **values)
+        return wrapper
+    return decorator
+
+
+def timed_stream(
+        ttft: Histogram,
+        rate: Histogram | None = None,
+        duration: Histogram | None = None,
+        labels: Callable[..., dict] | dict | None = None,
+        ):
+    """
+    Decorates an async generator function to observe the time to its first item,
+    the items per second after it, and the total duration of complete streams.
+    """
+    def decorator(func):
+        label_values = _labeller(func, labels)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            values = label_values(args, kwargs)
+            start = time.perf_counter()
+            first = None
+            items = 0
+            stream = func(*args, **kwargs)
+            try:
+                async for item in stream:
+                    if first is None:
+                        first = time.perf_counter()
+                        ttft.observe(first - start, **values)
+                    items += 1
+                    yield item
+            finally:
+                await stream.aclose() # Release the wrapped generator now, not when it is collected
+            end = time.perf_counter()
+            if duration is not None:
+                duration.observe(end - start, **values)
+            if rate is not None and first is not None and items > 1 and end > first:
+                rate.observe((items - 1) / (end - first), **values)
+        return wrapper
+    return decorator
+
+
+def counted(counter: Counter, labels: Callable[..., dict] | dict | None = None):
+    """
+    Decorates a coroutine function to count its calls.
+    """
+    def decorator(func):
+        label_values = _labeller(func, labels)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            counter.inc(**label_values(args, kwargs))
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
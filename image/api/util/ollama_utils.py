@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+load_dotenv()
+
+from util.metrics import registry as metrics
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL") or "http://localhost:11434"
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+OLLAMA_PRELOAD_TIMEOUT = float(os.getenv("OLLAMA_PRELOAD_TIMEOUT", "300"))
+# Seconds a model stays loaded after a query, adapted to the gaps between its queries
+OLLAMA_KEEP_ALIVE = float(os.getenv("OLLAMA_KEEP_ALIVE", "1800"))
+OLLAMA_KEEP_ALIVE_MIN = float(os.getenv("OLLAMA_KEEP_ALIVE_MIN", "300"))
+OLLAMA_KEEP_ALIVE_MAX = float(os.getenv("OLLAMA_KEEP_ALIVE_MAX", "7200"))
+OLLAMA_KEEP_ALIVE_COVERAGE = float(os.getenv("OLLAMA_KEEP_ALIVE_COVERAGE", "0.9"))
+OLLAMA_STATUS_TTL = float(os.getenv("OLLAMA_STATUS_TTL", "5"))
+
+OLLAMA_LOADS = metrics.histogram("ollama_model_load_seconds", "Model loads requested ahead of queries, by model")
+OLLAMA_COLD_QUERIES = metrics.counter(
+    "ollama_cold_queries_total",
+    "Queries sent to a model that was expected to be unloaded, by model"
+)
+
+
+def _full_name(model: str) -> str:
+    return model if ":" in model else f"{model}:latest" # How Ollama lists untagged models
+
+
+class _ModelState:
+    def __init__(self):
+        self.arrivals: deque[float] = deque(maxlen=64)
+        self.expires: float | None = None # Expected unload time, None while not loaded
+        self.loading: asyncio.Task | None = None
+        self.queries = 0
+        self.cold_queries = 0
+        self.last_load_s: float | None = None
+        self.error: str | None = None
+
+
+class OllamaWarmer:
+    """
+    Keeps Ollama models loaded while they are in use, so queries do not pay for a
+    model load.
+
+    Models can be preloaded ahead of the first query. Every query then sends a
+    ``keep_alive`` long enough to cover most of the gaps seen between that model's
+    queries (``coverage`` of them, times 1.5), bounded by ``minimum`` and
+    ``maximum``. A model with little traffic history gets ``default``. Busy models
+    stay loaded and rarely used ones give their memory back.
+    """
+    def __init__(
+            self,
+            base_url: str = OLLAMA_BASE_URL,
+            default: float = OLLAMA_KEEP_ALIVE,
+            minimum: float = OLLAMA_KEEP_ALIVE_MIN,
+            maximum: float = OLLAMA_KEEP_ALIVE_MAX,
+            coverage: float = OLLAMA_KEEP_ALIVE_COVERAGE,
+            ):
+        self.base_url = base_url.rstrip("/")
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.coverage = coverage
+        self._models: dict[str, _ModelState] = {}
+        self._client = None
+        self._task: asyncio.Task | None = None
+        self._loaded: tuple[float, dict[str, float] | None] = (0.0, None)
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState()
+        return state
+
+    def _http(self):
+        if self._client is None:
+            import httpx # Already installed with langchain-ollama
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=OLLAMA_PRELOAD_TIMEOUT)
+        return self._client
+
+    def keep_alive(self, model: str) -> int:
+        state = self._models.get(model)
+        if state is None or len(state.arrivals) < 4:
+            return int(self.default)
+        arrivals = list(state.arrivals)
+        gaps = sorted(later - earlier for earlier, later in zip(arrivals, arrivals[1:]))
+        gap = gaps[min(len(gaps) - 1, int(len(gaps) * self.coverage))]
+        return int(min(self.maximum, max(self.minimum, gap * 1.5)))
+
+    def params(self, llm: str, model: str) -> dict:
+        """
+        Records a query and returns the extra call parameters for it: the model's
+        ``keep_alive`` for Ollama, nothing for other providers.
+        """
+        if llm != "ollama":
+            return {}
+        state = self._state(model)
+        now = time.monotonic()
+        if state.loading is None and (state.expires is None or state.expires <= now):
+            state.cold_queries += 1
+            OLLAMA_COLD_QUERIES.inc(model=model)
+        state.queries += 1
+        state.arrivals.append(now)
+        keep_alive = self.keep_alive(model)
+        state.expires = now + keep_alive
+        return {"keep_alive": keep_alive}
+
+    async def load(self, model: str) -> float:
+        """
+        Loads the model into Ollama's memory without generating anything. Callers
+        that ask while a load is running wait for the same load.
+
+        :return: Seconds the load took.
+        """
+        state = self._state(model)
+        if state.loading is None:
+            state.loading = asyncio.create_task(self._load(model, state))
+        return await asyncio.shield(state.loading)
+
+    async def _load(self, model: str, state: _ModelState) -> float:
+        keep_alive = self.keep_alive(model)
+        start = time.monotonic()
+        try:
+            response = await self._http().post(
+                "/api/generate", json={"model": model, "keep_alive": keep_alive, "stream": False}
+            )
+            response.raise_for_status()
+        except Exception as e:
+            state.error = str(e) or type(e).__name__
+            raise
+        finally:
+            state.loading = None
+        elapsed = time.monotonic() - start
+        OLLAMA_LOADS.observe(elapsed, model=model)
+        state.last_load_s = elapsed
+        state.error = None
+        state.expires = time.monotonic() + keep_alive
+        return elapsed
+
+    async def preload(self, models: list[str]):
+        """
+        Loads the models one after another, so they do not compete for GPU memory
+        while loading. A model that fails to load is reported and skipped.
+        """
+        for model in models:
+            try:
+                elapsed = await self.load(model)
+                print(f"Preloaded Ollama model {model} in {elapsed:.1f}s")
+            except Exception as e:
+                print(f"Failed to preload Ollama model {model}: {e}")
+
+    def start(self, models: list[str]):
+        """
+        Preloads the models in the background, so the API serves requests while they load.
+        """
+        for model in models:
+            self._state(model) # Listed as cold until its turn
+        if models:
+            self._task = asyncio.create_task(self.preload(models))
+
+    async def loaded(self) -> dict[str, float] | None:
+        """
+        The models Ollama has in memory and the seconds until each unloads, from
+        ``/api/ps``. Cached for ``OLLAMA_STATUS_TTL`` seconds.
+
+        :return: None if Ollama cannot be reached.
+        """
+        checked, models = self._loaded
+        if time.monotonic() - checked < OLLAMA_STATUS_TTL:
+            return models
+        try:
+            response = await self._http().get("/api/ps", timeout=2.0)
+            response.raise_for_status()
+            models = {}
+            for entry in response.json().get("models", []):
+                expires = entry.get("expires_at")
+                remaining = None
+                if expires:
+                    remaining = (datetime.fromisoformat(expires) - datetime.now(timezone.utc)).total_seconds()
+                models[entry["name"]] = remaining
+        except Exception:
+            models = None
+        self._loaded = (time.monotonic(), models)
+        return models
+
+    async def status(self) -> dict:
+        """
+        The warm or cold state of every model that was preloaded or queried. The
+        state comes from Ollama itself when it is reachable (``source`` is
+        ``ollama``), otherwise it is estimated from the keep_alive sent last.
+        """
+        loaded = await self.loaded()
+        now = time.monotonic()
+        models = {}
+        for model, state in self._models.items():
+            if loaded is not None:
+                name = model if model in loaded else _full_name(model)
+                warm = name in loaded
+                remaining = loaded.get(name)
+            else:
+                remaining = state.expires - now if state.expires is not None else None
+                warm = remaining is not None and remaining > 0
+            models[model] = {
+                "state": "loading" if state.loading is not None else "warm" if warm else "cold",
+                "source": "ollama" if loaded is not None else "estimate",
+                "expires_in_s": round(remaining, 1) if warm and remaining is not None else None,
+                "keep_alive_s": self.keep_alive(model),
+                "queries": state.queries,
+                "cold_queries": state.cold_queries,
+                "last_load_s": state.last_load_s,
+                "error": state.error,
+            }
+        return {"base_url": self.base_url, "reachable": loaded is not None, "models": models}
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def preload_models() -> list[str]:
+    """
+    The models to preload: ``OLLAMA_PRELOAD_MODELS`` (comma separated) when set,
+    otherwise every Ollama candidate of the configured routes and tier of the cascades.
+    """
+    if not OLLAMA_PRELOAD:
+        return []
+    configured = os.getenv("OLLAMA_PRELOAD_MODELS")
+    if configured is not None:
+        return [model.strip() for model in configured.split(",") if model.strip()]
+    from util.llm_router import router as llm_router
+    from util.cascade_utils import model_cascade
+    models = []
+    # Small tiers first, their answers are the ones meant to be fast
+    candidates = [cascade.small for cascade in model_cascade.cascades.values()]
+    candidates += [cascade.large for cascade in model_cascade.cascades.values()]
+    candidates += [candidate for route in llm_router.routes.values() for candidate in route.candidates]
+    for candidate in candidates:
+        if candidate.llm == "ollama" and candidate.model not in models:
+            models.append(candidate.model)
+    return models
+
+
+ollama_warmer = OllamaWarmer()
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+load_dotenv()
+
+if TYPE_CHECKING:
+    import numpy as np # Imported where used, so importing the app does not load numpy
+
+RAG_EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", "32"))
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> list[str]:
+    """
+    Splits text into chunks of at most ``chunk_size`` characters. Paragraphs are kept
+    together when they fit. Longer paragraphs are cut on sentence boundaries, and
+    each cut chunk repeats up to ``overlap`` characters of the previous one.
+
+    :raises ValueError: Unless ``chunk_size > 0`` and ``0 <= overlap < chunk_size``,
+        without which cutting would never advance.
+    """
+    if chunk_size <= 0 or not 0 <= overlap < chunk_size:
+        raise ValueError(f"Need chunk_size > 0 and 0 <= overlap < chunk_size, got {chunk_size} and {overlap}")
+    chunks: list[str] = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(current) + len(paragraph) + 2 <= chunk_size:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+            continue
+        if current:
+            chunks.append(current)
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            if not sentence:
+                continue
+            if len(sentence) > chunk_size:
+                if current:
+                    chunks.append(current) # Keeps the chunks in text order
+                current = ""
+                while len(sentence) > chunk_size:
+                    chunks.append(sentence[:chunk_size])
+                    sentence = sentence[chunk_size - overlap:]
+            if not current:
+                current = sentence
+            elif len(current) + len(sentence) + 1 <= chunk_size:
+                current = f"{current} {sentence}"
+            else:
+                chunks.append(current)
+                # The carried overlap counts against chunk_size too
+                room = min(overlap, chunk_size - len(sentence) - 1)
+                current = f"{current[-room:]} {sentence}" if room > 0 else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    import numpy as np
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """
+    Flat inner-product index stored on disk.
+
+    Vectors are L2-normalized float32 rows appended to ``vectors.f32``, which is
+    memory-mapped instead of loaded, so startup cost does not grow with the index.
+    Chunk texts and the per-document content hashes live in ``meta.json``. Removed
+    documents leave tombstoned rows that are dropped by ``compact``.
+    """
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.path / "vectors.f32"
+        self._meta_path = self.path / "meta.json"
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+        else:
+            meta = {"dim": None, "chunks": [], "documents": {}, "deleted": []}
+        self.dim: int | None = meta["dim"]
+        self.chunks: list[dict] = meta["chunks"]
+        self.documents: dict[str, dict] = meta["documents"]
+        self.deleted: set[int] = set(meta["deleted"])
+        self._truncate_to_meta()
+        self._snapshot = self._take_snapshot()
+
+    def _truncate_to_meta(self):
+        # Rows appended after the last metadata save (e.g. a crash mid ingest) are dropped
+        if self.dim is not None and self._vectors_path.exists():
+            expected = len(self.chunks) * self.dim * 4
+            if self._vectors_path.stat().st_size != expected:
+                with open(self._vectors_path, "r+b") as f:
+                    f.truncate(expected)
+
+    def _map(self) -> np.ndarray:
+        import numpy as np
+        if self.dim is None or not self.chunks:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self.chunks), self.dim))
+
+    def _take_snapshot(self) -> tuple:
+        # Searches read one consistent (vectors, chunks, deleted) view while an
+        # ingest appends or compacts in another thread
+        return self._map(), list(self.chunks), frozenset(self.deleted)
+
+    def _save_meta(self):
+        tmp = self._meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "dim": self.dim,
+            "chunks": self.chunks,
+            "documents": self.documents,
+            "deleted": sorted(self.deleted),
+        }))
+        os.replace(tmp, self._meta_path)
+
+    def __len__(self):
+        return len(self.chunks) - len(self.deleted)
+
+    def has(self, doc_id: str, digest: str) -> bool:
+        document = self.documents.get(doc_id)
+        return document is not None and document["hash"] == digest
+
+    def add(self, doc_id: str, digest: str, texts: list[str], vectors: np.ndarray, save: bool = True):
+        import numpy as np
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding size {vectors.shape[1]} does not match index size {self.dim}")
+        self.remove(doc_id, save=False)
+        with open(self._vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        start = len(self.chunks)
+        self.chunks.extend({"doc_id": doc_id, "text": text} for text in texts)
+        self.documents[doc_id] = {"hash": digest, "rows": list(range(start, len(self.chunks)))}
+        if save:
+            self.flush()
+
+    def remove(self, doc_id: str, save: bool = True) -> bool:
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return False
+        self.deleted.update(document["rows"])
+        if save:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        Saves the metadata, compacting first when over a quarter of the rows are tombstones.
+        """
+        if self.chunks and len(self.deleted) > len(self.chunks) // 4:
+            self.compact()
+        self._save_meta()
+        self._snapshot = self._take_snapshot()
+
+    def compact(self):
+        import numpy as np
+        keep = [row for row in range(len(self.chunks)) if row not in self.deleted]
+        remap = {old: new for new, old in enumerate(keep)}
+        vectors = self._map()
+        tmp = self._vectors_path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            for start in range(0, len(keep), 4096):
+                f.write(np.ascontiguousarray(vectors[keep[start:start + 4096]]).tobytes())
+        del vectors
+        os.replace(tmp, self._vectors_path)
+        self.chunks = [self.chunks[row] for row in keep]
+        for document in self.documents.values():
+            document["rows"] = [remap[row] for row in document["rows"]]
+        self.deleted = set()
+
+    def search(self, vector, k: int = 4) -> list[dict]:
+        """
+        Returns the ``k`` chunks with the highest cosine similarity to ``vector``.
+        """
+        import numpy as np
+        vectors, chunks, deleted = self._snapshot
+        if len(vectors) == 0:
+            return []
+        query = _normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        scores = vectors @ query
+        if deleted:
+            scores[list(deleted)] = -np.inf
+        k = min(k, len(vectors) - len(deleted))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{**chunks[row], "score": float(scores[row])} for row in top]
+
+
+class RAGStore:
+    """
+    Ingestion and retrieval on top of a ``VectorIndex`` with Ollama embeddings.
+    Documents whose content hash did not change since the last ingest are skipped.
+    """
+    def __init__(self, path: str, embed_model: str, base_url: str | None = None):
+        self.path = path
+        self.embed_model = embed_model
+        self.base_url = base_url
+        self._index: VectorIndex | None = None
+        self._embedder = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def index(self) -> VectorIndex:
+        if self._index is None:
+            self._index = VectorIndex(self.path)
+        return self._index
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            from langchain_ollama import OllamaEmbeddings
+            self._embedder = OllamaEmbeddings(model=self.embed_model, base_url=self.base_url)
+        return self._embedder
+
+    async def _embed(self, texts: list[str]) -> np.ndarray:
+        import numpy as np
+        vectors = []
+        for start in range(0, len(texts), RAG_EMBED_BATCH):
+            vectors.extend(await self.embedder.aembed_documents(texts[start:start + RAG_EMBED_BATCH]))
+        return np.asarray(vectors, dtype=np.float32)
+
+    async def ingest(self, documents: list[tuple[str, str]], chunk_size: int = 800, overlap: int = 100) -> dict:
+        """
+        Chunks and embeds new or changed documents.
+
+        :param documents: (doc_id, content) pairs.
+        :return: Counts of ingested, unchanged and total chunks.
+        :rtype: dict
+        """
+        ingested, unchanged, chunk_count = [], [], 0
+        removed = False
+        async with self._lock:
+            for doc_id, content in documents:
+                digest = content_hash(content)
+                if self.index.has(doc_id, digest):
+                    unchanged.append(doc_id)
+                    continue
+                texts = chunk_text(content, chunk_size, overlap)
+                if not texts:
+                    # Nothing to embed, but the old chunks must not stay retrievable
+                    removed |= await asyncio.to_thread(self.index.remove, doc_id, False)
+                    continue
+                vectors = await self._embed(texts)
+                await asyncio.to_thread(self.index.add, doc_id, digest, texts, vectors, False)
+                ingested.append(doc_id)
+                chunk_count += len(texts)
+            if ingested or removed:
+                await asyncio.to_thread(self.index.flush)
+        return {"ingested": ingested, "unchanged": unchanged, "chunks": chunk_count}
+
+    async def remove(self, doc_id: str) -> bool:
+        async with self._lock:
+            return await asyncio.to_thread(self.index.remove, doc_id)
+
+    async def retrieve(self, query: str, k: int = 4) -> list[dict]:
+        if len(self.index) == 0:
+            return []
+        vector = await self.embedder.aembed_query(query)
+        return await asyncio.to_thread(self.index.search, vector, k)
+
+    def stats(self) -> dict:
+        return {"documents": len(self.index.documents), "chunks": len(self.index), "dim": self.index.dim}
+
+
+rag_store = RAGStore(
+    path=os.getenv("RAG_INDEX_DIR", "rag_index"),
+    embed_model=os.getenv("RAG_EMBED_MODEL", "nomic-embed-text"),
+    base_url=os.getenv("OLLAMA_BASE_URL"),
+)
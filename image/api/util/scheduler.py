@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+from util.metrics import registry as metrics
+
+QUEUE_WAIT = metrics.histogram("scheduler_queue_wait_seconds", "Time from enqueue to a granted worker slot")
+QUEUE_REJECTED = metrics.counter("scheduler_rejected_total", "Requests refused on arrival or expired in the queue")
+
+
+class QueueRejectedError(Exception):
+    """
+    Raised when a request is refused because the queue is full or because it waited,
+    or would wait, longer than the scheduler's ``max_wait``.
+    """
+    pass
+
+
+class Ticket:
+    def __init__(self, seq: int, user: str, guild: str, priority: int):
+        self.seq = seq
+        self.user = user
+        self.guild = guild
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class _Level:
+    """
+    Two level round robin for one priority: guilds take turns, and inside a guild
+    its users take turns. A guild with weight ``w`` gets up to ``w`` grants in a
+    row before the next guild's turn.
+    """
+    def __init__(self):
+        self.guilds: OrderedDict[str, OrderedDict[str, deque[Ticket]]] = OrderedDict()
+        self.credit: dict[str, int] = {}
+
+    def push(self, ticket: Ticket):
+        users = self.guilds.setdefault(ticket.guild, OrderedDict())
+        users.setdefault(ticket.user, deque()).append(ticket)
+
+    def pop(self, weights: dict[str, int]) -> Ticket | None:
+        if not self.guilds:
+            return None
+        guild, users = next(iter(self.guilds.items()))
+        user, tickets = next(iter(users.items()))
+        ticket = tickets.popleft()
+        users.move_to_end(user)
+        if not tickets:
+            del users[user]
+        credit = self.credit.get(guild, weights.get(guild, 1)) - 1
+        if not users:
+            del self.guilds[guild]
+            self.credit.pop(guild, None)
+        elif credit <= 0:
+            self.guilds.move_to_end(guild)
+            self.credit.pop(guild, None)
+        else:
+            self.credit[guild] = credit
+        return ticket
+
+    def remove(self, ticket: Ticket) -> bool:
+        users = self.guilds.get(ticket.guild)
+        if users is None or ticket.user not in users:
+            return False
+        tickets = users[ticket.user]
+        try:
+            tickets.remove(ticket)
+        except ValueError:
+            return False
+        if not tickets:
+            del users[ticket.user]
+        if not users:
+            del self.guilds[ticket.guild]
+            self.credit.pop(ticket.guild, None)
+        return True
+
+    def __iter__(self):
+        for users in self.guilds.values():
+            for tickets in users.values():
+                yield from tickets
+
+
+class ProviderScheduler:
+    """
+    Admits requests for one provider to a fixed number of worker slots.
+
+    Waiting requests are ordered by priority (lower runs first) and shared fairly
+    between guilds and users inside each priority. A request is rejected on arrival
+    when the queue already holds ``max_depth`` requests or the estimated wait is
+    over ``max_wait``, and it is expired if it is still waiting after ``max_wait``.
+    """
+    def __init__(self, name: str, workers: int, max_wait: float, max_depth: int, weights: dict[str, int]):
+        self.name = name
+        self.workers = workers
+        self.max_wait = max_wait
+        self.max_depth = max_depth
+        self.weights = weights
+        self.running = 0
+        self.depth = 0
+        self.granted = 0
+        self.rejected = 0
+        self.expired = 0
+        self._levels: dict[int, _Level] = {}
+        self._waits: deque[float] = deque(maxlen=500)
+        self._service_times: deque[float] = deque(maxlen=100)
+        self._seq = itertools.count()
+
+    def _estimated_wait(self) -> float:
+        if not self._service_times:
+            return 0.0
+        average = sum(self._service_times) / len(self._service_times)
+        return (self.depth + 1) * average / self.workers
+
+    def enqueue(self, user: str, guild: str, priority: int) -> Ticket:
+        if self.depth >= self.max_depth:
+            self.rejected += 1
+            QUEUE_REJECTED.inc(provider=self.name, reason="full")
+            raise QueueRejectedError(f"{self.name} queue is full ({self.depth} waiting), try again later")
+        estimate = self._estimated_wait()
+        if self.running >= self.workers and estimate > self.max_wait:
+            self.rejected += 1
+            QUEUE_REJECTED.inc(provider=self.name, reason="wait")
+            raise QueueRejectedError(
+                f"{self.name} queue wait is about {estimate:.0f}s, over the {self.max_wait:.0f}s limit"
+            )
+        ticket = Ticket(next(self._seq), user, guild, priority)
+        self._levels.setdefault(priority, _Level()).push(ticket)
+        self.depth += 1
+        ticket.timer = asyncio.get_running_loop().call_later(self.max_wait, self._expire, ticket)
+        self._dispatch()
+        return ticket
+
+    def _expire(self, ticket: Ticket):
+        level = self._levels.get(ticket.priority)
+        if level is not None and level.remove(ticket) and not ticket.granted.done():
+            self.depth -= 1
+            self.expired += 1
+            QUEUE_REJECTED.inc(provider=self.name, reason="expired")
+            ticket.granted.set_exception(QueueRejectedError(
+                f"Request waited over {self.max_wait:.0f}s in the {self.name} queue"
+            ))
+
+    def cancel(self, ticket: Ticket):
+        if ticket.timer is not None:
+            ticket.timer.cancel()
+        level = self._levels.get(ticket.priority)
+        if level is not None and level.remove(ticket):
+            self.depth -= 1
+
+    def _dispatch(self):
+        while self.running < self.workers:
+            ticket = None
+            for priority in sorted(self._levels):
+                ticket = self._levels[priority].pop(self.weights)
+                if ticket is not None:
+                    break
+            if ticket is None:
+                return
+            self.depth -= 1
+            ticket.timer.cancel()
+            if ticket.granted.done(): # Caller went away while waiting
+                continue
+            self.running += 1
+            self.granted += 1
+            wait = time.monotonic() - ticket.enqueued
+            self._waits.append(wait)
+            QUEUE_WAIT.observe(wait, provider=self.name)
+            ticket.granted.set_result(None)
+
+    def release(self, service_time: float):
+        self.running -= 1
+        self._service_times.append(service_time)
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        Estimated number of requests ahead of the ticket: every waiting request with
+        a higher priority, plus the same priority ones that arrived earlier.
+        """
+        ahead = 0
+        for priority, level in self._levels.items():
+            if priority < ticket.priority:
+                ahead += sum(1 for _ in level)
+            elif priority == ticket.priority:
+                ahead += sum(1 for other in level if other.seq < ticket.seq)
+        return ahead + 1
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "depth": self.depth,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "avg_wait_s": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait_s": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "max_wait_s": waits[-1] if waits else 0.0,
+        }
+
+
+class Scheduler:
+    """
+    One ``ProviderScheduler`` per provider, created on first use. Worker counts come
+    from ``SCHEDULER_WORKERS_<PROVIDER>`` (default ``SCHEDULER_WORKERS``) and guild
+    weights from the ``SCHEDULER_GUILD_WEIGHTS`` JSON object.
+    """
+    def __init__(self):
+        self.max_wait = float(os.getenv("SCHEDULER_MAX_WAIT", "60"))
+        self.max_depth = int(os.getenv("SCHEDULER_MAX_DEPTH", "100"))
+        self.weights = {
+            str(guild): int(weight)
+            for guild, weight in json.loads(os.getenv("SCHEDULER_GUILD_WEIGHTS", "{}")).items()
+        }
+        self._providers: dict[str, ProviderScheduler] = {}
+
+    def provider(self, name: str) -> ProviderScheduler:
+        scheduler = self._providers.get(name)
+        if scheduler is None:
+            workers = int(os.getenv(f"SCHEDULER_WORKERS_{name.upper()}", os.getenv("SCHEDULER_WORKERS", "4")))
+            scheduler = self._providers[name] = ProviderScheduler(
+                name, workers, self.max_wait, self.max_depth, self.weights
+            )
+        return scheduler
+
+    def enqueue(self, provider: str, user: str | None, guild: str | None, priority: int = 1):
+        scheduler = self.provider(provider)
+        return scheduler, scheduler.enqueue(user or "anonymous", guild or "direct", priority)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, user: str | None, guild: str | None, priority: int = 1):
+        """
+        Waits for a worker slot and holds it for the duration of the block.
+
+        :raises QueueRejectedError: If the request is refused or expires while waiting.
+        """
+        scheduler, ticket = self.enqueue(provider, user, guild, priority)
+        async with self.hold(scheduler, ticket):
+            yield
+
+    @asynccontextmanager
+    async def hold(self, scheduler: ProviderScheduler, ticket: Ticket):
+        """
+        Waits until an already enqueued ticket is granted and holds its slot.
+        """
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            if ticket.granted.done() and not ticket.granted.cancelled() and ticket.granted.exception() is None:
+                scheduler.release(0.0) # Granted just before the caller was cancelled
+            else:
+                scheduler.cancel(ticket)
+            raise
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            scheduler.release(time.monotonic() - start)
+
+    async def positions(self, scheduler: ProviderScheduler, ticket: Ticket, interval: float = 1.0):
+        """
+        Yields the ticket's queue position whenever it changes, checking every
+        ``interval`` seconds, until the ticket is granted. If the caller stops waiting,
+        the ticket is removed from the queue, or its slot released when it was
+        already granted.
+        """
+        last = None
+        try:
+            while not ticket.granted.done():
+                position = scheduler.position(ticket)
+                if position != last:
+                    last = position
+                    yield position
+                await asyncio.wait({ticket.granted}, timeout=interval)
+        except BaseException:
+            if not ticket.granted.done():
+                scheduler.cancel(ticket)
+                ticket.granted.cancel()
+            elif not ticket.granted.cancelled() and ticket.granted.exception() is None:
+                scheduler.release(0.0) # Granted just before the caller stopped waiting
+            raise
+
+    def stats(self) -> dict:
+        return {name: scheduler.stats() for name, scheduler in self._providers.items()}
+
+
+scheduler = Scheduler()
+
+metrics.gauge(
+    "scheduler_queue_depth",
+    "Requests waiting for a worker slot",
+    lambda: {(("provider", name),): provider.depth for name, provider in scheduler._providers.items()},
+)
+metrics.gauge(
+    "scheduler_running",
+    "Requests holding a worker slot",
+    lambda: {(("provider", name),): provider.running for name, provider in scheduler._providers.items()},
+)
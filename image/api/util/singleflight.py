@@ -0,0 +1,109 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key.
+
+    The first caller starts ``fn`` as a task and every caller that arrives while it
+    is running awaits the same task. The task is shielded, so one caller
+    disconnecting does not cancel the work the others are waiting for.
+    """
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception() # Mark as retrieved when every caller went away
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "started": self.started, "coalesced": self.coalesced}
+
+
+class _Broadcast:
+    def __init__(self):
+        self.pieces: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task | None = None
+
+
+class StreamFlight:
+    """
+    Deduplicates concurrent streams that share a key.
+
+    One producer task consumes the stream and records every piece. Subscribers
+    replay the recorded pieces from the start and then follow live ones, so a
+    late subscriber still gets the whole answer. The producer is cancelled once
+    the last subscriber leaves.
+    """
+    def __init__(self):
+        self._streams: dict[Hashable, _Broadcast] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = self._streams[key] = _Broadcast()
+            broadcast.task = asyncio.create_task(self._produce(key, broadcast, factory))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        broadcast.subscribers += 1
+        try:
+            index = 0
+            while True:
+                if index < len(broadcast.pieces):
+                    yield broadcast.pieces[index]
+                    index += 1
+                elif broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                else:
+                    async with broadcast.changed:
+                        await broadcast.changed.wait_for(
+                            lambda: index < len(broadcast.pieces) or broadcast.done
+                        )
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
+
+    async def _produce(self, key: Hashable, broadcast: _Broadcast, factory):
+        try:
+            async for piece in factory():
+                broadcast.pieces.append(piece)
+                async with broadcast.changed:
+                    broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            async with broadcast.changed:
+                broadcast.changed.notify_all()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._streams), "started": self.started, "coalesced": self.coalesced}
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+load_dotenv()
+
+from util.metrics import registry as metrics
+
+# A dropped connection can resume within this many seconds, with its requests still running
+WS_SESSION_TTL = float(os.getenv("WS_SESSION_TTL", "60"))
+# Unacknowledged frames kept for resumption; a session that falls further behind cannot resume
+WS_RESUME_BUFFER = int(os.getenv("WS_RESUME_BUFFER", "2000"))
+
+WS_FRAMES = metrics.counter("ws_frames_total", "Frames sent to bot sockets, by type")
+WS_RESUMES = metrics.counter("ws_resumes_total", "Socket reconnections, by whether the session resumed")
+
+
+def codec(encoding: str):
+    """
+    Returns ``(encode, decode, binary)`` for a frame encoding: ``msgpack`` frames
+    are binary, ``json`` frames are text and use orjson when it is installed.
+    """
+    if encoding == "msgpack":
+        import msgpack # Only needed by clients that ask for it
+        return msgpack.packb, lambda data: msgpack.unpackb(data, raw=False), True
+    try:
+        import orjson
+        return lambda frame: orjson.dumps(frame).decode(), orjson.loads, False
+    except ImportError:
+        return lambda frame: json.dumps(frame, separators=(",", ":")), json.loads, False
+
+
+class SocketSession:
+    """
+    The requests of one bot connection. Every frame sent has a sequence number and
+    is kept until the bot acknowledges it, so a bot that reconnects with the same
+    session replays what it missed while its requests keep running.
+    """
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.seq = 0
+        self.outbox: deque[dict] = deque()
+        self.overflowed = False
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.websocket = None
+        self.encode = None
+        self.binary = False
+        self.detached_at: float | None = time.monotonic()
+        self._send_lock = asyncio.Lock()
+
+    def known(self) -> list[str]:
+        """
+        Requests the session still tracks: running ones and those with unacknowledged frames.
+        """
+        return list(set(self.tasks) | {frame["id"] for frame in self.outbox})
+
+    def ack(self, seq: int):
+        while self.outbox and self.outbox[0]["seq"] <= seq:
+            self.outbox.popleft()
+
+    async def _write(self, frame: dict):
+        data = self.encode(frame)
+        if self.binary:
+            await self.websocket.send_bytes(data)
+        else:
+            await self.websocket.send_text(data)
+
+    async def emit(self, request_id: str, kind: str, data=None):
+        self.seq += 1
+        frame = {"seq": self.seq, "id": request_id, "type": kind, "data": data}
+        self.outbox.append(frame)
+        if len(self.outbox) > WS_RESUME_BUFFER:
+            self.outbox.popleft()
+            self.overflowed = True
+        WS_FRAMES.inc(type=kind)
+        async with self._send_lock: # Keeps frames in sequence order
+            if self.websocket is not None:
+                try:
+                    await self._write(frame)
+                except Exception:
+                    self.websocket = None # The reader notices the disconnect and detaches
+
+    async def attach(self, websocket, encoding: str, last_seq: int, resumed: bool):
+        """
+        Sends the ``hello`` frame and replays every frame after ``last_seq`` before
+        live frames flow again.
+        """
+        async with self._send_lock:
+            self.encode, _, self.binary = codec(encoding)
+            self.websocket = websocket
+            self.detached_at = None
+            self.ack(last_seq)
+            await self._write({"seq": 0, "id": None, "type": "hello", "data": {
+                "session": self.id, "resumed": resumed, "known": self.known(),
+            }})
+            for frame in list(self.outbox):
+                await self._write(frame)
+
+    def detach(self, websocket):
+        if self.websocket is websocket:
+            self.websocket = None
+        self.detached_at = time.monotonic()
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+
+class SessionStore:
+    """
+    Socket sessions by ID. Detached sessions are dropped, and their requests
+    cancelled, ``ttl`` seconds after their connection went away.
+    """
+    def __init__(self, ttl: float = WS_SESSION_TTL):
+        self.ttl = ttl
+        self._sessions: dict[str, SocketSession] = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if session.detached_at is not None and now - session.detached_at > self.ttl:
+                session.close()
+                del self._sessions[session_id]
+
+    def open(self, session_id: str | None) -> tuple[SocketSession, bool]:
+        """
+        :return: The session to resume, or a new one, and whether it resumed.
+        """
+        self._expire()
+        session = self._sessions.get(session_id) if session_id else None
+        if session is not None and not session.overflowed:
+            WS_RESUMES.inc(resumed="true")
+            return session, True
+        if session is not None:
+            session.close()
+            del self._sessions[session.id]
+        if session_id:
+            WS_RESUMES.inc(resumed="false")
+        session_id = uuid.uuid4().hex
+        session = self._sessions[session_id] = SocketSession(session_id)
+        return session, False
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "connected": sum(1 for session in self._sessions.values() if session.websocket is not None),
+            "running": sum(len(session.tasks) for session in self._sessions.values()),
+            "buffered_frames": sum(len(session.outbox) for session in self._sessions.values()),
+        }
+
+
+async def dispatch(app, session: SocketSession, frame: dict, client=None, max_redirects: int = 3):
+    """
+    Runs one request frame through the app's HTTP routes in process and sends the
+    response back as frames. A complete response becomes one ``result`` frame
+    holding ``status`` and the decoded ``body``. A streamed response becomes a
+    ``start`` frame with the status, one ``chunk`` frame per piece and an ``end``
+    frame. Redirects, e.g. for a missing trailing slash, are followed.
+    """
+    request_id = frame["id"]
+    method = frame.get("method", "POST").upper()
+    path = frame["path"]
+    body = b"" if frame.get("body") is None else json.dumps(frame["body"]).encode()
+    try:
+        for _ in range(max_redirects + 1):
+            location = await _call(app, session, request_id, method, path, body, client)
+            if location is None:
+                return
+            path = location
+        await session.emit(request_id, "error", {"status": 508, "error": f"Too many redirects for {frame['path']}"})
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await session.emit(request_id, "error", {"status": 500, "error": str(e)})
+    finally:
+        session.tasks.pop(request_id, None)
+
+
+async def _call(app, session: SocketSession, request_id: str, method: str, path: str, body: bytes, client) -> str | None:
+    """
+    :return: The path to follow when the app redirected, otherwise None.
+    """
+    target = urlsplit(path)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": target.path,
+        "raw_path": target.path.encode(),
+        "query_string": target.query.encode(),
+        "root_path": "",
+        "headers": [
+            (b"host", b"api"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": client,
+        "server": None,
+    }
+    sent = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    response = {"status": 500, "headers": {}, "parts": [], "streaming": False, "redirect": None}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {
+                name.decode().lower(): value.decode() for name, value in message.get("headers", [])
+            }
+            if response["status"] in (307, 308) and "location" in response["headers"]:
+                location = urlsplit(response["headers"]["location"])
+                response["redirect"] = location.path + (f"?{location.query}" if location.query else "")
+        elif message["type"] == "http.response.body" and response["redirect"] is None:
+            chunk = message.get("body", b"")
+            more = message.get("more_body", False)
+            if more and not response["streaming"]:
+                response["streaming"] = True
+                await session.emit(request_id, "start", {
+                    "status": response["status"], "content_type": response["headers"].get("content-type"),
+                })
+                for part in response["parts"]:
+                    await session.emit(request_id, "chunk", _text(part))
+                response["parts"].clear()
+            if response["streaming"]:
+                if chunk:
+                    await session.emit(request_id, "chunk", _text(chunk))
+                if not more:
+                    await session.emit(request_id, "end")
+            else:
+                response["parts"].append(chunk)
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    if response["redirect"] is not None:
+        return response["redirect"]
+    if not response["streaming"]:
+        raw = b"".join(response["parts"])
+        if response["headers"].get("content-type", "").startswith("application/json"):
+            data = json.loads(raw) if raw else None
+        else:
+            data = _text(raw)
+        await session.emit(request_id, "result", {"status": response["status"], "body": data})
+    return None
+
+
+def _text(data: bytes) -> str:
+    # Streamed responses are SSE or NDJSON, and text survives either encoding
+    return data.decode("utf-8", errors="replace")
+
+
+sessions = SessionStore()
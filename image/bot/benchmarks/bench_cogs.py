@@ -0,0 +1,248 @@
+"""
+Replays synthetic Discord events through the cogs with stubbed contexts.
+
+Messages, edits and reactions go to LoggingCog's listeners, and ``query``,
+``coinflip`` and ``rps`` commands to AgentCog and GamesCog. Agent queries are
+answered by an in-process fake API on a loopback port that streams Server-Sent
+Events at a fixed token rate, so the bot's HTTP client, streaming and memory
+paths run without Discord, the real API or a model. Command callbacks are called
+directly, so checks and cooldowns are not part of the measurement. Run from
+image/bot:
+
+    python -m benchmarks.bench_cogs --events 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from util import api_utils
+from util.memory_utils import ConversationMemory
+from cogs.agent import AgentCog
+from cogs.games import GamesCog
+from cogs.logging import LoggingCog
+
+EVENT_WEIGHTS = {
+    "message": 60,
+    "message_edit": 8,
+    "reaction_add": 10,
+    "coinflip": 8,
+    "rps": 8,
+    "query": 6,
+}
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+    guild = None
+
+    def __init__(self, channel, author, content: str, send_latency: float = 0.0):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.send_latency = send_latency
+
+    async def edit(self, content: str):
+        await asyncio.sleep(self.send_latency)
+        self.content = content
+        return self
+
+    async def delete(self):
+        await asyncio.sleep(self.send_latency)
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeContext:
+    """
+    The parts of ``commands.Context`` the cogs use. ``send`` waits ``send_latency``
+    seconds to stand in for the Discord round trip.
+    """
+    def __init__(self, bot, channel, author, guild, command: str, send_latency: float):
+        self.bot = bot
+        self.channel = channel
+        self.author = author
+        self.guild = guild
+        self.prefix = "/"
+        self.command = command
+        self.send_latency = send_latency
+        self.sent: list[FakeMessage] = []
+
+    async def send(self, content: str):
+        await asyncio.sleep(self.send_latency)
+        message = FakeMessage(self.channel, self.bot.user, content, self.send_latency)
+        self.sent.append(message)
+        return message
+
+    def typing(self):
+        return _Typing()
+
+
+async def start_fake_api(latency: float, token_rate: float, tokens: int):
+    """
+    Serves ``/query/stream`` with a deterministic answer of ``tokens`` words.
+
+    :return: The runner and the base URL it listens on.
+    """
+    async def stream(request):
+        payload = await request.json()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        start = time.monotonic()
+        words = payload["content"].split() or ["ok"]
+        for i in range(tokens):
+            await asyncio.sleep(max(0.0, start + latency + i / token_rate - time.monotonic()))
+            piece = words[i % len(words)] + " "
+            await response.write(f"data: {json.dumps({'content': piece})}\n\n".encode("utf-8"))
+        await response.write(b"event: done\ndata: {}\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post("/query/stream", stream)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def make_events(count: int, channels: int, users: int, rng: random.Random) -> list[tuple[str, int, int]]:
+    kinds = list(EVENT_WEIGHTS)
+    weights = list(EVENT_WEIGHTS.values())
+    return [
+        (rng.choices(kinds, weights)[0], rng.randrange(channels), rng.randrange(users))
+        for _ in range(count)
+    ]
+
+
+async def replay(args) -> dict:
+    logger = logging.getLogger("bench-cogs")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+
+    runner, base_url = await start_fake_api(args.api_latency, args.token_rate, args.tokens)
+    api_utils.BASE_URL = base_url # Read on every request, so the cogs now talk to the fake API
+    session = api_utils.create_session()
+    bot = SimpleNamespace(
+        session=session,
+        memory=ConversationMemory(),
+        llm="fake",
+        model="bench",
+        user=FakeUser(0),
+    )
+    agent, games, log = AgentCog(bot, logger), GamesCog(bot, logger), LoggingCog(bot, logger)
+    guild = SimpleNamespace(id=1)
+    channels = [SimpleNamespace(id=100 + i) for i in range(args.channels)]
+    users = [FakeUser(1000 + i) for i in range(args.users)]
+    rng = random.Random(args.seed)
+    events = make_events(args.events, args.channels, args.users, rng)
+
+    async def handle(kind: str, channel, author):
+        ctx = FakeContext(bot, channel, author, guild, kind, args.send_latency)
+        match kind:
+            case "message":
+                await log.on_message(FakeMessage(channel, author, "hello there"))
+            case "message_edit":
+                before = FakeMessage(channel, author, "helo")
+                after = FakeMessage(channel, author, "hello")
+                await log.on_message_edit(before, after)
+            case "reaction_add":
+                await log.on_reaction_add(SimpleNamespace(emoji="+1", message=FakeMessage(channel, author, "hi")), author)
+            case "coinflip":
+                await log.on_message(FakeMessage(channel, author, "/coinflip"))
+                await games.coinflip.callback(games, ctx)
+            case "rps":
+                await log.on_message(FakeMessage(channel, author, "/rps rock"))
+                await games.rps.callback(games, ctx, rng.choice(["rock", "paper", "scissors"]))
+            case "query":
+                await log.on_message(FakeMessage(channel, author, "/query what is new"))
+                await agent.query_agent.callback(agent, ctx, "what", "is", "new")
+
+    samples: dict[str, list[float]] = defaultdict(list)
+    pending = iter(events)
+
+    async def worker():
+        for kind, channel, user in pending:
+            start = time.perf_counter()
+            await handle(kind, channels[channel], users[user])
+            samples[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        elapsed = time.perf_counter() - start
+        await session.close()
+        await runner.cleanup()
+
+    return {
+        "events": args.events,
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "throughput_eps": args.events / elapsed if elapsed else 0.0,
+        "by_event": {
+            kind: {
+                "count": len(times),
+                "p50_ms": percentile(times, 50),
+                "p95_ms": percentile(times, 95),
+                "p99_ms": percentile(times, 99),
+            }
+            for kind, times in sorted(samples.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--send-latency", type=float, default=0.0, help="Seconds each Discord send or edit takes")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Fake API seconds to first token")
+    parser.add_argument("--token-rate", type=float, default=200, help="Fake API tokens per second")
+    parser.add_argument("--tokens", type=int, default=32, help="Fake API tokens per answer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_cogs.json")
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(args))
+    for kind, stats in result["by_event"].items():
+        print(f"{kind:>14}: {stats['count']:>5} events, p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+    print(f"{result['throughput_eps']:.0f} events/s")
+    with open(args.output, "w") as f:
+        json.dump({"benchmark": "cog_replay", "results": [result]}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -6,8 +7,10 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 
-from util.api_utils import query_post
-from util.message_utils import send_message
+from util.api_utils import agent_post, attachment_post, query_stream
+from util.message_utils import send_message, sender, stream_message
+from util.memory_utils import estimate_tokens
+from util.state_utils import game_stats
 
 class AgentCog(commands.Cog, name="Agent"):
     def __init__(self, bot, logger):
@@ -25,7 +28,8 @@ class AgentCog(commands.Cog, name="Agent"):
     async def query_agent(self, ctx, *msg):
         """
         Handles the query command to process user input and respond with the
-        message or inform the user if no message is provided.
+        message or inform the user if no message is provided. Files attached to the
+        command message are processed by the API and sent along with the query.
 
         :param ctx: The context of the command invocation, typically includes
                     information about its usage and the channel.
@@ -34,23 +38,107 @@ class AgentCog(commands.Cog, name="Agent"):
         :return: None, as the function sends messages directly to the context.
         """
         try:
-            if msg:
-                msg = " ".join(msg) # Convert msg tuple to single string, delimits words using spaces 
+            if msg or ctx.message.attachments:
+                msg = " ".join(msg) or "Describe the attached files." # Convert msg tuple to single string, delimits words using spaces 
                 self.logger.debug(f"Queried Agent: {self.bot.llm} ({self.bot.model})")
+                summary, history = await self.bot.memory.context(ctx.channel.id, estimate_tokens(msg))
+                status = None
+
+                async def show_queue_position(position):
+                    nonlocal status
+                    text = f"Waiting in queue, position {position}"
+                    if status is None:
+                        status = await sender.send(ctx, text)
+                    else:
+                        await sender.edit(status, text)
+
                 async with ctx.typing():
-                    response = await query_post(
+                    attachments = await asyncio.gather(*(
+                        attachment_post(self.bot.session, attachment, self.logger)
+                        for attachment in ctx.message.attachments
+                    ))
+                    stream = query_stream(
+                        self.bot.session,
                         prompt=msg,
                         llm=self.bot.llm,
                         model=self.bot.model,
-                        logger=self.logger
+                        logger=self.logger,
+                        history=history,
+                        summary=summary,
+                        user_id=ctx.author.id,
+                        guild_id=ctx.guild.id if ctx.guild else None,
+                        on_queue=show_queue_position,
+                        attachments=attachments
                     )
+                    try:
+                        response = await stream_message(ctx=ctx, stream=stream, logger=self.logger) # Edit messages as tokens arrive
+                    finally:
+                        if status is not None:
+                            await status.delete()
                     self.logger.debug(response)
-                    await send_message(ctx=ctx, message=response, logger=self.logger) # Send the converted message
+                await self.bot.memory.add(ctx.channel.id, msg, response)
             else:
                 self.logger.debug(f"Didnt enter a message")
                 await ctx.send("Enter a message")
+        except RuntimeError as e: # API errors, e.g. a full queue, are shown to the user
+            self.logger.error(e)
+            await ctx.send(f"Query failed: {e}")
         except Exception as e:
             self.logger.error(e)
             
             
-                    
\ No newline at end of file
+    @commands.command(name="agent")
+    async def agent(self, ctx, *msg):
+        """
+        Answers a message with the API's agent, which may search this server's
+        event log, look up indexed documents, do math and read the user's game
+        results before it answers. A footer shows the steps, tool calls and time taken.
+
+        :param ctx: Invocation context of the command.
+        :param msg: A tuple containing parts of the message passed with the command.
+        :return: None
+        """
+        if not msg:
+            await ctx.send("Enter a message")
+            return
+        msg = " ".join(msg)
+        self.logger.debug(f"Queried Agent tools: {self.bot.llm} ({self.bot.model})")
+        summary, history = await self.bot.memory.context(ctx.channel.id, estimate_tokens(msg))
+        async with ctx.typing():
+            response = await agent_post(
+                self.bot.session,
+                prompt=msg,
+                llm=self.bot.llm,
+                model=self.bot.model,
+                logger=self.logger,
+                history=history,
+                summary=summary,
+                user_id=ctx.author.id,
+                guild_id=ctx.guild.id if ctx.guild else None,
+                context={"game_stats": await game_stats(self.bot.state, ctx.author.id)},
+            )
+        if "error" in response:
+            await ctx.send(f"Query failed: {response['error']}")
+            return
+        tools = f"{response['tool_calls']} tool calls"
+        if response["cached_tool_calls"]:
+            tools += f" ({response['cached_tool_calls']} cached)"
+        footer = f"-# {response['steps']} steps, {tools}, {response['duration_ms'] / 1000:.1f}s"
+        if response["stopped"] != "answer":
+            footer += f", stopped at {response['stopped'].replace('_', ' ')}"
+        await send_message(ctx, {"content": f"{response['content']}\n{footer}"}, self.logger)
+        await self.bot.memory.add(ctx.channel.id, msg, response["content"])
+
+
+    @commands.command(name="forget")
+    async def forget(self, ctx):
+        """
+        Clears the agent's conversation memory for the current channel or thread.
+
+        :param ctx: Invocation context of the command.
+        :type ctx: commands.Context
+        :return: None
+        """
+        await self.bot.memory.clear(ctx.channel.id)
+        self.logger.debug(f"Cleared conversation memory for channel {ctx.channel.id}")
+        await ctx.send("Conversation memory cleared")
@@ -1,6 +1,7 @@
 import random
 from discord.ext import commands
 from cogs.logging import get_formatted_time
+from util.state_utils import record_game, shared_cooldown
 
 class GamesCog(commands.Cog, name="Games"):
     def __init__(self, bot, logger):
@@ -24,11 +25,12 @@ class GamesCog(commands.Cog, name="Games"):
         """
         result = random.choice(["Heads", "Tails"])
         await ctx.send(f"The coin landed on **{result}**")
+        await record_game(self.bot.state, ctx.author.id, "coinflip", result.lower())
         self.logger.info(f"The coin landed on {result}")
 
 
     @commands.command(name="rps")
-    @commands.cooldown(1, 5, commands.BucketType.user)
+    @shared_cooldown(1, 5, commands.BucketType.user) # Shared by every shard process
     async def rps(self, ctx, choice: str):
         """
         Handles a game of rock-paper-scissors between the user and the bot. The bot randomly
@@ -50,14 +52,15 @@ class GamesCog(commands.Cog, name="Games"):
         bot_choice = random.choice(options)
         # Determine winrar
         if choice == bot_choice:
-            outcome = "It's a tie!"
+            result, outcome = "tie", "It's a tie!"
         elif (
                 (choice == "rock" and bot_choice == "scissors") or
                 (choice == "paper" and bot_choice == "rock") or
                 (choice == "scissors" and bot_choice == "paper")
         ):
-            outcome = "You won!"
+            result, outcome = "win", "You won!"
         else:
-            outcome = "I win!"
+            result, outcome = "loss", "I win!"
         await ctx.send(f"You chose **{choice}**, I chose **{bot_choice}**. {outcome}")
+        await record_game(self.bot.state, ctx.author.id, "rps", result)
         self.logger.info(f"{ctx.author} chose {choice}, I chose {bot_choice}. {outcome}")
\ No newline at end of file
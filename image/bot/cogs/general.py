@@ -1,5 +1,80 @@
+import re
+import time
+from datetime import datetime, timedelta, timezone
+import discord
 from discord.ext import commands
-from util import api_utils
+from util import api_utils, database_utils
+from util.state_utils import shard_statuses
+
+LOGS_PAGE_SIZE = 10
+DURATION = re.compile(r"^(\d+)([mhd])$")
+DURATION_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+def _format(value) -> str:
+    return "-" if value is None else f"{value:.3g}"
+
+
+def _parse_time(value: str | None) -> str | None:
+    """
+    Turns a relative duration (``30m``, ``2h``, ``7d``) or an ISO date into the ISO
+    timestamp the API expects.
+    """
+    if value is None:
+        return None
+    match = DURATION.match(value.strip().lower())
+    if match:
+        delta = timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+        return (datetime.now(timezone.utc) - delta).isoformat()
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise commands.BadArgument(f"Not a duration or ISO date: {value}")
+
+
+def _format_logs(page: dict) -> str:
+    if "error" in page:
+        return page["error"][:1900]
+    if not page["logs"]:
+        return "No matching log entries"
+    return "\n".join(entry["message"][:180] for entry in page["logs"])[:1900]
+
+
+class LogFlags(commands.FlagConverter):
+    user: discord.Member | None = None
+    level: str | None = None
+    event: str | None = None
+    since: str | None = "1d"
+    until: str | None = None
+    text: str | None = None
+
+
+class LogPager(discord.ui.View):
+    """
+    An "Older" button under a page of log entries that replaces it with the next
+    page. Only the member who searched can use it.
+    """
+    def __init__(self, cog, author_id: int, filters: dict, cursor: str):
+        super().__init__(timeout=300)
+        self.cog = cog
+        self.author_id = author_id
+        self.filters = filters
+        self.cursor = cursor
+
+    @discord.ui.button(label="Older", style=discord.ButtonStyle.secondary)
+    async def older(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Run /logs to search yourself", ephemeral=True)
+            return
+        page = await api_utils.logs_search(
+            self.cog.bot.session, self.cog.logger, **self.filters, cursor=self.cursor
+        )
+        self.cursor = page.get("next_cursor")
+        await interaction.response.edit_message(
+            content=_format_logs(page),
+            view=self if self.cursor else None,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
 
 
 class GeneralCog(commands.Cog, name="General"):
@@ -55,8 +130,91 @@ class GeneralCog(commands.Cog, name="General"):
         :rtype: None
         """
         response = await api_utils.health_get(
+            self.bot.session,
             verbosity=int(verbosity), 
             logger=self.logger
         )
-        await ctx.send(response["health"])
+        await ctx.send(response.get("health", response.get("error")))
+        for name, series in response.get("latency", {}).items():
+            lines = [
+                f"{labels}: n={stats['count']} p50={_format(stats['p50'])} p95={_format(stats['p95'])}"
+                for labels, stats in series.items()
+            ]
+            if lines:
+                await ctx.send(f"**{name}**\n" + "\n".join(lines)[:1900])
+        
+        
+    @commands.command(name="dbstats")
+    @commands.is_owner()
+    async def db_stats(self, ctx):
+        """
+        Sends the database pool statistics (connections in use, idle connections and
+        acquire wait times) to the invoking channel. Restricted to the bot owner.
+
+        :param ctx: Invocation context of the command.
+        :type ctx: commands.Context
+        :return: None
+        """
+        stats = database_utils.pool_stats(self.bot.db_pool)
+        await ctx.send("\n".join(f"{name}: {value}" for name, value in stats.items()))
         
+        
+    @commands.command(name="shards")
+    async def shards(self, ctx):
+        """
+        Sends the status of every shard as last reported to the shared state: its
+        cluster, gateway latency and guild count. Shards that have not reported for a
+        minute are marked stale.
+
+        :param ctx: Invocation context of the command.
+        :type ctx: commands.Context
+        :return: None
+        """
+        statuses = await shard_statuses(self.bot.state)
+        if not statuses:
+            await ctx.send("No shard has reported yet")
+            return
+        lines = []
+        for shard_id, status in sorted(statuses.items()):
+            latency = "-" if status["latency"] is None else f"{status['latency'] * 1000:.0f} ms"
+            state = "stale" if time.time() - status["updated"] > 60 else ("closed" if status["closed"] else "up")
+            here = " (this shard)" if ctx.guild is not None and ctx.guild.shard_id == shard_id else ""
+            lines.append(
+                f"Shard {shard_id}{here}: {state}, cluster {status['cluster']}, {latency}, {status['guilds']} guilds"
+            )
+        await ctx.send("\n".join(lines)[:1900])
+        
+        
+    @commands.command(name="logs")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def logs(self, ctx, *, flags: LogFlags):
+        """
+        Searches this server's event log, newest first, for example
+        ``/logs user: @name level: warning since: 2h text: some words``. Pages
+        through older entries with a button. Restricted to server managers.
+
+        :param ctx: Invocation context of the command.
+        :type ctx: commands.Context
+        :param flags: Filters: ``user``, minimum ``level``, ``event``, ``since`` and
+            ``until`` as durations (30m, 2h, 7d) or ISO dates, and ``text``.
+        :type flags: LogFlags
+        :return: None
+        """
+        filters = {
+            "guild_id": ctx.guild.id,
+            "user_id": flags.user.id if flags.user else None,
+            "level": flags.level.upper() if flags.level else None,
+            "event": flags.event,
+            "since": _parse_time(flags.since),
+            "until": _parse_time(flags.until),
+            "text": flags.text,
+            "limit": LOGS_PAGE_SIZE,
+        }
+        page = await api_utils.logs_search(self.bot.session, self.logger, **filters)
+        cursor = page.get("next_cursor")
+        await ctx.send(
+            _format_logs(page),
+            view=LogPager(self, ctx.author.id, filters, cursor) if cursor else None,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
@@ -1,15 +1,25 @@
 import datetime
 from discord.ext import commands
+from util.logging_utils import EventLogger
+from util.metrics import registry as metrics, counted
+
+GATEWAY_EVENTS = metrics.counter("discord_gateway_events_total", "Gateway events seen by the logging listeners")
 
 
 async def get_formatted_time():
     dt = datetime.datetime.now()
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
+
+def _guild_id(source) -> int | None:
+    return source.guild.id if source.guild is not None else None
+
+
 class LoggingCog(commands.Cog, name="Logging"):
     def __init__(self, bot, logger):
         self.bot = bot
         self.logger = logger
+        self.events = EventLogger(logger)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -20,47 +30,108 @@ class LoggingCog(commands.Cog, name="Logging"):
     # ----------------------------------------------------------------------------
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "message"})
     async def on_message(self, message):
         if not message.author == self.bot.user:
-            self.logger.info(f"{message.author}: {message.content}")
+            self.events.info(
+                "message", "{user}: {content}",
+                guild_id=_guild_id(message), channel_id=message.channel.id, user_id=message.author.id,
+                message_id=message.id, user=message.author.name, content=message.content,
+            )
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "message_delete"})
     async def on_message_delete(self, message):
-        self.logger.warning(f"{message.author.name} has deleted a message: {message.content}")
+        self.events.warning(
+            "message_delete", "{user} has deleted a message: {content}",
+            guild_id=_guild_id(message), channel_id=message.channel.id, user_id=message.author.id,
+            message_id=message.id, user=message.author.name, content=message.content,
+        )
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "message_edit"})
     async def on_message_edit(self, before, after):
-        self.logger.warning(f"{before.author.name} has edited a message: {before.content} -> {after.content}")
+        self.events.warning(
+            "message_edit", "{user} has edited a message: {before} -> {after}",
+            guild_id=_guild_id(before), channel_id=before.channel.id, user_id=before.author.id,
+            message_id=before.id, user=before.author.name, before=before.content, after=after.content,
+        )
 
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "reaction_add"})
     async def on_reaction_add(self, reaction, user):
-        self.logger.debug(f"{user.name} has added a reaction to a message: {reaction.emoji}")
+        self.events.debug(
+            "reaction_add", "{user} has added a reaction to a message: {emoji}",
+            guild_id=_guild_id(reaction.message), channel_id=reaction.message.channel.id, user_id=user.id,
+            message_id=reaction.message.id, user=user.name, emoji=reaction.emoji,
+        )
 
     # ----------------------------------------------------------------------------
     # Members
     # ----------------------------------------------------------------------------
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "member_join"})
     async def on_member_join(self, member):
-        self.logger.debug(f"{member.name} just joined the server!")
+        self.events.debug(
+            "member_join", "{user} just joined the server!",
+            guild_id=member.guild.id, user_id=member.id, user=member.name,
+        )
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "member_remove"})
     async def on_member_remove(self, member):
-        self.logger.warning(f"{member.name} just left the server!")
+        self.events.warning(
+            "member_remove", "{user} just left the server!",
+            guild_id=member.guild.id, user_id=member.id, user=member.name,
+        )
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "member_update"})
     async def on_member_update(self, before, after):
-        self.logger.warning(f"{before.name} has changed their nickname to {after.name}")
+        self.events.warning(
+            "member_update", "{before} has changed their nickname to {after}",
+            guild_id=after.guild.id, user_id=after.id, before=before.name, after=after.name,
+        )
 
     # ----------------------------------------------------------------------------
     # Commands
     # ----------------------------------------------------------------------------
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "command_completion"})
     async def on_command_completion(self, ctx):
-        self.logger.debug(f"Command completed: {ctx.prefix}{ctx.command}")
+        self.events.debug(
+            "command_completion", "Command completed: {prefix}{command}",
+            guild_id=_guild_id(ctx), channel_id=ctx.channel.id, user_id=ctx.author.id,
+            prefix=ctx.prefix, command=ctx.command,
+        )
 
     @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "command_error"})
     async def on_command_error(self, ctx, error):
-        self.logger.error(f"Command error: {ctx.prefix}{error}")
\ No newline at end of file
+        self.events.error(
+            "command_error", "Command error: {prefix}{error}",
+            guild_id=_guild_id(ctx), channel_id=ctx.channel.id, user_id=ctx.author.id,
+            prefix=ctx.prefix, command=ctx.command, error=error,
+        )
+
+    # ----------------------------------------------------------------------------
+    # Shards
+    # ----------------------------------------------------------------------------
+
+    @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "shard_ready"})
+    async def on_shard_ready(self, shard_id):
+        self.events.info("shard_ready", "Shard {shard_id} is ready", shard_id=shard_id)
+
+    @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "shard_disconnect"})
+    async def on_shard_disconnect(self, shard_id):
+        self.events.warning("shard_disconnect", "Shard {shard_id} disconnected", shard_id=shard_id)
+
+    @commands.Cog.listener()
+    @counted(GATEWAY_EVENTS, {"event": "shard_resumed"})
+    async def on_shard_resumed(self, shard_id):
+        self.events.info("shard_resumed", "Shard {shard_id} resumed its session", shard_id=shard_id)
@@ -1,6 +1,9 @@
 import os
+import math
+import importlib
 import logging
 import asyncio
+from collections import Counter
 import asyncpg
 import discord
 from discord import app_commands
@@ -8,22 +11,41 @@ from discord.ext import commands
 from dotenv import load_dotenv
 load_dotenv()
 
-from util.logging_utils import setup_logging
-from cogs.agent import AgentCog
-from cogs.logging import LoggingCog
-from cogs.general import GeneralCog
-from cogs.games import GamesCog
+from util.logging_utils import setup_logging, shutdown_logging
+from util.api_utils import create_session, api_socket, API_TRANSPORT
+from util import database_utils, metrics
+from util.state_utils import create_state, report_shard
+from util.memory_utils import create_memory, llm_summarizer
 
-class DiscordBot(commands.Bot):
+# Cogs are imported only when enabled, see DiscordBot.setup_hook
+COGS = {
+    "general": ("cogs.general", "GeneralCog"),
+    "games": ("cogs.games", "GamesCog"),
+    "logging": ("cogs.logging", "LoggingCog"),
+    "agent": ("cogs.agent", "AgentCog"),
+}
+
+class DiscordBot(commands.AutoShardedBot):
     def __init__(self, *cogs):
         self.db_pool = None
+        self.session = None
+        self.memory = None
+        self.state = None
+        self.shard_reporter = None
+        self.log_maintainer = None
+        self.cluster_id = os.getenv("CLUSTER_ID", "0")
+        self.metrics_runner = None
         self.logger = None
         self.cogs_list = cogs
         self.logger_name = "Discord Logger"
         self.prefix = "/"
         self.description = "A Discord bot that has multipurpose utility"
-        self.llm = "ollama"
-        self.model = "deepseek-r1:7b"
+        self.llm = "route" # Let the API pick the fastest healthy backend
+        self.model = os.getenv("LLM_ROUTE", "default") # Route name, see LLM_ROUTES in the API
+        if os.getenv("LLM_CASCADE"):
+            # A small model answers first, see LLM_CASCADES in the API
+            self.llm = "cascade"
+            self.model = os.getenv("LLM_CASCADE")
         
         # intents config
         intents = discord.Intents.default()
@@ -31,38 +53,74 @@ class DiscordBot(commands.Bot):
         intents.members = True
         intents.message_content = True
         
+        # Sharding: by default one process runs Discord's recommended number of shards.
+        # A supervisor (supervisor.py) runs clusters by giving each process its SHARD_IDS.
+        shard_count = os.getenv("SHARD_COUNT")
+        shard_ids = os.getenv("SHARD_IDS")
+        
         super().__init__(
             command_prefix=self.prefix,
             intents=intents,
-            description=self.description
+            description=self.description,
+            shard_count=int(shard_count) if shard_count else None,
+            shard_ids=[int(i) for i in shard_ids.split(",")] if shard_ids else None
         )
         
         self.run(os.getenv("BOT_TOKEN"))
         
     async def setup_hook(self):
         # Need to create an implementation for AWS DynamoDB to hold Discord logs
+        try:
+            dsn = os.getenv("DB_URL")
+            if dsn:
+                await database_utils.wait_until_ready(dsn)
+                self.db_pool = await database_utils.create_pool(dsn)
+                await database_utils.ensure_schema(self.db_pool)
+        except Exception as e:
+            print(f"Failed to connect to database, logging to console. Error: {e}")
+            if self.db_pool is not None:
+                await self.db_pool.close()
+                self.db_pool = None
+            
         try:
             loop = asyncio.get_running_loop()
             self.logger = setup_logging(self.db_pool, loop, self.logger_name, logging.DEBUG, "logs")
         except Exception as e:
             print(f"Failed to configure logger. Error: {e}")
             
-        try:
-            for cog in self.cogs_list:
-                match cog:
-                    case "general":
-                        await self.add_cog(GeneralCog(self, self.logger))
-                    case "games":
-                        await self.add_cog(GamesCog(self, self.logger))
-                    case "logging":
-                        await self.add_cog(LoggingCog(self, self.logger))
-                    case "agent":
-                        await self.add_cog(AgentCog(self, self.logger))
-                    case _:
-                        # Default case: if no names matches, no cog is added
-                        self.logger.error(f"Cog {cog} not found.")
-        except Exception as e:
-            self.logger.error(f"Couldn't load cog: {e}")
+        self.session = create_session() # Shared by every API call, closed in close()
+        if API_TRANSPORT == "websocket":
+            api_socket.start(self.session, self.logger) # Falls back to HTTP while disconnected
+        self.state = create_state() # Cooldowns and shard status shared by every shard process
+        self.shard_reporter = asyncio.create_task(self.report_shards())
+        if self.db_pool is not None:
+            self.log_maintainer = asyncio.create_task(self.maintain_logs())
+        metrics.registry.gauge(
+            "discord_shard_latency_seconds",
+            "Gateway heartbeat latency of each shard in this process",
+            lambda: {(("shard", str(shard_id)),): latency for shard_id, latency in self.latencies},
+        )
+        metrics_port = os.getenv("METRICS_PORT")
+        if metrics_port:
+            try:
+                self.metrics_runner = await metrics.start_server(os.getenv("METRICS_HOST", "0.0.0.0"), int(metrics_port))
+            except Exception as e:
+                self.logger.error(f"Failed to start metrics server: {e}")
+        self.memory = create_memory(self.db_pool)
+        if os.getenv("MEMORY_SUMMARIZER") == "llm":
+            self.memory.summarizer = llm_summarizer(self.session, self.llm, self.model, self.logger)
+        
+        for cog in self.cogs_list:
+            if cog not in COGS:
+                # Default case: if no names matches, no cog is added
+                self.logger.error(f"Cog {cog} not found.")
+                continue
+            try:
+                module, class_name = COGS[cog]
+                cog_class = getattr(importlib.import_module(module), class_name)
+                await self.add_cog(cog_class(self, self.logger))
+            except Exception as e:
+                self.logger.error(f"Couldn't load cog {cog}: {e}")
             
     async def on_ready(self):
         guild_id = os.getenv("GUILD_ID")
@@ -74,18 +132,62 @@ class DiscordBot(commands.Bot):
             self.logger.debug("Synced Tree Commands without guild")
         self.logger.debug(f"Logged in as {self.user} (ID: {self.user.id})")
         
+    async def report_shards(self, interval: float = 15.0):
+        """
+        Publishes the status of this process' shards to the shared state every
+        ``interval`` seconds, for the ``shards`` command.
+        """
+        while True:
+            try:
+                guilds = Counter(guild.shard_id for guild in self.guilds)
+                for shard_id, shard in self.shards.items():
+                    await report_shard(self.state, shard_id, {
+                        "cluster": self.cluster_id,
+                        "pid": os.getpid(),
+                        "latency": shard.latency if not shard.is_closed() and math.isfinite(shard.latency) else None,
+                        "closed": shard.is_closed(),
+                        "guilds": guilds.get(shard_id, 0),
+                    })
+            except Exception as e:
+                self.logger.warning(f"Failed to report shard status: {e}")
+            await asyncio.sleep(interval)
+    
+    async def maintain_logs(self, interval: float = 3600.0):
+        """
+        Creates upcoming log partitions and drops the ones past ``LOG_RETENTION_DAYS``
+        every ``interval`` seconds. Safe to run in every shard process.
+        """
+        while True:
+            try:
+                result = await database_utils.maintain_log_partitions(self.db_pool)
+                if result["created"] or result["dropped"]:
+                    self.logger.info(f"Log partitions created: {result['created']}, dropped: {result['dropped']}")
+            except Exception as e:
+                self.logger.warning(f"Failed to maintain log partitions: {e}")
+            await asyncio.sleep(interval)
+    
     async def close(self):
+        if self.shard_reporter is not None:
+            self.shard_reporter.cancel()
+        if self.log_maintainer is not None:
+            self.log_maintainer.cancel()
+        if self.logger is not None:
+            await shutdown_logging(self.logger) # Write queued log records before the pool goes away
         if self.db_pool is not None:
             if hasattr(self, "db_pool"):
                 self.logger.debug("Close database connection")
                 await self.db_pool.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if api_socket.started:
+            await api_socket.close()
+        if self.session is not None:
+            self.logger.debug("Close API session")
+            await self.session.close()
+        if self.state is not None:
+            await self.state.aclose()
         self.logger.debug("Close bot connection")
         await super().close()
 
 if __name__ == "__main__":
-    DiscordBot(
-        "agent",
-        "logging",
-        "general",
-        "games"
-    )
\ No newline at end of file
+    DiscordBot(*os.getenv("BOT_COGS", "agent,logging,general,games").split(","))
@@ -0,0 +1,120 @@
+"""
+Runs the bot as several shard cluster processes.
+
+``SHARD_COUNT`` shards (Discord's recommendation when unset) are split into
+``SHARD_CLUSTERS`` processes, each running main.py with its own ``SHARD_IDS``.
+Clusters are started one after another so their shards stay within the gateway's
+identify rate limit, and a cluster that exits is restarted with exponential
+backoff. Cooldowns and shard status are only shared between clusters through
+Redis, so set ``REDIS_URL``. Run from image/bot:
+
+    python supervisor.py
+"""
+import asyncio
+import math
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+load_dotenv()
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+IDENTIFY_INTERVAL = 5.0 # Seconds per identify bucket, see Discord's session_start_limit
+
+
+async def recommended_shards(token: str) -> tuple[int, int]:
+    """
+    :return: Discord's recommended shard count and the identify max_concurrency.
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+def split_shards(shard_count: int, clusters: int) -> list[list[int]]:
+    per_cluster = math.ceil(shard_count / clusters)
+    return [
+        list(range(start, min(start + per_cluster, shard_count)))
+        for start in range(0, shard_count, per_cluster)
+    ]
+
+
+class Cluster:
+    def __init__(self, cluster_id: int, shard_ids: list[int], shard_count: int):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process: asyncio.subprocess.Process | None = None
+
+    def env(self) -> dict:
+        return {
+            **os.environ,
+            "CLUSTER_ID": str(self.cluster_id),
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(str(shard_id) for shard_id in self.shard_ids),
+        }
+
+    async def run(self, stop: asyncio.Event):
+        failures = 0
+        while not stop.is_set():
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, "main.py", env=self.env())
+            print(f"Cluster {self.cluster_id} started (pid {self.process.pid}, shards {self.shard_ids})")
+            waiter = asyncio.create_task(self.process.wait())
+            stopper = asyncio.create_task(stop.wait())
+            await asyncio.wait({waiter, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            stopper.cancel()
+            if stop.is_set():
+                await self.terminate(waiter)
+                return
+            failures = 0 if time.monotonic() - started > 60 else failures + 1
+            delay = min(60, 2 ** failures)
+            print(f"Cluster {self.cluster_id} exited with code {waiter.result()}, restarting in {delay}s")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def terminate(self, waiter: asyncio.Task, timeout: float = 30.0):
+        if self.process.returncode is None:
+            self.process.terminate()
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Cluster {self.cluster_id} did not stop within {timeout}s, killing it")
+            self.process.kill()
+            await waiter
+
+
+async def main():
+    token = os.getenv("BOT_TOKEN")
+    shard_count, max_concurrency = await recommended_shards(token)
+    shard_count = int(os.getenv("SHARD_COUNT", shard_count))
+    clusters = max(1, min(int(os.getenv("SHARD_CLUSTERS", "1")), shard_count))
+    if clusters > 1 and not os.getenv("REDIS_URL"):
+        print("REDIS_URL is not set, cooldowns and shard status will not be shared between clusters")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = []
+    for cluster_id, shard_ids in enumerate(split_shards(shard_count, clusters)):
+        cluster = Cluster(cluster_id, shard_ids, shard_count)
+        tasks.append(asyncio.create_task(cluster.run(stop)))
+        # Let this cluster identify all its shards before the next one starts
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=math.ceil(len(shard_ids) / max_concurrency) * IDENTIFY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+"""
+Run from image/bot: python -m pytest tests
+"""
+from util.message_utils import FENCE, format_text
+
+
+def fences(chunk: str) -> int:
+    return sum(1 for line in chunk.split("\n") if FENCE.match(line))
+
+
+def test_code_block_across_the_limit_is_closed_and_reopened():
+    code = "\n".join(f"print({i})  # line {i}" for i in range(150))
+    text = "Here is the script:\n\n```python\n" + code + "\n```\n\nThat is all."
+    assert len(text) > 2000
+    chunks = format_text(text)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 2000 for chunk in chunks)
+    assert all(fences(chunk) % 2 == 0 for chunk in chunks)
+    reopened = [chunk for chunk in chunks if "print(" in chunk]
+    assert len(reopened) > 1
+    assert all("```python\nprint(" in chunk for chunk in reopened)
+    assert "".join(chunks).count("print(") == 150
+
+
+def test_short_paragraphs_are_packed_into_one_message():
+    paragraphs = [f"Paragraph {i}. " + "word " * 20 for i in range(10)]
+    chunks = format_text("\n\n".join(paragraphs))
+    assert chunks == ["\n\n".join(paragraphs)]
+
+
+def test_no_chunk_exceeds_max_length():
+    text = "\n\n".join([
+        "x" * 450,
+        "short line\n" * 30,
+        "```\n" + "y" * 700 + "\n```",
+        " ".join(["word"] * 300),
+    ])
+    for max_length in (100, 200, 500):
+        chunks = format_text(text, max_length)
+        assert all(0 < len(chunk) <= max_length for chunk in chunks)
+        assert all(fences(chunk) % 2 == 0 for chunk in chunks)
+
+
+def test_code_block_still_streaming_is_shown_closed():
+    assert format_text("```python\nprint(1)") == ["```python\nprint(1)\n```"]
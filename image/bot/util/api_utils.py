@@ -1,109 +1,439 @@
 import aiohttp
+import asyncio
 import os
 import json
+import random
 from dotenv import load_dotenv
 load_dotenv()
 from logging import Logger
 
+from util.metrics import registry as metrics, timed, timed_stream
+from util.socket_utils import ApiSocket, SocketUnavailableError
+
+API_LATENCY = metrics.histogram("api_request_duration_seconds", "Bot to API requests, by endpoint")
+API_TTFT = metrics.histogram("api_stream_first_piece_seconds", "Time until a streamed answer starts, queue wait included")
+
 BASE_URL = os.getenv("API_URL")
 
-async def _get(logger: Logger, content: dict, endpoint: str = "/"):
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "180"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_STREAM_READ_TIMEOUT = float(os.getenv("API_STREAM_READ_TIMEOUT", "120"))
+API_BATCH_TIMEOUT = float(os.getenv("API_BATCH_TIMEOUT", "900"))
+API_CONNECTION_LIMIT = int(os.getenv("API_CONNECTION_LIMIT", "50"))
+API_KEEPALIVE_TIMEOUT = float(os.getenv("API_KEEPALIVE_TIMEOUT", "60"))
+API_DNS_CACHE_TTL = int(os.getenv("API_DNS_CACHE_TTL", "300"))
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+API_BACKOFF_BASE = float(os.getenv("API_BACKOFF_BASE", "0.5"))
+API_BACKOFF_MAX = float(os.getenv("API_BACKOFF_MAX", "8"))
+
+API_ATTACHMENT_MAX_BYTES = int(os.getenv("API_ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+API_ATTACHMENT_CHUNK = 64 * 1024
+
+# "websocket" sends queries over one persistent socket, see ApiSocket; HTTP stays the fallback
+API_TRANSPORT = os.getenv("API_TRANSPORT", "http")
+API_WS_ENCODING = os.getenv("API_WS_ENCODING", "msgpack")
+API_WS_HEARTBEAT = float(os.getenv("API_WS_HEARTBEAT", "30"))
+API_WS_CONNECT_WAIT = float(os.getenv("API_WS_CONNECT_WAIT", "5"))
+
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Creates the HTTP session shared by every API call the bot makes.
+
+    The connector keeps connections alive between commands and caches DNS lookups.
+    The session is created in ``DiscordBot.setup_hook`` and closed in ``DiscordBot.close``.
+
+    :return: A new client session with the tuned connector and default timeouts.
+    :rtype: aiohttp.ClientSession
+    """
+    connector = aiohttp.TCPConnector(
+        limit=API_CONNECTION_LIMIT,
+        keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=API_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(total=API_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers={"Content-Type": "application/json"},
+    )
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter keeps several shards from retrying in lockstep
+    return random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+
+
+# Started in DiscordBot.setup_hook when API_TRANSPORT is "websocket"
+api_socket = ApiSocket(BASE_URL, API_WS_ENCODING, _backoff, API_WS_CONNECT_WAIT, API_WS_HEARTBEAT)
+
+
+async def _send(
+        session: aiohttp.ClientSession,
+        logger: Logger,
+        method: str,
+        url: str,
+        idempotent: bool,
+        **kwargs
+        ) -> aiohttp.ClientResponse:
+    """
+    Sends a request, retrying with jittered exponential backoff.
+
+    Refused connections are always retried since nothing reached the API. Server
+    errors (5xx) are only retried for idempotent requests.
+
+    :return: The response of the last attempt. The caller must release it.
+    :rtype: aiohttp.ClientResponse
+    :raises aiohttp.ClientConnectorError: If the API cannot be reached after every retry.
     """
-    Performs an asynchronous HTTP GET request to a specified API endpoint using `aiohttp`.
+    for attempt in range(API_RETRIES + 1):
+        last_attempt = attempt == API_RETRIES
+        try:
+            response = await session.request(method, url, **kwargs)
+        except aiohttp.ClientConnectorError as e:
+            if last_attempt:
+                raise
+            logger.warning(f"{method} to {url} could not connect ({e}), retrying")
+        else:
+            if not (idempotent and response.status in RETRY_STATUSES) or last_attempt:
+                return response
+            logger.warning(f"{method} to {url} returned status {response.status}, retrying")
+            response.release()
+        await asyncio.sleep(_backoff(attempt))
 
-    The method creates a session with `aiohttp.ClientSession`, constructs the request
-    URL using the provided endpoint, and sends a GET request along with JSON content 
-    and headers. Logs operations and handles response statuses and errors appropriately.
 
+@timed(API_LATENCY, lambda method, endpoint, **_: {"method": method, "endpoint": endpoint})
+async def _request(
+        session: aiohttp.ClientSession,
+        logger: Logger,
+        method: str,
+        content: dict,
+        endpoint: str = "/",
+        idempotent: bool = False
+        ):
+    """
+    Sends JSON content to an API endpoint over the shared session and handles the
+    response the same way for every method.
+
+    :param session: The bot's shared client session
+    :type session: aiohttp.ClientSession
     :param logger: Logger instance for logging request-related messages
     :type logger: Logger
-    :param content: JSON data to be included in the GET request
+    :param method: HTTP method, e.g. ``GET`` or ``POST``
+    :type method: str
+    :param content: JSON data to be included in the request
     :type content: dict
-    :param endpoint: API endpoint to which the GET request is sent (default is '/')
+    :param endpoint: API endpoint to which the request is sent (default is '/')
     :type endpoint: str
+    :param idempotent: Whether the request may be retried after a server error
+    :type idempotent: bool
     :return: API response as a dictionary. If an error occurs, returns a dictionary
         containing an error message
     :rtype: dict
     """
+    url = f"{BASE_URL}{endpoint}"
     try:
-        async with aiohttp.ClientSession() as session:
-            get_url = f"{BASE_URL}{endpoint}"
-            headers = {"Content-Type": "application/json"}
-            logger.info(f"Trying GET to URL: {get_url}")
-
-            async with session.get(get_url, json=content, headers=headers) as response:
-                if response.status == 200:
-                    response_data = await response.json()
-                    logger.info(f"API response (GET): {response_data}")
-                    return response_data
-                elif response.status == 500:
-                    status = response.status
-                    text = await response.text()
-                    logger.error(f"GET failed with status {status}: {text}")
-                    return {"error": f"API returned status {status}: {text}"}
-                else:
-                    status = response.status
-                    text = await response.text()
-                    logger.error(f"GET failed with status {status}: {text}")
-                    return {"error": f"API returned status {status}: {text}"}
+        try:
+            status, data = await api_socket.request(method, endpoint, content, idempotent, API_TIMEOUT)
+            logger.info(f"{method} {endpoint} over the API socket: status {status}")
+        except SocketUnavailableError:
+            logger.info(f"Trying {method} to URL: {url}")
+            response = await _send(session, logger, method, url, idempotent, json=content)
+            async with response:
+                status = response.status
+                data = await response.json() if status == 200 else await response.text()
+        if status == 200:
+            logger.debug(f"API response ({method}): {data}")
+            return data
+        logger.error(f"{method} failed with status {status}: {data}")
+        return {"error": f"API returned status {status}: {data}"}
     except Exception as e:
-        logger.error(f"Session creation error: {e}")
-        return {"error": f"Failed to create session: {str(e)}"}
+        logger.error(f"{method} request error: {e}")
+        return {"error": f"Failed to reach API: {str(e)}"}
+
+
+async def _get(session: aiohttp.ClientSession, logger: Logger, content: dict, endpoint: str = "/"):
+    return await _request(session, logger, "GET", content, endpoint, idempotent=True)
+
 
+async def _post(session: aiohttp.ClientSession, logger: Logger, content: dict, endpoint: str = "/"):
+    return await _request(session, logger, "POST", content, endpoint)
 
-async def _post(logger: Logger, content: dict, endpoint: str = "/"):
+
+async def query_post(session, prompt, llm, model, logger, show_thoughts=False):
+    query_payload = {
+        "content": prompt,
+        "llm": llm,
+        "model": model,
+        "show_thoughts": show_thoughts
+    }
+    return await _post(session, content=query_payload, endpoint="/query", logger=logger)
+
+
+async def attachment_post(session, attachment, logger) -> dict:
     """
-    Posts JSON content to a specified API endpoint using an asynchronous
-    HTTP session.
+    Streams a Discord attachment from the CDN to the API chunk by chunk, so the
+    file is never held in memory, and returns the processed attachment.
 
-    :param content: The JSON payload to send in the POST request.
-    :type content: json
-    :param endpoint: The endpoint path to append to the base URL for
-        the POST request.
-    :type endpoint: str
-    :param logger: The logger instance used for logging actions and
-        errors.
-    :type logger: logging.Logger
-    :return: The API response from the POST request, typically as a
-        dictionary. If the request fails, a dictionary containing an 
-        error field with the error description is returned.
+    :param attachment: A ``discord.Attachment``.
+    :return: The processed attachment, to be passed on in ``query_stream``.
     :rtype: dict
+    :raises RuntimeError: If the file is too large or the API cannot process it.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            post_url = f"{BASE_URL}{endpoint}"
-            headers = {"Content-Type": "application/json"}
-            logger.info(f"Trying POST to URL: {post_url}")
-            
-            async with session.post(post_url, json=content, headers=headers) as response:
-                if response.status == 200:
-                    response_data = await response.json()
-                    logger.info(f"API response (POST): {response_data}")
-                    return response_data
-                elif response.status == 500:
-                    status = response.status
-                    text = await response.text()
-                    logger.error(f"POST failed with status {status}: {text}")
-                    return {"error": f"API returned status {status}: {text}"}
-                else:
-                    status = response.status
-                    text = await response.text()
-                    logger.error(f"POST failed with status {status}: {text}")
-                    return {"error": f"API returned status {status}: {text}"}
-    except Exception as e:
-        logger.error(f"Session creation error: {e}")
-        return {"error": f"Failed to create session: {str(e)}"}
+    if attachment.size > API_ATTACHMENT_MAX_BYTES:
+        raise RuntimeError(f"{attachment.filename} is larger than {API_ATTACHMENT_MAX_BYTES // (1024 * 1024)} MB")
+    url = f"{BASE_URL}/attachments/"
+    logger.info(f"Streaming attachment {attachment.filename} ({attachment.size} bytes) to {url}")
+    async with session.get(attachment.url) as download:
+        if download.status != 200:
+            raise RuntimeError(f"Could not download {attachment.filename}: status {download.status}")
+        # No retries: the body is consumed as it is sent
+        async with session.post(
+            url,
+            params={"filename": attachment.filename, "content_type": attachment.content_type or ""},
+            data=download.content.iter_chunked(API_ATTACHMENT_CHUNK),
+            headers={"Content-Type": "application/octet-stream"},
+        ) as response:
+            if response.status != 200:
+                text = await response.text()
+                logger.error(f"Attachment upload failed with status {response.status}: {text}")
+                raise RuntimeError(f"API returned status {response.status}: {text}")
+            return await response.json()
 
 
-async def query_post(prompt, llm, model, logger, show_thoughts=False):
+@timed_stream(API_TTFT)
+async def query_stream(
+        session,
+        prompt,
+        llm,
+        model,
+        logger,
+        show_thoughts=False,
+        history=None,
+        summary=None,
+        user_id=None,
+        guild_id=None,
+        on_queue=None,
+        attachments=None
+        ):
+    """
+    Streams the answer of a query from the API's Server-Sent Events endpoint, over
+    the API socket when it is in use.
+
+    :param history: Earlier (role, content) turns of the conversation, oldest first.
+    :param summary: Summary of the turns that no longer fit in the history.
+    :param user_id: Discord user the query is scheduled for.
+    :param guild_id: Discord guild the query is scheduled for.
+    :param on_queue: Async callback receiving the queue position while the query waits.
+    :param attachments: Processed attachments returned by ``attachment_post``.
+    :return: An async iterator of text pieces in the order the model produced them.
+    :raises RuntimeError: If the API answers with an error status or an error event.
+    """
     query_payload = {
         "content": prompt,
         "llm": llm,
         "model": model,
-        "show_thoughts": show_thoughts
+        "show_thoughts": show_thoughts,
+        "messages": [{"role": role, "content": content} for role, content in history or []],
+        "summary": summary or None,
+        "user_id": str(user_id) if user_id else None,
+        "guild_id": str(guild_id) if guild_id else None,
+        "attachments": attachments or []
+    }
+    try:
+        pieces = api_socket.stream("POST", "/query/stream", query_payload, API_STREAM_READ_TIMEOUT)
+        status = await anext(pieces)
+        logger.info("Streaming POST to /query/stream over the API socket")
+    except SocketUnavailableError:
+        pieces = None
+    if pieces is not None:
+        try:
+            if status != 200:
+                text = "".join([piece async for piece in pieces])
+                logger.error(f"Streaming POST failed with status {status}: {text}")
+                raise RuntimeError(f"API returned status {status}: {text}")
+            async for piece in _parse_events(_lines(pieces), on_queue, logger):
+                yield piece
+        finally:
+            await pieces.aclose() # Cancels the query on the API when the caller stops early
+        return
+
+    post_url = f"{BASE_URL}/query/stream"
+    logger.info(f"Trying streaming POST to URL: {post_url}")
+    # Long generations must not hit the session's total timeout, only a read stall
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=API_CONNECT_TIMEOUT,
+        sock_read=API_STREAM_READ_TIMEOUT
+    )
+    response = await _send(session, logger, "POST", post_url, False, json=query_payload, timeout=timeout)
+    async with response:
+        if response.status != 200:
+            text = await response.text()
+            logger.error(f"Streaming POST failed with status {response.status}: {text}")
+            raise RuntimeError(f"API returned status {response.status}: {text}")
+        lines = (raw_line.decode("utf-8") async for raw_line in response.content)
+        async for piece in _parse_events(lines, on_queue, logger):
+            yield piece
+
+
+async def _lines(pieces):
+    # Socket chunks split the stream wherever the API flushed, not at line ends
+    buffer = ""
+    async for piece in pieces:
+        buffer += piece
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def _parse_events(lines, on_queue, logger):
+    """
+    Yields the text pieces of the Server-Sent Events of ``/query/stream``.
+    """
+    event = None
+    async for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data = json.loads(line[len("data:"):].strip())
+            if event == "done":
+                return
+            if event == "error":
+                logger.error(f"Streaming POST failed: {data['error']}")
+                raise RuntimeError(f"API returned status {data['status']}: {data['error']}")
+            if event == "queue":
+                if on_queue is not None:
+                    await on_queue(data["position"])
+                continue
+            yield data["content"]
+        elif not line:
+            event = None
+
+
+def _batch_payload(prompts, llm, model, max_concurrency, user_id, guild_id) -> dict:
+    return {
+        "queries": [
+            {
+                "llm": llm,
+                "model": model,
+                "user_id": str(user_id) if user_id else None,
+                "guild_id": str(guild_id) if guild_id else None,
+                "priority": 2, # Background work yields to interactive queries
+                **({"content": prompt} if isinstance(prompt, str) else prompt),
+            }
+            for prompt in prompts
+        ],
+        "max_concurrency": max_concurrency,
     }
-    return await _post(content=query_payload, endpoint="/query", logger=logger)
 
 
-async def health_get(logger, verbosity: int = 1):
-    return await _get(content={}, endpoint=f"/health/{verbosity}", logger=logger)
\ No newline at end of file
+async def query_batch(session, prompts, llm, model, logger, max_concurrency=4, user_id=None, guild_id=None) -> list[dict]:
+    """
+    Answers many prompts with one request to the API's batch endpoint.
+
+    :param prompts: Prompt strings, or dicts of ``Query`` fields for more control
+        (history, RAG, per-item model). Dict fields override ``llm`` and ``model``.
+    :param max_concurrency: Prompts generated at once for each provider and model.
+    :param user_id: Discord user the batch is scheduled for.
+    :param guild_id: Discord guild the batch is scheduled for.
+    :return: One result per prompt, in order, each with either ``response`` or
+        ``error`` and ``status``.
+    :rtype: list[dict]
+    :raises RuntimeError: If the API cannot be reached or rejects the whole batch.
+    """
+    payload = _batch_payload(prompts, llm, model, max_concurrency, user_id, guild_id)
+    url = f"{BASE_URL}/query/batch"
+    logger.info(f"Trying batch POST of {len(prompts)} prompts to URL: {url}")
+    # Nothing is sent back until the whole batch is done
+    timeout = aiohttp.ClientTimeout(total=API_BATCH_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+    response = await _send(session, logger, "POST", url, False, json=payload, timeout=timeout)
+    async with response:
+        if response.status != 200:
+            text = await response.text()
+            logger.error(f"Batch POST failed with status {response.status}: {text}")
+            raise RuntimeError(f"API returned status {response.status}: {text}")
+        return (await response.json())["results"]
+
+
+async def query_batch_stream(session, prompts, llm, model, logger, max_concurrency=4, user_id=None, guild_id=None):
+    """
+    Like ``query_batch``, but yields each result as soon as the API has it, in
+    the order they finish. Use the ``index`` of a result to match it to its prompt.
+
+    :return: An async iterator of results.
+    :raises RuntimeError: If the API cannot be reached or rejects the whole batch.
+    """
+    payload = _batch_payload(prompts, llm, model, max_concurrency, user_id, guild_id)
+    url = f"{BASE_URL}/query/batch/stream"
+    logger.info(f"Trying streaming batch POST of {len(prompts)} prompts to URL: {url}")
+    timeout = aiohttp.ClientTimeout(total=None, connect=API_CONNECT_TIMEOUT, sock_read=API_STREAM_READ_TIMEOUT)
+    response = await _send(session, logger, "POST", url, False, json=payload, timeout=timeout)
+    async with response:
+        if response.status != 200:
+            text = await response.text()
+            logger.error(f"Streaming batch POST failed with status {response.status}: {text}")
+            raise RuntimeError(f"API returned status {response.status}: {text}")
+        async for raw_line in response.content:
+            line = raw_line.strip()
+            if line:
+                yield json.loads(line)
+
+
+async def health_get(session, logger, verbosity: int = 1):
+    return await _get(session, content={}, endpoint=f"/health/{verbosity}", logger=logger)
+
+
+async def logs_search(session, logger, **filters):
+    """
+    Searches the event log through the API. ``filters`` are the fields of the API's
+    ``LogSearch``; unset ones are left out.
+
+    :return: A page with ``logs`` and ``next_cursor``, or a dictionary with an error.
+    :rtype: dict
+    """
+    content = {name: value for name, value in filters.items() if value is not None}
+    return await _request(session, logger, "POST", content, "/logs/search", idempotent=True)
+
+
+async def agent_post(
+        session,
+        prompt,
+        llm,
+        model,
+        logger,
+        history=None,
+        summary=None,
+        user_id=None,
+        guild_id=None,
+        context=None,
+        tools=None
+        ):
+    """
+    Sends a message to the API's agent, which lets the model call tools before it answers.
+
+    :param history: Earlier (role, content) turns of the conversation, oldest first.
+    :param summary: Summary of the turns that no longer fit in the history.
+    :param context: Data the tools read, e.g. ``{"game_stats": ...}``.
+    :param tools: Names of the tools the model may call, all by default.
+    :return: The answer with ``content``, ``steps``, ``tool_calls`` and a timing
+        ``trace``, or a dictionary with an error.
+    :rtype: dict
+    """
+    payload = {
+        "content": prompt,
+        "llm": llm,
+        "model": model,
+        "messages": [{"role": role, "content": content} for role, content in history or []],
+        "summary": summary or None,
+        "user_id": str(user_id) if user_id else None,
+        "guild_id": str(guild_id) if guild_id else None,
+        "context": context or {},
+        "tools": tools,
+    }
+    return await _post(session, content=payload, endpoint="/agent/", logger=logger)
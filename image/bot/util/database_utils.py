@@ -1,6 +1,293 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+
 import asyncpg
 
-async def execute(db_pool: asyncpg.Pool, query: str, *args):
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "3"))
+
+SCHEMA_LOCK = 0x6c6f6773 # Advisory lock serializing schema and partition changes between shard processes
+LOG_PARTITION_NAME = re.compile(r"^logs_p(\d{8})$")
+
+# Logs are partitioned by day so retention drops whole partitions instead of
+# deleting rows, and time-bounded searches only touch the days they cover. The
+# indexes are created on every partition; searches page backwards on (timestamp, id)
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS logs (
+        id BIGSERIAL,
+        timestamp TIMESTAMPTZ NOT NULL,
+        logger TEXT NOT NULL,
+        level TEXT NOT NULL,
+        message TEXT NOT NULL,
+        event TEXT,
+        guild_id BIGINT,
+        channel_id BIGINT,
+        user_id BIGINT,
+        fields JSONB,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT;
+    CREATE INDEX IF NOT EXISTS logs_time ON logs (timestamp DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS logs_guild_time ON logs (guild_id, timestamp DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS logs_user_time ON logs (user_id, timestamp DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS logs_level_time ON logs (level, timestamp DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS logs_message_search ON logs USING GIN (to_tsvector('simple', message));
+    CREATE TABLE IF NOT EXISTS conversation_turns (
+        id BIGSERIAL PRIMARY KEY,
+        channel_id BIGINT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS conversation_turns_channel ON conversation_turns (channel_id, id);
+    CREATE TABLE IF NOT EXISTS conversation_summaries (
+        channel_id BIGINT PRIMARY KEY,
+        summary TEXT NOT NULL
+    );
+"""
+
+# An unpartitioned logs table from before partitioning is renamed and its rows
+# within the retention period are copied into the partitioned table
+LEGACY_LOGS = """
+    ALTER TABLE logs RENAME TO logs_unpartitioned;
+    ALTER TABLE logs_unpartitioned
+        ADD COLUMN IF NOT EXISTS event TEXT,
+        ADD COLUMN IF NOT EXISTS guild_id BIGINT,
+        ADD COLUMN IF NOT EXISTS channel_id BIGINT,
+        ADD COLUMN IF NOT EXISTS user_id BIGINT,
+        ADD COLUMN IF NOT EXISTS fields JSONB;
+"""
+LEGACY_LOGS_COPY = """
+    INSERT INTO logs (timestamp, logger, level, message, event, guild_id, channel_id, user_id, fields)
+    SELECT timestamp, logger, level, message, event, guild_id, channel_id, user_id, fields
+    FROM logs_unpartitioned WHERE timestamp >= $1
+"""
+
+
+class _AcquireStats:
+    def __init__(self):
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.acquisitions += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+_acquire_stats = _AcquireStats()
+
+
+async def create_pool(dsn: str | None = None) -> asyncpg.Pool | None:
+    """
+    Creates the bot's connection pool from environment configuration.
+
+    ``DB_URL`` is the connection string. Sizes, statement cache and connection
+    lifetime limits come from the ``DB_POOL_*`` variables. Returns ``None`` when no
+    connection string is configured.
+
+    :param dsn: Connection string overriding ``DB_URL``
+    :type dsn: str or None
+    :return: The connection pool, or None if the database is not configured
+    :rtype: asyncpg.Pool or None
+    """
+    dsn = dsn or os.getenv("DB_URL")
+    if not dsn:
+        return None
+    # Queries run through the helpers below are prepared once per connection and
+    # kept in asyncpg's statement cache, so repeats skip parsing and planning
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+        max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256")),
+        max_queries=int(os.getenv("DB_POOL_MAX_QUERIES", "50000")),
+        max_inactive_connection_lifetime=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        command_timeout=float(os.getenv("DB_COMMAND_TIMEOUT", "30")),
+    )
+
+
+async def wait_until_ready(dsn: str, attempts: int = 10, delay: float = 1.0):
+    """
+    Connects and runs ``SELECT 1`` until the database answers, so the pool is not
+    created against a database that is still booting (e.g. the docker-compose Postgres).
+
+    :raises OSError, asyncpg.PostgresError: If the database is still unreachable after every attempt.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            conn = await asyncpg.connect(dsn)
+            try:
+                await conn.fetchval("SELECT 1")
+            finally:
+                await conn.close()
+            return
+        except (OSError, asyncpg.PostgresError) as e:
+            if attempt == attempts:
+                raise
+            print(f"Database not ready ({e}), retry {attempt}/{attempts}")
+            await asyncio.sleep(delay)
+
+
+async def ensure_schema(db_pool: asyncpg.Pool):
+    """
+    Creates the tables and the log partitions from yesterday to
+    ``LOG_PARTITIONS_AHEAD`` days ahead, migrating an unpartitioned logs table.
+    """
+    today = datetime.now(timezone.utc).date()
+    async with transaction(db_pool) as conn:
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+        legacy = await conn.fetchval("SELECT relkind = 'r' FROM pg_class WHERE oid = to_regclass('logs')")
+        if legacy:
+            await conn.execute(LEGACY_LOGS)
+        await conn.execute(SCHEMA)
+        if legacy:
+            since = datetime.now(timezone.utc) - timedelta(days=LOG_RETENTION_DAYS)
+            oldest = await conn.fetchval("SELECT min(timestamp) FROM logs_unpartitioned WHERE timestamp >= $1", since)
+            await _create_log_partitions(conn, oldest.date() if oldest else today, today)
+            await conn.execute(LEGACY_LOGS_COPY, since)
+            await conn.execute("DROP TABLE logs_unpartitioned")
+        await _create_log_partitions(conn, today - timedelta(days=1), today + timedelta(days=LOG_PARTITIONS_AHEAD))
+
+
+def _log_partition(day: date) -> str:
+    return f"logs_p{day:%Y%m%d}"
+
+
+async def _create_log_partitions(conn: asyncpg.Connection, first: date, last: date) -> list[str]:
+    existing = {record["name"] for record in await _log_partitions(conn)}
+    created = []
+    day = first
+    while day <= last:
+        name = _log_partition(day)
+        if name not in existing:
+            # Bounds are UTC days. Identifiers and bounds are generated here, never user input
+            await conn.execute(
+                f"CREATE TABLE {name} PARTITION OF logs "
+                f"FOR VALUES FROM ('{day.isoformat()} 00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00+00')"
+            )
+            created.append(name)
+        day += timedelta(days=1)
+    return created
+
+
+async def _log_partitions(conn: asyncpg.Connection) -> list[asyncpg.Record]:
+    return await conn.fetch(
+        "SELECT c.relname AS name FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('logs')"
+    )
+
+
+async def ensure_log_partitions(db_pool: asyncpg.Pool, first: date, last: date) -> list[str]:
+    """
+    Creates the missing daily log partitions from ``first`` to ``last``, inclusive.
+    """
+    async with transaction(db_pool) as conn:
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+        return await _create_log_partitions(conn, first, last)
+
+
+async def maintain_log_partitions(
+        db_pool: asyncpg.Pool,
+        retention_days: int = LOG_RETENTION_DAYS,
+        days_ahead: int = LOG_PARTITIONS_AHEAD,
+        ) -> dict:
+    """
+    Creates the log partitions of the coming days and drops those whose day ended
+    more than ``retention_days`` ago. Dropping a partition is instant, unlike
+    deleting its rows.
+
+    :return: The names of the created and dropped partitions.
+    :rtype: dict
+    """
+    today = datetime.now(timezone.utc).date()
+    cutoff = today - timedelta(days=retention_days)
+    async with transaction(db_pool) as conn:
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+        created = await _create_log_partitions(conn, today, today + timedelta(days=days_ahead))
+        dropped = []
+        for record in await _log_partitions(conn):
+            match = LOG_PARTITION_NAME.match(record["name"])
+            if match and datetime.strptime(match.group(1), "%Y%m%d").date() < cutoff:
+                await conn.execute(f"DROP TABLE {record['name']}")
+                dropped.append(record["name"])
+    return {"created": created, "dropped": dropped}
+
+
+@asynccontextmanager
+async def acquire(db_pool: asyncpg.Pool):
+    """
+    Acquires a connection from the pool and records how long the caller waited for it.
+    """
+    start = time.perf_counter()
     async with db_pool.acquire() as conn:
+        _acquire_stats.record(time.perf_counter() - start)
+        yield conn
+
+
+async def execute(db_pool: asyncpg.Pool, query: str, *args):
+    async with acquire(db_pool) as conn:
         await conn.execute(query, *args)
 
+
+async def fetch(db_pool: asyncpg.Pool, query: str, *args) -> list[asyncpg.Record]:
+    async with acquire(db_pool) as conn:
+        return await conn.fetch(query, *args)
+
+
+async def fetchrow(db_pool: asyncpg.Pool, query: str, *args) -> asyncpg.Record | None:
+    async with acquire(db_pool) as conn:
+        return await conn.fetchrow(query, *args)
+
+
+async def fetchval(db_pool: asyncpg.Pool, query: str, *args):
+    async with acquire(db_pool) as conn:
+        return await conn.fetchval(query, *args)
+
+
+async def copy_records(db_pool: asyncpg.Pool, table: str, records: list[tuple], columns: list[str]):
+    async with acquire(db_pool) as conn:
+        await conn.copy_records_to_table(table, records=records, columns=columns)
+
+
+async def executemany(db_pool: asyncpg.Pool, query: str, args: list[tuple]):
+    async with acquire(db_pool) as conn:
+        await conn.executemany(query, args)
+
+
+@asynccontextmanager
+async def transaction(db_pool: asyncpg.Pool):
+    """
+    Yields a connection inside a transaction that commits on exit and rolls back
+    on error.
+    """
+    async with acquire(db_pool) as conn:
+        async with conn.transaction():
+            yield conn
+
+
+def pool_stats(db_pool: asyncpg.Pool | None) -> dict:
+    """
+    Returns pool occupancy and acquire wait times for dashboards.
+    """
+    if db_pool is None:
+        return {"configured": False}
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    acquisitions = _acquire_stats.acquisitions
+    return {
+        "configured": True,
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min_size": db_pool.get_min_size(),
+        "max_size": db_pool.get_max_size(),
+        "acquisitions": acquisitions,
+        "avg_wait_ms": _acquire_stats.total_wait / acquisitions * 1000 if acquisitions else 0.0,
+        "max_wait_ms": _acquire_stats.max_wait * 1000,
+    }
@@ -1,8 +1,22 @@
 import asyncio
+import json
 import logging
-from datetime import datetime
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from util import database_utils
+from util.metrics import registry as metrics
+
+LOG_COLUMNS = ["timestamp", "logger", "level", "message", "event", "guild_id", "channel_id", "user_id", "fields"]
+ID_FIELDS = ("guild_id", "channel_id", "user_id")
+
+LOG_EVENTS_DROPPED = metrics.counter("log_events_dropped_total", "Structured log events skipped by sampling or rate limits")
+
 
 def setup_logging(
         db_pool,
@@ -13,53 +27,368 @@ def setup_logging(
         ):
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
-    db_handler = DatabaseLogHandler(db_pool=db_pool, loop=loop, table_name=table_name)
+    db_handler = DatabaseLogHandler(
+        db_pool=db_pool,
+        loop=loop,
+        table_name=table_name,
+        batch_size=int(os.getenv("LOG_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "2")),
+        max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        policy=os.getenv("LOG_QUEUE_POLICY", "drop_oldest"),
+    )
     formatter = logging.Formatter(
         fmt="[%(asctime)s] [%(levelname)s] %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S"
     )
     db_handler.setFormatter(formatter)
     logger.addHandler(db_handler)
+    db_handler.start()
+
+    json_path = os.getenv("LOG_JSONL_PATH")
+    if json_path:
+        json_handler = JsonLinesHandler(
+            json_path,
+            max_bytes=int(os.getenv("LOG_JSONL_MAX_BYTES", str(10 * 1024 * 1024))),
+            backups=int(os.getenv("LOG_JSONL_BACKUPS", "5")),
+        )
+        json_handler.setLevel(os.getenv("LOG_JSONL_LEVEL", "INFO").upper())
+        logger.addHandler(json_handler)
     return logger
-    
-    
+
+
+async def shutdown_logging(logger: logging.Logger):
+    """
+    Flushes every queued record of the logger's database handlers. Called from
+    ``DiscordBot.close`` before the database pool is closed.
+    """
+    for handler in logger.handlers:
+        if isinstance(handler, DatabaseLogHandler):
+            await handler.aclose()
+        elif isinstance(handler, JsonLinesHandler):
+            await asyncio.to_thread(handler.close)
+
+
+# ------------------------------------------------------------------------------
+# Structured events
+# ------------------------------------------------------------------------------
+
+class LogEvent:
+    """
+    The message of a structured log record. The fields are kept as given and only
+    rendered when a handler formats the record, with ``template`` when one is set
+    and as ``key=value`` pairs otherwise. Field values should be immutable (IDs,
+    names, message content) since handlers may format the record later.
+    """
+    __slots__ = ("event", "fields", "template")
+
+    def __init__(self, event: str, fields: dict, template: str | None = None):
+        self.event = event
+        self.fields = fields
+        self.template = template
+
+    def __str__(self) -> str:
+        if self.template:
+            return self.template.format_map(self.fields)
+        return " ".join([self.event, *(f"{key}={value}" for key, value in self.fields.items())])
+
+
+class EventSampler:
+    """
+    Decides which structured events are logged. ``rates`` maps an event type to the
+    fraction that is kept and ``limits`` to the most events kept per second, enforced
+    with a token bucket that allows bursts of one second's worth (at least one
+    event). The ``*`` entry
+    applies to event types without their own. Events are kept by default.
+    """
+    def __init__(self, rates: dict[str, float] | None = None, limits: dict[str, float] | None = None):
+        self.rates = rates or {}
+        self.limits = limits or {}
+        self._buckets: dict[str, list[float]] = {} # event -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "EventSampler":
+        """
+        Reads ``LOG_SAMPLE_RATES`` and ``LOG_RATE_LIMITS``, JSON objects of event type
+        to keep fraction and events per second.
+        """
+        return cls(
+            json.loads(os.getenv("LOG_SAMPLE_RATES") or "{}"),
+            json.loads(os.getenv("LOG_RATE_LIMITS") or "{}"),
+        )
+
+    def allow(self, event: str) -> bool:
+        rate = self.rates.get(event, self.rates.get("*", 1.0))
+        if rate < 1.0 and random.random() >= rate:
+            LOG_EVENTS_DROPPED.inc(event=event, reason="sampled")
+            return False
+        limit = self.limits.get(event, self.limits.get("*"))
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            burst = max(limit, 1.0)
+            bucket = self._buckets.setdefault(event, [burst, now])
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * limit)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                allowed = False
+            else:
+                bucket[0] -= 1.0
+                allowed = True
+        if not allowed:
+            LOG_EVENTS_DROPPED.inc(event=event, reason="rate_limited")
+        return allowed
+
+
+class EventLogger:
+    """
+    Logs structured events through a standard logger. Nothing is built for events
+    below the logger's level or dropped by the sampler, and the message is only
+    rendered by handlers that accept the record.
+
+        events = EventLogger(logger)
+        events.info("message", "{user}: {content}", guild_id=1, user="name", content="hi")
+    """
+    def __init__(self, logger: logging.Logger, sampler: EventSampler | None = None):
+        self.logger = logger
+        self.sampler = sampler or default_sampler
+
+    def log(self, level: int, event: str, template: str | None = None, **fields):
+        if not self.logger.isEnabledFor(level) or not self.sampler.allow(event):
+            return
+        # makeRecord and handle skip Logger.log's stack walk for the caller's
+        # file and line, which say nothing about an event
+        record = self.logger.makeRecord(
+            self.logger.name, level, "(event)", 0, LogEvent(event, fields, template), None, None
+        )
+        self.logger.handle(record)
+
+    def debug(self, event: str, template: str | None = None, **fields):
+        self.log(logging.DEBUG, event, template, **fields)
+
+    def info(self, event: str, template: str | None = None, **fields):
+        self.log(logging.INFO, event, template, **fields)
+
+    def warning(self, event: str, template: str | None = None, **fields):
+        self.log(logging.WARNING, event, template, **fields)
+
+    def error(self, event: str, template: str | None = None, **fields):
+        self.log(logging.ERROR, event, template, **fields)
+
+
+default_sampler = EventSampler.from_env()
+
+
+# ------------------------------------------------------------------------------
+# JSON lines
+# ------------------------------------------------------------------------------
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object. Structured events carry their type and
+    fields instead of a rendered message.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "logger": record.name,
+            "level": record.levelname,
+        }
+        if isinstance(record.msg, LogEvent):
+            entry["event"] = record.msg.event
+            entry["fields"] = record.msg.fields
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _EventQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare renders every message before queueing it. Events are
+        # safe to hand to the listener thread as they are, so they are formatted there
+        if isinstance(record.msg, LogEvent) and not record.exc_info:
+            return record
+        return super().prepare(record)
+
+
+class JsonLinesHandler(_EventQueueHandler):
+    """
+    Writes JSON lines to a size-rotated local file. Records are queued and both
+    formatted and written by a listener thread, so the event loop never touches
+    the disk.
+    """
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        super().__init__(queue.SimpleQueue())
+        self.file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self.file_handler.setFormatter(JsonLinesFormatter())
+        self.listener = QueueListener(self.queue, self.file_handler)
+        self.listener.start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.file_handler.close()
+        super().close()
+
+
 class DatabaseLogHandler(logging.Handler):
     """
     A custom logging handler that stores log records in the database via database_utils.
     Since Python's logging is synchronous by default but our DB functions are async,
-    we use run_coroutine_threadsafe to push work into the event loop.
+    ``emit`` only puts the record on a bounded queue. A background task on the event
+    loop drains the queue and writes records in bulk whenever ``batch_size`` records
+    are waiting or ``flush_interval`` seconds have passed.
+
+    When the queue is full, ``policy`` decides what happens: ``drop_newest`` discards
+    the new record, ``drop_oldest`` discards the oldest queued one and ``block`` makes
+    threads other than the event loop wait for space. The event loop itself can never
+    wait, so ``block`` behaves like ``drop_oldest`` there.
     """
-    def __init__(self, db_pool, loop: asyncio.AbstractEventLoop, table_name: str = "logs"):
+    def __init__(
+            self,
+            db_pool,
+            loop: asyncio.AbstractEventLoop,
+            table_name: str = "logs",
+            batch_size: int = 200,
+            flush_interval: float = 2.0,
+            max_queue: int = 10000,
+            policy: str = "drop_oldest",
+            block_timeout: float = 5.0,
+            ):
         super().__init__()
+        if policy not in ("drop_newest", "drop_oldest", "block"):
+            raise ValueError(f"Unknown log queue policy: {policy}")
         self.db_pool = db_pool
         self.loop = loop
         self.table_name = table_name
-    
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._task: asyncio.Task | None = None
+        self._batch: list[logging.LogRecord] = []
+        self._closed = False
+        self._loop_thread: int | None = None
+
+    def start(self):
+        """
+        Starts the background writer. Must be called from the event loop.
+        """
+        self._loop_thread = threading.get_ident()
+        self._task = self.loop.create_task(self._run())
+
     def emit(self, record: logging.LogRecord):
         """
-        Called automatically when a log event occurs. Formats the log message
-        and submits a database write through an async method.
+        Called automatically when a log event occurs. Queues the record for the
+        background writer without blocking; it is formatted when its batch is written.
         """
-        print(self.format(record)) # Temp logging through console
-        
-    
-    async def _write_log_to_db(self, log_time: datetime, logger_name:str, level: str, message: str):
+        try:
+            if self.db_pool is None or self._closed or self._task is None:
+                print(self.format(record)) # No database or writer, fall back to console
+                return
+            if not isinstance(record.msg, LogEvent):
+                # Plain messages may have mutable arguments, render them now
+                record.msg = record.getMessage()
+                record.args = None
+            if threading.get_ident() == self._loop_thread:
+                self._enqueue(record)
+            elif self.policy == "block":
+                future = asyncio.run_coroutine_threadsafe(self.queue.put(record), self.loop)
+                future.result(timeout=self.block_timeout)
+            else:
+                self.loop.call_soon_threadsafe(self._enqueue, record)
+        except Exception:
+            self.handleError(record)
+
+    def _enqueue(self, record: logging.LogRecord):
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(record)
+
+    def _row(self, record: logging.LogRecord) -> tuple:
+        event = record.msg if isinstance(record.msg, LogEvent) else None
+        fields = event.fields if event else {}
+        return (
+            datetime.fromtimestamp(record.created, tz=timezone.utc),
+            record.name,
+            record.levelname,
+            self.format(record),
+            event.event if event else None,
+            *(fields.get(name) for name in ID_FIELDS),
+            json.dumps(fields, default=str) if event else None,
+        )
+
+    async def _fill_batch(self):
+        # Records are collected on self._batch so aclose() can still write them
+        # if the writer is cancelled halfway through a batch
+        self._batch.append(await self.queue.get())
+        deadline = self.loop.time() + self.flush_interval
+        while len(self._batch) < self.batch_size:
+            if not self.queue.empty():
+                self._batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        while True:
+            await self._fill_batch()
+            await self._write_logs_to_db(self._batch)
+            self._batch = []
+
+    async def _write_logs_to_db(self, batch: list[logging.LogRecord]):
         """
-        An async helper method for writing a single log entry to the database.
+        An async helper method for writing a batch of log entries to the database
+        with a single COPY.
         """
-        insert_query = f"""
-            INSERT INTO {self.table_name} (timestamp, logger, level, message)
+        try:
+            rows = [self._row(record) for record in batch]
+            await database_utils.copy_records(self.db_pool, self.table_name, rows, LOG_COLUMNS)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Failed to write {len(batch)} log records: {e}")
+
+    async def aclose(self):
         """
-        await database_utils.execute(
-            self.db_pool,
-            insert_query,
-            log_time.isoformat(),
-            logger_name,
-            level,
-            message
-        )
-        
-        
-        
-    
-    
\ No newline at end of file
+        Stops the background writer and writes every record still in the queue.
+        """
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._batch:
+            await self._write_logs_to_db(self._batch)
+            self._batch = []
+        while not self.queue.empty():
+            batch = []
+            while not self.queue.empty() and len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+            await self._write_logs_to_db(batch)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import re
+from collections import deque
+from typing import Awaitable, Callable
+
+from util import database_utils
+
+Turn = tuple[str, str] # (role, content), role is "human" or "ai"
+Summarizer = Callable[[str, list[Turn]], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text, plus per-message overhead
+    return len(text) // 4 + 4
+
+
+async def extractive_summarizer(summary: str, turns: list[Turn], max_tokens: int = 300) -> str:
+    """
+    Folds turns into the running summary by keeping the first sentence of each one.
+    The oldest summary lines are dropped once the summary exceeds ``max_tokens``.
+    """
+    lines = summary.splitlines() if summary else []
+    for role, content in turns:
+        first_sentence = re.split(r"(?<=[.!?])\s", content.strip(), maxsplit=1)[0]
+        lines.append(f"{'User' if role == 'human' else 'Assistant'}: {first_sentence[:300]}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def llm_summarizer(session, llm: str, model: str, logger) -> Summarizer:
+    """
+    Returns a summarizer that asks the API to merge the turns into the running summary.
+    Falls back to the extractive summarizer if the API call fails.
+    """
+    from util.api_utils import query_post
+
+    async def summarize(summary: str, turns: list[Turn]) -> str:
+        transcript = "\n".join(f"{role}: {content}" for role, content in turns)
+        prompt = (
+            "Update the conversation summary with the new messages. "
+            "Reply with the updated summary only, in at most five sentences.\n\n"
+            f"Summary so far:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"
+        )
+        response = await query_post(session, prompt=prompt, llm=llm, model=model, logger=logger)
+        if "error" in response:
+            return await extractive_summarizer(summary, turns)
+        return response["content"]
+
+    return summarize
+
+
+class ConversationMemory:
+    """
+    Per-channel conversation history for the agent.
+
+    Each channel (threads are channels too) keeps its recent turns in a ring buffer.
+    Once the buffered turns exceed ``token_budget``, the oldest ones are folded into a
+    running summary by ``summarizer`` and removed, so every turn is summarized exactly
+    once instead of being resent in full. With a ``db_pool`` the turns and summaries
+    are also stored in Postgres and reloaded the first time a channel is used.
+    """
+    def __init__(
+            self,
+            db_pool=None,
+            max_turns: int = 50,
+            token_budget: int = 2000,
+            summarizer: Summarizer = extractive_summarizer,
+            ):
+        self.db_pool = db_pool
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self._turns: dict[int, deque[Turn]] = {}
+        self._summaries: dict[int, str] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+
+    def _lock(self, channel_id: int) -> asyncio.Lock:
+        return self._locks.setdefault(channel_id, asyncio.Lock())
+
+    async def _load(self, channel_id: int) -> deque[Turn]:
+        turns = self._turns.get(channel_id)
+        if turns is not None:
+            return turns
+        turns = self._turns[channel_id] = deque(maxlen=self.max_turns)
+        if self.db_pool is not None:
+            rows = await database_utils.fetch(
+                self.db_pool,
+                "SELECT role, content FROM conversation_turns WHERE channel_id = $1 ORDER BY id DESC LIMIT $2",
+                channel_id, self.max_turns
+            )
+            turns.extend((row["role"], row["content"]) for row in reversed(rows))
+            summary = await database_utils.fetchval(
+                self.db_pool,
+                "SELECT summary FROM conversation_summaries WHERE channel_id = $1",
+                channel_id
+            )
+            self._summaries[channel_id] = summary or ""
+        return turns
+
+    async def context(self, channel_id: int, reserve_tokens: int = 0) -> tuple[str, list[Turn]]:
+        """
+        Returns the channel's summary and the newest turns that fit in the token budget
+        after ``reserve_tokens`` are set aside for the new prompt.
+        """
+        async with self._lock(channel_id):
+            turns = await self._load(channel_id)
+            summary = self._summaries.get(channel_id, "")
+            budget = self.token_budget - reserve_tokens - estimate_tokens(summary)
+            selected: list[Turn] = []
+            for role, content in reversed(turns):
+                budget -= estimate_tokens(content)
+                if budget < 0:
+                    break
+                selected.append((role, content))
+            selected.reverse()
+            if selected and selected[0][0] == "ai":
+                selected.pop(0) # Never start on an answer whose question was cut off
+            return summary, selected
+
+    async def add(self, channel_id: int, prompt: str, response: str):
+        """
+        Records one exchange and folds the oldest turns into the summary if the
+        history no longer fits the token budget.
+        """
+        async with self._lock(channel_id):
+            turns = await self._load(channel_id)
+            new_turns = [("human", prompt), ("ai", response)]
+            overflow = [turns[i] for i in range(max(0, len(turns) + len(new_turns) - self.max_turns))]
+            turns.extend(new_turns)
+            if self.db_pool is not None:
+                await database_utils.executemany(
+                    self.db_pool,
+                    "INSERT INTO conversation_turns (channel_id, role, content) VALUES ($1, $2, $3)",
+                    [(channel_id, role, content) for role, content in new_turns]
+                )
+
+            folded = list(overflow)
+            while len(turns) > 2 and sum(estimate_tokens(content) for _, content in turns) > self.token_budget:
+                folded.append(turns.popleft())
+            if folded:
+                await self._fold(channel_id, folded)
+
+    async def _fold(self, channel_id: int, folded: list[Turn]):
+        summary = await self.summarizer(self._summaries.get(channel_id, ""), folded)
+        self._summaries[channel_id] = summary
+        if self.db_pool is not None:
+            async with database_utils.transaction(self.db_pool) as conn:
+                await conn.execute("""
+                    DELETE FROM conversation_turns WHERE id IN (
+                        SELECT id FROM conversation_turns WHERE channel_id = $1 ORDER BY id LIMIT $2
+                    )
+                """, channel_id, len(folded))
+                await conn.execute("""
+                    INSERT INTO conversation_summaries (channel_id, summary) VALUES ($1, $2)
+                    ON CONFLICT (channel_id) DO UPDATE SET summary = EXCLUDED.summary
+                """, channel_id, summary)
+
+    async def clear(self, channel_id: int):
+        async with self._lock(channel_id):
+            self._turns.pop(channel_id, None)
+            self._summaries.pop(channel_id, None)
+            if self.db_pool is not None:
+                async with database_utils.transaction(self.db_pool) as conn:
+                    await conn.execute("DELETE FROM conversation_turns WHERE channel_id = $1", channel_id)
+                    await conn.execute("DELETE FROM conversation_summaries WHERE channel_id = $1", channel_id)
+
+
+def create_memory(db_pool=None) -> ConversationMemory:
+    return ConversationMemory(
+        db_pool=db_pool if os.getenv("MEMORY_PERSIST", "true").lower() == "true" else None,
+        max_turns=int(os.getenv("MEMORY_MAX_TURNS", "50")),
+        token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", "2000")),
+    )
@@ -1,23 +1,332 @@
+import asyncio
+import io
+import os
+import re
 import textwrap
+import time
+from contextlib import asynccontextmanager
 
+import discord
 
+from util.metrics import registry as metrics, timed
 
+DISCORD_SEND_LATENCY = metrics.histogram("discord_send_duration_seconds", "Discord message sends and edits")
+DISCORD_SEND_ERRORS = metrics.counter("discord_send_errors_total", "Discord message sends and edits that failed")
+DISCORD_SEND_WAIT = metrics.histogram(
+    "discord_send_wait_seconds",
+    "Time sends and edits were held back to stay within Discord's rate limits"
+)
+DISCORD_FILE_FALLBACKS = metrics.counter("discord_file_fallbacks_total", "Answers sent as a file instead of messages")
 
-def format_text(message: str,  max_length: int = 1900) -> list[str]:
+DISCORD_MAX_LENGTH = 2000
+# Answers longer than this are sent as a preview plus a file, instead of many messages
+DISCORD_FILE_THRESHOLD = int(os.getenv("DISCORD_FILE_THRESHOLD", "6000"))
+# Discord allows 5 messages per 5 seconds in a channel and 50 requests per second per bot
+DISCORD_CHANNEL_RATE = float(os.getenv("DISCORD_CHANNEL_RATE", "1"))
+DISCORD_CHANNEL_BURST = int(os.getenv("DISCORD_CHANNEL_BURST", "5"))
+DISCORD_GLOBAL_RATE = float(os.getenv("DISCORD_GLOBAL_RATE", "50"))
+
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+
+# ------------------------------------------------------------------------------
+# Splitting
+# ------------------------------------------------------------------------------
+
+def _blocks(text: str) -> list[tuple[str, str | None, bool]]:
+    """
+    Splits markdown into paragraphs and fenced code blocks.
+
+    :return: ``(text, opening fence line, closed)`` per block. The fence line is
+        None for paragraphs. A code block still open at the end of the text, as
+        while streaming, is not closed.
+    """
+    blocks = []
+    paragraph: list[str] = []
+
+    def flush():
+        if paragraph:
+            blocks.append(("\n".join(paragraph), None, True))
+            paragraph.clear()
+
+    lines = text.split("\n")
+    i = 0
+    while i < len(lines):
+        match = FENCE.match(lines[i])
+        if match:
+            flush()
+            marker = match.group(1)
+            code = [lines[i]]
+            closed = False
+            i += 1
+            while i < len(lines):
+                code.append(lines[i])
+                i += 1
+                stripped = code[-1].strip()
+                if stripped.startswith(marker) and not stripped.strip(marker[0]):
+                    closed = True
+                    break
+            blocks.append(("\n".join(code), code[0], closed))
+        elif lines[i].strip():
+            paragraph.append(lines[i])
+            i += 1
+        else:
+            flush()
+            i += 1
+    flush()
+    return blocks
+
+
+def _pack(parts: list[str], max_length: int, separator: str) -> list[str]:
     chunks: list[str] = []
-    for paragraph in message.split("\n\n"):
-        if len(paragraph) <= max_length:
-            chunks.append(paragraph)
+    for part in parts:
+        if chunks and len(chunks[-1]) + len(separator) + len(part) <= max_length:
+            chunks[-1] += separator + part
         else:
-            chunks.extend(textwrap.wrap(paragraph,
-                                        width=max_length,
-                                        break_long_words=False,
-                                        break_on_hyphens=False))
+            chunks.append(part)
     return chunks
 
+
+def _split_lines(lines: list[str], max_length: int) -> list[str]:
+    parts = []
+    for line in lines:
+        if len(line) <= max_length:
+            parts.append(line)
+        else:
+            parts.extend(textwrap.wrap(line, width=max_length, break_on_hyphens=False, replace_whitespace=False))
+    return _pack(parts, max_length, "\n")
+
+
+def _pieces(text: str, max_length: int) -> list[str]:
+    """
+    Cuts text into pieces of at most ``max_length`` characters. Code blocks that
+    do not fit are cut between lines, and every piece of them is fenced again, so
+    no message ends inside a code block.
+    """
+    pieces = []
+    for block, fence, closed in _blocks(text):
+        if fence is None:
+            pieces.extend(_split_lines(block.split("\n"), max_length))
+            continue
+        closer = FENCE.match(fence).group(1)
+        lines = block.split("\n")[1:]
+        if closed:
+            lines = lines[:-1]
+        if len(block) <= max_length and closed:
+            pieces.append(block)
+            continue
+        budget = max_length - len(fence) - len(closer) - 2
+        for body in _split_lines(lines, budget) or [""]:
+            pieces.append(f"{fence}\n{body}\n{closer}")
+    return pieces
+
+
+def format_text(message: str, max_length: int = DISCORD_MAX_LENGTH) -> list[str]:
+    """
+    Splits an answer into as few Discord messages as possible. Paragraphs and code
+    blocks are packed into messages of up to ``max_length`` characters. Larger
+    ones are cut on line, then word boundaries, and code blocks are closed and
+    reopened around every cut.
+    """
+    return _pack(_pieces(message, max_length), max_length, "\n\n")
+
+
+# ------------------------------------------------------------------------------
+# Sending
+# ------------------------------------------------------------------------------
+
+class TokenBucket:
+    """
+    A rate limit of ``rate`` calls per second with bursts of ``burst`` calls.
+    Callers reserve a call and wait for the returned delay, so waiting callers
+    are served in the order they asked.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class SendScheduler:
+    """
+    Orders and paces everything the bot sends to a channel.
+
+    Each channel has a FIFO lock and a token bucket matching Discord's per-channel
+    limit. Messages sent while holding the lock, such as all chunks of a sent
+    answer or each update of a streamed one, are not interleaved with other
+    messages to the channel. A global bucket keeps the whole process under the
+    bot-wide limit. Pacing before each call avoids running into 429 responses and
+    discord.py's retry sleeps.
+    """
+    def __init__(
+            self,
+            rate: float = DISCORD_CHANNEL_RATE,
+            burst: int = DISCORD_CHANNEL_BURST,
+            global_rate: float = DISCORD_GLOBAL_RATE,
+            ):
+        self.rate = rate
+        self.burst = burst
+        self._global = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._buckets: dict[int, TokenBucket] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._users: dict[int, int] = {}
+
+    async def pace(self, channel_id: int):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            if len(self._buckets) > 1024:
+                # A full bucket carries no state, so idle ones can go
+                self._buckets = {key: value for key, value in self._buckets.items() if not value.idle()}
+            bucket = self._buckets[channel_id] = TokenBucket(self.rate, self.burst)
+        delay = max(bucket.reserve(), self._global.reserve())
+        if delay > 0:
+            DISCORD_SEND_WAIT.observe(delay)
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def channel(self, channel_id: int):
+        """
+        Holds the channel's turn. Sends made inside are paced but not reordered.
+        """
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        self._users[channel_id] = self._users.get(channel_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[channel_id] -= 1
+            if not self._users[channel_id]:
+                del self._users[channel_id]
+                del self._locks[channel_id]
+
+    async def send(self, ctx, content: str, file: discord.File | None = None):
+        async with self.channel(ctx.channel.id):
+            await self.pace(ctx.channel.id)
+            return await _send(ctx, content, file)
+
+    async def send_many(self, ctx, chunks: list[str]) -> list:
+        async with self.channel(ctx.channel.id):
+            messages = []
+            for chunk in chunks:
+                await self.pace(ctx.channel.id)
+                messages.append(await _send(ctx, chunk))
+            return messages
+
+    async def edit(self, message, content: str):
+        async with self.channel(message.channel.id):
+            await self.pace(message.channel.id)
+            return await _edit(message, content)
+
+    def stats(self) -> dict:
+        return {"channels": len(self._buckets), "busy_channels": len(self._locks)}
+
+
+sender = SendScheduler()
+
+
+@timed(DISCORD_SEND_LATENCY, {"op": "send"}, errors=DISCORD_SEND_ERRORS)
+async def _send(ctx, content: str, file: discord.File | None = None):
+    if file is not None:
+        return await ctx.send(content, file=file)
+    return await ctx.send(content)
+
+
+@timed(DISCORD_SEND_LATENCY, {"op": "edit"}, errors=DISCORD_SEND_ERRORS)
+async def _edit(message, content: str):
+    return await message.edit(content=content)
+
+
+def _answer_file(text: str) -> discord.File:
+    return discord.File(io.BytesIO(text.encode("utf-8")), filename="answer.md")
+
+
 async def send_message(ctx, message, logger):
-   content = message["content"]
-   logger.info(f"Message length: {len(content)}")
-   
-   for chunk in format_text(content):
-       await ctx.send(chunk)
\ No newline at end of file
+    """
+    Sends an answer in as few messages as possible. Answers over
+    ``DISCORD_FILE_THRESHOLD`` characters are sent as their first message with the
+    full text attached, in a single call.
+    """
+    content = message["content"]
+    logger.info(f"Message length: {len(content)}")
+    chunks = format_text(content)
+    if len(content) > DISCORD_FILE_THRESHOLD and len(chunks) > 1:
+        DISCORD_FILE_FALLBACKS.inc()
+        await sender.send(ctx, chunks[0], _answer_file(content))
+    else:
+        await sender.send_many(ctx, chunks)
+
+
+async def _sync_messages(ctx, messages: list, shown: list[str], chunks: list[str]):
+    """
+    Edits and sends messages until they show ``chunks``. The caller holds the
+    channel's turn, so the messages added by one update follow each other.
+    """
+    for i, chunk in enumerate(chunks):
+        if i < len(messages):
+            if shown[i] != chunk:
+                await sender.pace(ctx.channel.id)
+                await _edit(messages[i], chunk)
+                shown[i] = chunk
+        else:
+            await sender.pace(ctx.channel.id)
+            messages.append(await _send(ctx, chunk))
+            shown.append(chunk)
+
+
+async def stream_message(
+        ctx,
+        stream,
+        logger,
+        max_length: int = DISCORD_MAX_LENGTH,
+        edit_interval: float = 1.0,
+        file_threshold: int = DISCORD_FILE_THRESHOLD,
+        ) -> str:
+    """
+    Sends a streamed answer to Discord as it arrives.
+
+    The text is split with ``format_text`` after each update. Chunks that already
+    have a message are edited in place and new chunks are sent as new messages.
+    Discord is updated at most once per ``edit_interval`` seconds, plus once at the end.
+    At most ``file_threshold // max_length`` messages are shown; a longer answer is
+    then sent in full as a file.
+
+    :param ctx: Invocation context of the command.
+    :param stream: Async iterator of text pieces.
+    :param logger: Logger instance.
+    :param max_length: Maximum length of each Discord message.
+    :param edit_interval: Minimum number of seconds between two updates.
+    :param file_threshold: Length above which the full answer is attached as a file.
+    :return: The full text that was streamed.
+    :rtype: str
+    """
+    text = ""
+    messages = []
+    shown: list[str] = []
+    last_update = 0.0
+    live = max(1, file_threshold // max_length)
+    async for piece in stream:
+        text += piece
+        if time.monotonic() - last_update >= edit_interval:
+            async with sender.channel(ctx.channel.id):
+                await _sync_messages(ctx, messages, shown, format_text(text, max_length)[:live])
+            last_update = time.monotonic()
+    chunks = format_text(text, max_length)
+    async with sender.channel(ctx.channel.id):
+        await _sync_messages(ctx, messages, shown, chunks[:live])
+        if len(chunks) > live:
+            DISCORD_FILE_FALLBACKS.inc()
+            await sender.pace(ctx.channel.id)
+            await _send(ctx, f"Full answer ({len(text)} characters) attached", _answer_file(text))
+    logger.info(f"Message length: {len(text)}")
+    return text
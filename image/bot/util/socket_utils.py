@@ -0,0 +1,293 @@
+import asyncio
+import itertools
+import json
+import re
+from logging import Logger
+from typing import Callable
+
+import aiohttp
+
+from util.metrics import registry as metrics
+
+WS_RECONNECTS = metrics.counter("api_socket_reconnects_total", "API socket reconnections, by whether the session resumed")
+
+TERMINAL = {"result", "end", "error"}
+ACK_EVERY = 32
+
+
+class SocketUnavailableError(ConnectionError):
+    """
+    The socket is not in use or not connected, and the request was not sent.
+    """
+    pass
+
+
+def codec(encoding: str):
+    """
+    Returns ``(encode, decode)`` for a frame encoding: ``msgpack`` frames are
+    binary, ``json`` frames are text and use orjson when it is installed.
+    """
+    if encoding == "msgpack":
+        import msgpack
+        return msgpack.packb, lambda data: msgpack.unpackb(data, raw=False)
+    try:
+        import orjson
+        return lambda frame: orjson.dumps(frame).decode(), orjson.loads
+    except ImportError:
+        return lambda frame: json.dumps(frame, separators=(",", ":")), json.loads
+
+
+class _Pending:
+    def __init__(self, frame: dict, idempotent: bool):
+        self.frame = frame
+        self.idempotent = idempotent
+        self.frames: asyncio.Queue = asyncio.Queue()
+        self.received = False
+        self.done = False
+
+
+class ApiSocket:
+    """
+    One persistent WebSocket to the API that carries every request the bot makes.
+
+    Requests are tagged with an ID, so any number of them share the connection and
+    their responses, streamed or not, arrive interleaved. A dropped connection is
+    reopened with backoff and resumes the API side session: requests keep running,
+    missed frames are replayed and requests that never arrived are resent. If the
+    session could not be resumed, idempotent requests that got no answer yet are
+    resent and the others fail.
+    """
+    def __init__(
+            self,
+            base_url: str | None,
+            encoding: str,
+            backoff: Callable[[int], float],
+            connect_wait: float = 5.0,
+            heartbeat: float = 30.0,
+            ):
+        self.url = re.sub(r"^http", "ws", base_url or "") + "/ws/"
+        self.encoding = encoding
+        self.encode, self.decode = codec(encoding)
+        self.backoff = backoff
+        self.connect_wait = connect_wait
+        self.heartbeat = heartbeat
+        self.session_id: str | None = None
+        self.last_seq = 0
+        self.started = False
+        self._ids = itertools.count(1)
+        self._pending: dict[str, _Pending] = {}
+        self._ws = None
+        self._connected = asyncio.Event()
+        self._runner: asyncio.Task | None = None
+        self._unacked = 0
+        self.reconnects = 0
+        self.logger: Logger | None = None
+
+    def start(self, session: aiohttp.ClientSession, logger: Logger):
+        self.logger = logger
+        self.started = True
+        self._runner = asyncio.create_task(self._run(session))
+
+    async def close(self):
+        self.started = False
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+        for pending in self._pending.values():
+            pending.frames.put_nowait({"type": "error", "data": {"status": 503, "error": "The API socket was closed"}})
+
+    async def _run(self, session: aiohttp.ClientSession):
+        attempt = 0
+        while True:
+            try:
+                ws = await session.ws_connect(
+                    self.url,
+                    params={"session": self.session_id or "", "last_seq": self.last_seq, "encoding": self.encoding},
+                    heartbeat=self.heartbeat,
+                    max_msg_size=0,
+                )
+            except (aiohttp.ClientError, OSError) as e:
+                delay = self.backoff(attempt)
+                attempt += 1
+                self.logger.warning(f"API socket could not connect ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            broken = False
+            try:
+                await self._serve(ws)
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"API socket failed: {e}")
+            except Exception:
+                # A bad frame must not end the runner, or every request would wait
+                # connect_wait before falling back to HTTP
+                self.logger.exception("API socket failed on an unexpected error")
+                broken = True
+            finally:
+                established = self._connected.is_set()
+                self._connected.clear()
+                self._ws = None
+                await ws.close()
+            if established and not broken:
+                attempt = 0
+                self.logger.warning("API socket disconnected, reconnecting")
+                continue
+            # Closed before its hello or broken by a frame that may be replayed, so back off
+            delay = self.backoff(attempt)
+            attempt += 1
+            self.logger.warning(f"API socket disconnected, reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _serve(self, ws):
+        message = await ws.receive()
+        if message.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+            raise aiohttp.ClientError(f"Expected a hello frame, got a {message.type.name} message")
+        hello = self.decode(message.data)
+        if hello.get("type") != "hello":
+            raise aiohttp.ClientError(f"Expected a hello frame, got {hello.get('type')}")
+        resumed = hello["data"]["resumed"]
+        known = set(hello["data"]["known"])
+        if self.session_id is not None:
+            self.reconnects += 1
+            WS_RECONNECTS.inc(resumed=str(resumed).lower())
+        if not resumed:
+            self.last_seq = 0 # A new session numbers its frames from the start
+        self.session_id = hello["data"]["session"]
+        self._ws = ws
+        self._unacked = 0
+        for request_id, pending in list(self._pending.items()):
+            if pending.done or request_id in known:
+                continue
+            if resumed or (pending.idempotent and not pending.received):
+                await self._write(pending.frame)
+            else:
+                pending.done = True
+                pending.frames.put_nowait({
+                    "type": "error",
+                    "data": {"status": 503, "error": "The API connection was lost while the request ran"},
+                })
+        self._connected.set()
+        async for message in ws:
+            if message.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                break # Closed or failed
+            await self._receive(self.decode(message.data))
+
+    async def _receive(self, frame: dict):
+        if frame["seq"] <= self.last_seq:
+            return # Replayed twice around a reconnect
+        self.last_seq = frame["seq"]
+        pending = self._pending.get(frame["id"])
+        if pending is not None:
+            pending.received = True
+            pending.done = frame["type"] in TERMINAL
+            pending.frames.put_nowait(frame)
+        self._unacked += 1
+        if frame["type"] in TERMINAL or self._unacked >= ACK_EVERY:
+            self._unacked = 0
+            await self._write({"op": "ack", "seq": self.last_seq})
+
+    async def _write(self, frame: dict):
+        data = self.encode(frame)
+        if isinstance(data, bytes):
+            await self._ws.send_bytes(data)
+        else:
+            await self._ws.send_str(data)
+
+    async def _submit(self, method: str, path: str, body, idempotent: bool) -> str:
+        if not self.started:
+            raise SocketUnavailableError("The API socket is not in use")
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=self.connect_wait)
+        except asyncio.TimeoutError:
+            raise SocketUnavailableError(f"The API socket did not connect within {self.connect_wait}s")
+        request_id = str(next(self._ids))
+        frame = {"op": "call", "id": request_id, "method": method, "path": path, "body": body}
+        self._pending[request_id] = _Pending(frame, idempotent)
+        try:
+            await self._write(frame)
+        except (aiohttp.ClientError, ConnectionError, AttributeError):
+            pass # Resent once the socket reconnects
+        return request_id
+
+    async def _cancel(self, request_id: str):
+        pending = self._pending.pop(request_id, None)
+        if pending is not None and not pending.done and self._connected.is_set():
+            try:
+                await self._write({"op": "cancel", "id": request_id})
+            except (aiohttp.ClientError, ConnectionError):
+                pass
+
+    async def request(self, method: str, path: str, body=None, idempotent: bool = False, timeout: float | None = None):
+        """
+        Sends one request and waits for the whole response.
+
+        :return: The status and the decoded body.
+        :rtype: tuple[int, object]
+        :raises SocketUnavailableError: If the socket is not in use or not connected.
+        :raises RuntimeError: If the connection was lost and the request cannot be resent.
+        :raises asyncio.TimeoutError: If no response arrives within ``timeout`` seconds.
+        """
+        request_id = await self._submit(method, path, body, idempotent)
+        pending = self._pending[request_id]
+
+        async def response():
+            frame = await pending.frames.get()
+            if frame["type"] == "result":
+                return frame["data"]["status"], frame["data"]["body"]
+            if frame["type"] == "error":
+                return frame["data"]["status"], frame["data"]["error"]
+            status = frame["data"]["status"] # A streamed response, collected whole
+            parts = []
+            while (frame := await pending.frames.get())["type"] == "chunk":
+                parts.append(frame["data"])
+            if frame["type"] == "error":
+                raise RuntimeError(frame["data"]["error"])
+            return status, "".join(parts)
+
+        try:
+            return await asyncio.wait_for(response(), timeout=timeout)
+        finally:
+            await self._cancel(request_id)
+
+    async def stream(self, method: str, path: str, body=None, read_timeout: float | None = None):
+        """
+        Sends one request and yields its response as it arrives: the status first,
+        then every piece of the body. A complete (not streamed) response is yielded
+        as one piece.
+
+        :raises SocketUnavailableError: If the socket is not in use or not connected.
+        :raises RuntimeError: If the connection was lost while the response streamed.
+        :raises asyncio.TimeoutError: If nothing arrives for ``read_timeout`` seconds.
+        """
+        request_id = await self._submit(method, path, body, False)
+        pending = self._pending[request_id]
+        try:
+            while True:
+                frame = await asyncio.wait_for(pending.frames.get(), timeout=read_timeout)
+                kind = frame["type"]
+                if kind == "start":
+                    yield frame["data"]["status"]
+                elif kind == "chunk":
+                    yield frame["data"]
+                elif kind == "result":
+                    body = frame["data"]["body"]
+                    yield frame["data"]["status"]
+                    yield body if isinstance(body, str) else json.dumps(body)
+                    return
+                elif kind == "end":
+                    return
+                else:
+                    raise RuntimeError(frame["data"]["error"])
+        finally:
+            await self._cancel(request_id)
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "connected": self._connected.is_set(),
+            "encoding": self.encoding,
+            "pending": len(self._pending),
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,170 @@
+import json
+import math
+import os
+import time
+
+from discord.ext import commands
+
+
+class MemoryState:
+    """
+    In-process stand-in for ``redis.asyncio.Redis`` implementing the subset of
+    commands the bot uses, with the same signatures and ``decode_responses=True``
+    semantics (values come back as strings). Expired keys are dropped lazily.
+
+    It is only shared inside one process, so shard clusters need ``REDIS_URL``.
+    """
+    def __init__(self):
+        self._data: dict[str, object] = {}
+        self._expires: dict[str, float] = {}
+
+    def _alive(self, name: str) -> bool:
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    async def get(self, name: str) -> str | None:
+        return self._data.get(name) if self._alive(name) else None
+
+    async def set(self, name: str, value, ex: float | None = None, px: int | None = None, nx: bool = False):
+        if nx and self._alive(name):
+            return None
+        self._data[name] = str(value)
+        self._expires.pop(name, None)
+        if ex is not None:
+            self._expires[name] = time.monotonic() + ex
+        elif px is not None:
+            self._expires[name] = time.monotonic() + px / 1000
+        return True
+
+    async def incr(self, name: str, amount: int = 1) -> int:
+        value = int(self._data.get(name, 0) if self._alive(name) else 0) + amount
+        self._data[name] = str(value) # Keeps the expiry, like Redis
+        return value
+
+    async def pexpire(self, name: str, time_ms: int) -> bool:
+        if not self._alive(name):
+            return False
+        self._expires[name] = time.monotonic() + time_ms / 1000
+        return True
+
+    async def pttl(self, name: str) -> int:
+        if not self._alive(name):
+            return -2
+        expires = self._expires.get(name)
+        return -1 if expires is None else math.ceil((expires - time.monotonic()) * 1000)
+
+    async def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._alive(name):
+                del self._data[name]
+                self._expires.pop(name, None)
+                deleted += 1
+        return deleted
+
+    async def hset(self, name: str, key: str | None = None, value=None, mapping: dict | None = None) -> int:
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        current = self._data.get(name) if self._alive(name) else None
+        if current is None:
+            current = self._data[name] = {}
+        added = sum(1 for field in fields if field not in current)
+        current.update({str(field): str(value) for field, value in fields.items()})
+        return added
+
+    async def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        current = self._data.get(name) if self._alive(name) else None
+        if current is None:
+            current = self._data[name] = {}
+        value = int(current.get(key, 0)) + amount
+        current[key] = str(value)
+        return value
+
+    async def hgetall(self, name: str) -> dict[str, str]:
+        return dict(self._data.get(name, {})) if self._alive(name) else {}
+
+    async def hdel(self, name: str, *keys: str) -> int:
+        current = self._data.get(name) if self._alive(name) else None
+        if not current:
+            return 0
+        return sum(1 for key in keys if current.pop(key, None) is not None)
+
+    async def aclose(self):
+        pass
+
+
+def create_state():
+    """
+    Returns the state backend shared by every shard: Redis when ``REDIS_URL`` is
+    set, otherwise the in-process ``MemoryState``.
+    """
+    url = os.getenv("REDIS_URL")
+    if not url:
+        return MemoryState()
+    import redis.asyncio as redis
+    return redis.from_url(url, decode_responses=True)
+
+
+async def hit(state, key: str, rate: int, per: float) -> float:
+    """
+    Counts one use in a fixed window of ``per`` seconds.
+
+    :return: 0 if the use is allowed, otherwise the seconds until the window resets.
+    :rtype: float
+    """
+    window = max(1, int(per * 1000))
+    count = await state.incr(key)
+    if count == 1:
+        await state.pexpire(key, window)
+    if count <= rate:
+        return 0.0
+    remaining = await state.pttl(key)
+    if remaining < 0: # The expiry was lost, e.g. the first caller died in between
+        await state.pexpire(key, window)
+        remaining = window
+    return remaining / 1000
+
+
+def shared_cooldown(rate: int, per: float, bucket: commands.BucketType = commands.BucketType.default):
+    """
+    Like ``commands.cooldown``, but the counters live in ``bot.state`` so every shard
+    process enforces the same limit.
+
+    :raises commands.CommandOnCooldown: If the bucket used up its ``rate`` in the window.
+    """
+    async def predicate(ctx) -> bool:
+        key = f"cooldown:{ctx.command.qualified_name}:{bucket.name}:{bucket.get_key(ctx.message)}"
+        retry_after = await hit(ctx.bot.state, key, rate, per)
+        if retry_after:
+            raise commands.CommandOnCooldown(commands.Cooldown(rate, per), retry_after, bucket)
+        return True
+    return commands.check(predicate)
+
+
+async def report_shard(state, shard_id: int, status: dict):
+    await state.hset("shards", str(shard_id), json.dumps({**status, "updated": time.time()}))
+
+
+async def shard_statuses(state) -> dict[int, dict]:
+    return {int(shard_id): json.loads(status) for shard_id, status in (await state.hgetall("shards")).items()}
+
+
+
+async def record_game(state, user_id: int, game: str, outcome: str):
+    await state.hincrby(f"games:{user_id}", f"{game}:{outcome}")
+
+
+async def game_stats(state, user_id: int) -> dict[str, dict[str, int]]:
+    """
+    :return: The user's count of each outcome per game, e.g. ``{"rps": {"win": 3, "tie": 1}}``.
+    :rtype: dict
+    """
+    stats: dict[str, dict[str, int]] = {}
+    for field, count in (await state.hgetall(f"games:{user_id}")).items():
+        game, outcome = field.split(":", 1)
+        stats.setdefault(game, {})[outcome] = int(count)
+    return stats